@@ -0,0 +1,81 @@
+import sys
+import time
+import tempfile
+from quiz_dataset_tools.util.language import TextLocalization, TextLocalizations
+from quiz_dataset_tools.prebuild.dbase import PrebuildDBase
+from quiz_dataset_tools.prebuild.types import (
+    PrebuildAnswer,
+    PrebuildQuestion,
+    PrebuildTest,
+    PrebuildText,
+)
+
+
+QUESTIONS_COUNT = 2000
+ANSWERS_COUNT = 4
+REPEAT = 3
+
+
+def make_text(text_id: int, content: str) -> PrebuildText:
+    return PrebuildText(
+        text_id=text_id,
+        localizations=TextLocalizations(
+            EN=TextLocalization(content),
+            FR=TextLocalization(f"FR {content}"),
+            ES=TextLocalization(f"ES {content}"),
+            RU=TextLocalization(f"RU {content}"),
+            ZH=TextLocalization(f"ZH {content}"),
+        ),
+    )
+
+
+def populate(dbase: PrebuildDBase, questions_count: int) -> None:
+    with dbase.unit_of_work():
+        dbase.add_test(PrebuildTest(test_id=1, title=make_text(1, "Test")))
+        for question_id in range(1, questions_count + 1):
+            text_id = question_id * 10
+            dbase.add_question(
+                PrebuildQuestion(
+                    test_id=1,
+                    question_id=question_id,
+                    text=make_text(text_id, f"Question {question_id}"),
+                    comment_text=make_text(text_id + 9, f"Comment {question_id}"),
+                    answers=[
+                        PrebuildAnswer(
+                            text=make_text(text_id + i + 1, f"Answer {i}"),
+                            is_right_answer=i == 0,
+                        )
+                        for i in range(ANSWERS_COUNT)
+                    ],
+                )
+            )
+
+
+def measure(name: str, func) -> float:
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    assert best is not None
+    print(f"{name:<20} {best * 1000:8.1f} ms")
+    return best
+
+
+def main() -> None:
+    questions_count = int(sys.argv[1]) if len(sys.argv) > 1 else QUESTIONS_COUNT
+    with tempfile.TemporaryDirectory() as data_dir:
+        dbase = PrebuildDBase(data_dir)
+        dbase.bootstrap()
+        populate(dbase, questions_count)
+        assert dbase.get_questions() == dbase.read_questions()
+        print(f"Questions: {questions_count}, answers per question: {ANSWERS_COUNT}")
+        orm_time = measure("get_questions (ORM)", dbase.get_questions)
+        core_time = measure("read_questions", dbase.read_questions)
+        print(f"Speedup: {orm_time / core_time:.1f}x")
+        dbase.close()
+
+
+if __name__ == "__main__":
+    main()
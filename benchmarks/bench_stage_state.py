@@ -0,0 +1,139 @@
+import sys
+import copy
+import time
+import tracemalloc
+from quiz_dataset_tools.util.language import (
+    Language,
+    TextLocalization,
+    TextLocalizations,
+)
+from quiz_dataset_tools.prebuild.stage import (
+    DataUpdateBaseStage,
+    StageState,
+    VerificationStage,
+)
+from quiz_dataset_tools.prebuild.types import (
+    PrebuildAnswer,
+    PrebuildQuestion,
+    PrebuildTest,
+    PrebuildText,
+)
+
+
+QUESTIONS_COUNT = 2000
+ANSWERS_COUNT = 4
+# Every N-th question is changed by the update stage
+CHANGE_RATE = 10
+
+
+def make_text(text_id: int, content: str) -> PrebuildText:
+    return PrebuildText(
+        text_id=text_id,
+        localizations=TextLocalizations(
+            EN=TextLocalization(content, text_id * 10 + 1),
+            FR=TextLocalization(f"FR {content}", text_id * 10 + 2),
+            ES=TextLocalization(f"ES {content}", text_id * 10 + 3),
+            RU=TextLocalization(f"RU {content}", text_id * 10 + 4),
+            ZH=TextLocalization(f"ZH {content}", text_id * 10 + 5),
+        ),
+        original=TextLocalizations(EN=TextLocalization(content)),
+    )
+
+
+def make_state(questions_count: int) -> StageState:
+    questions = []
+    for question_id in range(1, questions_count + 1):
+        text_id = question_id * 10
+        questions.append(
+            PrebuildQuestion(
+                test_id=1,
+                question_id=question_id,
+                text=make_text(text_id, f"Question {question_id}"),
+                comment_text=make_text(text_id + 9, f"Comment {question_id}"),
+                answers=[
+                    PrebuildAnswer(
+                        answer_id=text_id + i,
+                        question_id=question_id,
+                        text=make_text(text_id + i + 1, f"Answer {i}"),
+                        is_right_answer=i == 0,
+                    )
+                    for i in range(ANSWERS_COUNT)
+                ],
+            )
+        )
+    state = StageState(
+        tests=[PrebuildTest(test_id=1, title=make_text(1, "Test"))],
+        questions=questions,
+        text_warnings=[],
+    )
+    state.track_changes()
+    return state
+
+
+class SparseUpdateStage(DataUpdateBaseStage):
+    def update_question(self, question: PrebuildQuestion) -> None:
+        if question.question_id % CHANGE_RATE == 0:
+            question.text.localizations.set(Language.FR, "updated")
+
+
+class LegacyUpdateStage(SparseUpdateStage):
+    # The deepcopy based implementation the stages used to have
+    def process(self, state: StageState) -> StageState:
+        result_state = copy.deepcopy(state)
+        for test in result_state.tests:
+            self.update_test(test)
+        for question in result_state.questions:
+            question_copy = copy.deepcopy(question)
+            for answer in question.answers:
+                self.update_answer(question_copy, answer)
+            self.update_question(question)
+        return result_state
+
+
+class LegacyVerificationStage(VerificationStage):
+    def process(self, state: StageState) -> StageState:
+        result_state = copy.deepcopy(state)
+        for question in result_state.questions:
+            question_copy = copy.deepcopy(question)
+            for answer in question.answers:
+                result_state.text_warnings.extend(
+                    self.check_answer(question_copy, answer)
+                )
+            result_state.text_warnings.extend(self.check_question(question))
+        return result_state
+
+
+def measure(name: str, stage, state: StageState) -> tuple[float, int]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = stage.process(state)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    changed = len(result.get_changed_questions())
+    print(
+        f"{name:<30} {elapsed * 1000:8.1f} ms {peak / 2**20:8.1f} MiB"
+        f" changed: {changed}"
+    )
+    return elapsed, peak
+
+
+def compare(name: str, legacy_stage, stage, state: StageState) -> None:
+    legacy_time, legacy_peak = measure(f"{name} (deepcopy)", legacy_stage, state)
+    new_time, new_peak = measure(f"{name} (copy-on-write)", stage, state)
+    print(
+        f"{name}: {legacy_time / new_time:.1f}x faster,"
+        f" {legacy_peak / max(new_peak, 1):.1f}x less peak memory"
+    )
+
+
+def main() -> None:
+    questions_count = int(sys.argv[1]) if len(sys.argv) > 1 else QUESTIONS_COUNT
+    state = make_state(questions_count)
+    print(f"Questions: {questions_count}, answers per question: {ANSWERS_COUNT}")
+    compare("update", LegacyUpdateStage(), SparseUpdateStage(), state)
+    compare("verification", LegacyVerificationStage(), VerificationStage(), state)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
-from sqlalchemy import create_engine, select
-from sqlalchemy.orm import (
-    sessionmaker,
-)
+from sqlalchemy import select
 from quiz_dataset_tools.util.language import Language, TextLocalizations
+from quiz_dataset_tools.util.session import (
+    SessionDBase,
+    create_sqlite_engine,
+    session_decorator,
+)
 from quiz_dataset_tools.build.orm import (
     BaseOrm,
     LanguageOrm,
@@ -19,28 +21,15 @@ from quiz_dataset_tools.build.types import (
 )
 
 
-def _session_decorator(func):
-    def wrapper(dbase, *args, **kwargs):
-        Session = sessionmaker(dbase.engine)
-        with Session() as session:
-            return func(dbase, session, *args, **kwargs)
-
-    return wrapper
-
-
-class MainDBase:
+class MainDBase(SessionDBase):
     def __init__(self, data_dir: str):
-        database_path = f"{data_dir}/main.db"
-        self.engine = create_engine(f"sqlite:///{database_path}", echo=False)
-
-    def close(self):
-        self.engine.dispose()
+        super().__init__(create_sqlite_engine(f"{data_dir}/main.db"))
 
     def bootstrap(self) -> None:
         self._bootstrap_tables()
         self._bootstrap_languages()
 
-    @_session_decorator
+    @session_decorator
     def get_questions(self, session) -> list[MainQuestion]:
         result = session.execute(select(QuestionOrm))
         return [entry.to_obj() for entry in result.scalars()]
@@ -49,7 +38,7 @@ class MainDBase:
         BaseOrm.metadata.drop_all(self.engine)
         BaseOrm.metadata.create_all(self.engine)
 
-    @_session_decorator
+    @session_decorator
     def _bootstrap_languages(self, session) -> None:
         for lang in Language:
             session.add(
@@ -58,4 +47,3 @@ class MainDBase:
                     LanguageName=lang.value.name,
                 )
             )
-        session.commit()
@@ -10,4 +10,6 @@ DOMAIN_UNITS_SYSTEM = {
     "fl": "imperial system",
 }
 
+DOMAINS = ["bc", "ca", "fl", "ny", "on", "tx"]
+
 GPT_MODEL = "gpt-4o"
@@ -1,9 +1,32 @@
-from sqlalchemy import create_engine, select
+import datetime
+from typing import Iterable, Iterator
+from sqlalchemy import (
+    ColumnElement,
+    and_,
+    bindparam,
+    case,
+    delete,
+    func,
+    inspect,
+    not_,
+    or_,
+    select,
+    union,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.orm import (
-    sessionmaker,
+    joinedload,
+    selectinload,
 )
 from quiz_dataset_tools.util.language import Language, TextLocalizations
-from quiz_dataset_tools.util.fs import backup_file
+from quiz_dataset_tools.util.backup import BackupManager, BackupPolicy
+from quiz_dataset_tools.util.sqlite import SqlitePragmas
+from quiz_dataset_tools.util.session import (
+    SessionDBase,
+    create_sqlite_engine,
+    session_decorator,
+)
 from quiz_dataset_tools.prebuild.types import (
     PrebuildText,
     PrebuildTextWarning,
@@ -12,35 +35,63 @@ from quiz_dataset_tools.prebuild.types import (
     PrebuildQuestionImage,
     PrebuildTest,
 )
+from quiz_dataset_tools.prebuild.stage import StageState
 from quiz_dataset_tools.prebuild.orm import (
     BaseOrm,
     LanguageOrm,
     TextOrm,
+    TextLocalizationOrm,
     TextWarningOrm,
+    TextStageMarkOrm,
     AnswerOrm,
     QuestionOrm,
     TestOrm,
+    dtime_to_timestamp,
 )
 
 
-def _session_decorator(func):
-    def wrapper(dbase, *args, **kwargs):
-        Session = sessionmaker(dbase.engine)
-        with Session() as session:
-            return func(dbase, session, *args, **kwargs)
+def _text_loader(loader):
+    return loader.options(
+        selectinload(TextOrm.Localizations),
+        selectinload(TextOrm.Warnings),
+        selectinload(TextOrm.StageMarks),
+    )
 
-    return wrapper
 
+# Hydrate the whole question graph in a constant number of queries instead
+# of lazy loading every text, localization, warning and answer one by one.
+_QUESTION_LOAD_OPTIONS = (
+    _text_loader(joinedload(QuestionOrm.Text)),
+    _text_loader(joinedload(QuestionOrm.CommentText)),
+    _text_loader(selectinload(QuestionOrm.Answers).joinedload(AnswerOrm.Text)),
+)
+
+_TEST_LOAD_OPTIONS = (_text_loader(joinedload(TestOrm.Title)),)
 
-class PrebuildDBase:
-    def __init__(self, data_dir: str, backup: bool = False):
-        database_path = f"{data_dir}/prebuild.db"
+# Keep IN (...) lists well below the SQLite bound parameters limit
+_PREFETCH_CHUNK_SIZE = 500
+ITER_BATCH_SIZE = 200
+
+
+class PrebuildDBase(SessionDBase):
+    def __init__(
+        self,
+        data_dir: str,
+        backup: bool = False,
+        pragmas: SqlitePragmas | None = None,
+        backup_policy: BackupPolicy | None = None,
+    ):
+        self.database_path = f"{data_dir}/prebuild.db"
+        self.backup_policy = backup_policy
+        engine = create_sqlite_engine(self.database_path)
+        (pragmas or SqlitePragmas()).apply(engine)
+        super().__init__(engine)
         if backup:
-            self._backup_database(database_path)
-        self.engine = create_engine(f"sqlite:///{database_path}", echo=False)
+            self.backup()
+        self.migrate()
 
-    def close(self):
-        self.engine.dispose()
+    def backup(self) -> str | None:
+        return self._backup_database(self.database_path)
 
     def bootstrap(self) -> None:
         self._drop_tables()
@@ -50,26 +101,35 @@ class PrebuildDBase:
     def bootstrap_tables(self) -> None:
         self._bootstrap_tables()
 
-    @_session_decorator
+    def migrate(self) -> None:
+        # Add tables and indexes declared after the database file was created
+        inspector = inspect(self.engine)
+        with self.engine.begin() as connection:
+            if inspector.has_table(TextOrm.__tablename__):
+                BaseOrm.metadata.create_all(connection)
+            for table in BaseOrm.metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    continue
+                for index in table.indexes:
+                    connection.execute(CreateIndex(index, if_not_exists=True))
+
+    @session_decorator
     def add_test(self, session, test: PrebuildTest) -> None:
         session.add(TestOrm.from_obj(test))
-        session.commit()
 
-    @_session_decorator
+    @session_decorator
     def update_test(self, session, test: PrebuildTest) -> None:
         test_orm = session.query(TestOrm).where(TestOrm.TestId == test.test_id).first()
         assert (
             test_orm is not None
         ), f"Cant find test in the dbase, test_id = {test.test_id}"
         test_orm.update(test)
-        session.commit()
 
-    @_session_decorator
+    @session_decorator
     def add_question(self, session, question: PrebuildQuestion) -> None:
         session.add(QuestionOrm.from_obj(question))
-        session.commit()
 
-    @_session_decorator
+    @session_decorator
     def update_question(self, session, question: PrebuildQuestion) -> None:
         question_orm = (
             session.query(QuestionOrm)
@@ -80,41 +140,146 @@ class PrebuildDBase:
             question_orm is not None
         ), f"Cant find question in the dbase, question_id = {question.question_id}"
         question_orm.update(question)
-        session.commit()
 
-    @_session_decorator
+    @session_decorator
+    def save_state(self, session, state: StageState) -> int:
+        # Returns the number of written entities
+        changed_tests = state.get_changed_tests()
+        test_orms = self._prefetch(
+            session,
+            TestOrm,
+            TestOrm.TestId,
+            [test.test_id for test in changed_tests],
+            _TEST_LOAD_OPTIONS,
+        )
+        for test in changed_tests:
+            test_orm = test_orms.get(test.test_id)
+            assert (
+                test_orm is not None
+            ), f"Cant find test in the dbase, test_id = {test.test_id}"
+            test_orm.update(test)
+        changed_questions = state.get_changed_questions()
+        question_orms = self._prefetch(
+            session,
+            QuestionOrm,
+            QuestionOrm.QuestionId,
+            [question.question_id for question in changed_questions],
+            _QUESTION_LOAD_OPTIONS,
+        )
+        for question in changed_questions:
+            question_orm = question_orms.get(question.question_id)
+            assert (
+                question_orm is not None
+            ), f"Cant find question in the dbase, question_id = {question.question_id}"
+            question_orm.update(question)
+        # Text updates above go through the ORM, flush them before the bulk
+        # warning statements
+        session.flush()
+        written_warnings = self.delete_text_warnings(
+            [warning for warning in state.text_warnings if not warning.content]
+        ) + self.upsert_text_warnings(
+            [warning for warning in state.text_warnings if warning.content]
+        )
+        return len(changed_tests) + len(changed_questions) + written_warnings
+
+    @session_decorator
     def get_tests(self, session) -> list[PrebuildTest]:
-        result = session.execute(select(TestOrm))
+        result = session.execute(select(TestOrm).options(*_TEST_LOAD_OPTIONS))
         return [orm.to_obj() for orm in result.scalars()]
 
-    @_session_decorator
+    @session_decorator
     def get_question(self, session, question_id: int) -> PrebuildQuestion | None:
         question_orm = session.execute(
-            select(QuestionOrm).where(QuestionOrm.QuestionId == question_id)
+            select(QuestionOrm)
+            .where(QuestionOrm.QuestionId == question_id)
+            .options(*_QUESTION_LOAD_OPTIONS)
         ).scalar_one_or_none()
         if not question_orm:
             return None
         return question_orm.to_obj()
 
-    @_session_decorator
+    @session_decorator
     def get_questions(self, session) -> list[PrebuildQuestion]:
-        result = session.execute(select(QuestionOrm))
+        result = session.execute(select(QuestionOrm).options(*_QUESTION_LOAD_OPTIONS))
         return [orm.to_obj() for orm in result.scalars()]
 
-    @_session_decorator
+    def iter_questions(
+        self,
+        batch_size: int = ITER_BATCH_SIZE,
+        test_ids: Iterable[int] | None = None,
+        question_ids: Iterable[int] | None = None,
+        since: int | None = None,
+    ) -> Iterator[PrebuildQuestion]:
+        # Keyset pagination on QuestionId, only one batch of questions is
+        # alive at a time. Batches join the caller's unit of work if any.
+        assert batch_size > 0, f"Bad batch size: {batch_size}"
+        questions = QuestionOrm.__table__
+        criteria = self._question_criteria(test_ids, question_ids, since)
+        last_question_id = None
+        while True:
+            batch_criteria = list(criteria)
+            if last_question_id is not None:
+                batch_criteria.append(questions.c.QuestionId > last_question_id)
+            with self.unit_of_work() as session:
+                batch = self._read_questions(session, batch_criteria, limit=batch_size)
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            last_question_id = batch[-1].question_id
+
+    # Read-only path: builds the dataclasses straight from Core rows, no ORM
+    # objects are created. Use get_* methods to read entities for an update.
+
+    @session_decorator
+    def read_tests(
+        self,
+        session,
+        test_ids: Iterable[int] | None = None,
+        since: int | None = None,
+    ) -> list[PrebuildTest]:
+        tests = TestOrm.__table__
+        criteria: list[ColumnElement[bool]] = []
+        if test_ids is not None:
+            criteria.append(tests.c.TestId.in_(list(test_ids)))
+        if since is not None:
+            criteria.append(tests.c.TitleTextId.in_(_updated_text_ids(since)))
+        query = select(tests).where(*criteria).order_by(tests.c.TestId)
+        texts = self._read_texts(session, select(query.subquery().c.TitleTextId))
+        return [
+            PrebuildTest(
+                test_id=row.TestId,
+                title=texts[row.TitleTextId],
+                position=row.Position,
+            )
+            for row in session.execute(query)
+        ]
+
+    @session_decorator
+    def read_questions(
+        self,
+        session,
+        test_ids: Iterable[int] | None = None,
+        question_ids: Iterable[int] | None = None,
+        since: int | None = None,
+    ) -> list[PrebuildQuestion]:
+        criteria = self._question_criteria(test_ids, question_ids, since)
+        return self._read_questions(session, criteria)
+
+    @session_decorator
     def get_questions_by_test(self, session, test_id: int) -> list[PrebuildQuestion]:
         result = session.execute(
-            select(QuestionOrm).where(QuestionOrm.TestId == test_id)
+            select(QuestionOrm)
+            .where(QuestionOrm.TestId == test_id)
+            .options(*_QUESTION_LOAD_OPTIONS)
         )
         return [orm.to_obj() for orm in result.scalars()]
 
-    @_session_decorator
+    @session_decorator
     def set_question_image(self, session, question_id: int, image: str | None) -> None:
         question = session.get(QuestionOrm, question_id)
         question.Image = image if image else None
-        session.commit()
 
-    @_session_decorator
+    @session_decorator
     def get_answer(self, session, answer_id: int) -> PrebuildAnswer | None:
         answer_orm = session.execute(
             select(AnswerOrm).where(AnswerOrm.AnswerId == answer_id)
@@ -123,39 +288,77 @@ class PrebuildDBase:
             return None
         return answer_orm.to_obj()
 
-    @_session_decorator
+    @session_decorator
     def update_text(self, session, text: PrebuildText) -> None:
         text_orm = session.query(TextOrm).where(TextOrm.TextId == text.text_id).first()
         assert (
             text_orm is not None
         ), f"Cant find text in the dbase, text_id = {text.text_id}"
         text_orm.update(text)
-        session.commit()
 
-    @_session_decorator
-    def add_text_warning(self, session, text_warning: PrebuildTextWarning) -> None:
-        assert (
-            text_warning.text_localization_id is not None
-            and text_warning.code is not None
-        ), f"Cant add text warning, {text_warning.text_localization_id=}, {text_warning.code=}"
-        text_warning_orm = (
-            session.query(TextWarningOrm)
-            .where(
-                (
-                    TextWarningOrm.TextLocalizationsId
-                    == text_warning.text_localization_id
-                )
-                & (TextWarningOrm.Code == text_warning.code)
-            )
-            .first()
+    def add_text_warning(self, text_warning: PrebuildTextWarning) -> None:
+        self.upsert_text_warnings([text_warning])
+
+    @session_decorator
+    def upsert_text_warnings(
+        self, session, text_warnings: list[PrebuildTextWarning]
+    ) -> int:
+        # Returns the number of inserted or changed warnings
+        if not text_warnings:
+            return 0
+        for text_warning in text_warnings:
+            assert (
+                text_warning.text_localization_id is not None
+                and text_warning.code is not None
+            ), f"Cant add text warning, {text_warning.text_localization_id=}, {text_warning.code=}"
+        self._check_manually_checked_warnings(session, text_warnings)
+        table = BaseOrm.metadata.tables[TextWarningOrm.__tablename__]
+        stmt = sqlite_insert(table)
+        content_changed = and_(
+            stmt.excluded.Content != "", stmt.excluded.Content != table.c.Content
+        )
+        # Same rules as TextWarningOrm.update: new content resets the manual
+        # check, otherwise the flag can only be raised. Empty content keeps
+        # the stored one.
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.TextLocalizationsId, table.c.Code],
+            set_={
+                "Content": case(
+                    (stmt.excluded.Content == "", table.c.Content),
+                    else_=stmt.excluded.Content,
+                ),
+                "IsManuallyChecked": case(
+                    (content_changed, False),
+                    else_=or_(
+                        table.c.IsManuallyChecked, stmt.excluded.IsManuallyChecked
+                    ),
+                ),
+                "LastUpdateTimestamp": func.now(),
+            },
+            where=or_(
+                content_changed,
+                and_(
+                    stmt.excluded.IsManuallyChecked,
+                    not_(table.c.IsManuallyChecked),
+                ),
+            ),
         )
-        if text_warning_orm:
-            text_warning_orm.update(text_warning)
-        else:
-            session.add(TextWarningOrm.from_obj(text_warning))
-        session.commit()
+        result = session.execute(
+            stmt,
+            [
+                {
+                    "TextId": text_warning.text_id,
+                    "TextLocalizationsId": text_warning.text_localization_id,
+                    "Code": text_warning.code,
+                    "Content": text_warning.content or "",
+                    "IsManuallyChecked": bool(text_warning.is_manually_checked),
+                }
+                for text_warning in text_warnings
+            ],
+        )
+        return result.rowcount
 
-    @_session_decorator
+    @session_decorator
     def update_text_warning(self, session, text_warning: PrebuildTextWarning) -> None:
         text_warning_orm = (
             session.query(TextWarningOrm)
@@ -166,25 +369,219 @@ class PrebuildDBase:
             text_warning_orm is not None
         ), f"Cant find text warning in the dbase, text_warning_id = {text_warning.text_warning_id}"
         text_warning_orm.update(text_warning)
-        session.commit()
 
-    @_session_decorator
-    def delete_text_warning(self, session, text_warning: PrebuildTextWarning) -> None:
-        session.query(TextWarningOrm).filter(
-            (TextWarningOrm.TextLocalizationsId == text_warning.text_localization_id)
-            & (TextWarningOrm.Code == text_warning.code)
-        ).delete(synchronize_session=False)
-        session.commit()
+    def delete_text_warning(self, text_warning: PrebuildTextWarning) -> None:
+        self.delete_text_warnings([text_warning])
+
+    @session_decorator
+    def delete_text_warnings(
+        self, session, text_warnings: list[PrebuildTextWarning]
+    ) -> int:
+        # Returns the number of deleted warnings
+        if not text_warnings:
+            return 0
+        table = BaseOrm.metadata.tables[TextWarningOrm.__tablename__]
+        result = session.execute(
+            delete(table).where(
+                (table.c.TextLocalizationsId == bindparam("localization_id"))
+                & (table.c.Code == bindparam("code"))
+            ),
+            [
+                {
+                    "localization_id": text_warning.text_localization_id,
+                    "code": text_warning.code,
+                }
+                for text_warning in text_warnings
+            ],
+        )
+        return result.rowcount
 
-    @_session_decorator
+    @session_decorator
     def get_text_warnings(self, session, text_id: int) -> list[PrebuildTextWarning]:
         result = session.execute(
             select(TextWarningOrm).where(TextWarningOrm.TextId == text_id)
         )
         return [orm.to_obj() for orm in result.scalars()]
 
-    def _backup_database(self, database_path) -> None:
-        backup_file(database_path)
+    @staticmethod
+    def _prefetch(session, orm_cls, key_column, keys: list[int], options) -> dict:
+        result = {}
+        for i in range(0, len(keys), _PREFETCH_CHUNK_SIZE):
+            rows = session.execute(
+                select(orm_cls)
+                .where(key_column.in_(keys[i : i + _PREFETCH_CHUNK_SIZE]))
+                .options(*options)
+            ).scalars()
+            for orm in rows:
+                result[getattr(orm, key_column.key)] = orm
+        return result
+
+    @staticmethod
+    def _question_criteria(
+        test_ids: Iterable[int] | None,
+        question_ids: Iterable[int] | None,
+        since: int | None,
+    ) -> list[ColumnElement[bool]]:
+        questions = QuestionOrm.__table__
+        answers = AnswerOrm.__table__
+        criteria: list[ColumnElement[bool]] = []
+        if test_ids is not None:
+            criteria.append(questions.c.TestId.in_(list(test_ids)))
+        if question_ids is not None:
+            criteria.append(questions.c.QuestionId.in_(list(question_ids)))
+        if since is not None:
+            # Any text of the question: the question, its comment or answers
+            updated_text_ids = _updated_text_ids(since)
+            criteria.append(
+                or_(
+                    questions.c.TextId.in_(updated_text_ids),
+                    questions.c.CommentTextId.in_(updated_text_ids),
+                    questions.c.QuestionId.in_(
+                        select(answers.c.QuestionId).where(
+                            answers.c.TextId.in_(updated_text_ids)
+                        )
+                    ),
+                )
+            )
+        return criteria
+
+    def _read_questions(
+        self, session, criteria: list[ColumnElement[bool]], limit: int | None = None
+    ) -> list[PrebuildQuestion]:
+        questions = QuestionOrm.__table__
+        answers = AnswerOrm.__table__
+        query = select(questions).where(*criteria).order_by(questions.c.QuestionId)
+        if limit is not None:
+            query = query.limit(limit)
+        question_rows = session.execute(query).all()
+        if not question_rows:
+            return []
+        selected = query.subquery()
+        selected_answers = answers.c.QuestionId.in_(select(selected.c.QuestionId))
+        texts = self._read_texts(
+            session,
+            union(
+                select(selected.c.TextId),
+                select(selected.c.CommentTextId),
+                select(answers.c.TextId).where(selected_answers),
+            ),
+        )
+        question_answers: dict[int, list[PrebuildAnswer]] = {
+            row.QuestionId: [] for row in question_rows
+        }
+        for row in session.execute(
+            select(answers).where(selected_answers).order_by(answers.c.AnswerId)
+        ):
+            question_answers[row.QuestionId].append(
+                PrebuildAnswer(
+                    answer_id=row.AnswerId,
+                    question_id=row.QuestionId,
+                    text=texts[row.TextId],
+                    is_right_answer=row.IsRightAnswer,
+                )
+            )
+        return [
+            PrebuildQuestion(
+                test_id=row.TestId,
+                question_id=row.QuestionId,
+                text=texts[row.TextId],
+                answers=question_answers[row.QuestionId],
+                image=row.Image,
+                audio=row.Audio,
+                comment_text=(
+                    texts[row.CommentTextId] if row.CommentTextId is not None else None
+                ),
+            )
+            for row in question_rows
+        ]
+
+    @staticmethod
+    def _read_texts(session, text_ids) -> dict[int, PrebuildText]:
+        # text_ids is a select of TextId values, it is used as a subquery
+        texts = TextOrm.__table__
+        localizations = TextLocalizationOrm.__table__
+        warnings = TextWarningOrm.__table__
+        stage_marks = TextStageMarkOrm.__table__
+        result: dict[int, PrebuildText] = {}
+        for row in session.execute(select(texts).where(texts.c.TextId.in_(text_ids))):
+            original = None
+            if row.Original is not None:
+                original = TextLocalizations()
+                original.set(Language.EN, row.Original)
+            result[row.TextId] = PrebuildText(
+                text_id=row.TextId,
+                localizations=TextLocalizations(),
+                original=original,
+                is_manually_checked=row.IsManuallyChecked,
+                last_update_timestamp=dtime_to_timestamp(row.LastUpdateTimestamp),
+            )
+        for row in session.execute(
+            select(localizations)
+            .where(localizations.c.TextId.in_(text_ids))
+            .order_by(localizations.c.TextLocalizationsId)
+        ):
+            lang = Language.from_id(row.LanguageId)
+            assert lang
+            result[row.TextId].localizations.set(
+                lang, row.Content, row.TextLocalizationsId
+            )
+        for row in session.execute(
+            select(warnings)
+            .where(warnings.c.TextId.in_(text_ids))
+            .order_by(warnings.c.TextWarningId)
+        ):
+            result[row.TextId].warnings.append(
+                PrebuildTextWarning(
+                    text_warning_id=row.TextWarningId,
+                    text_id=row.TextId,
+                    text_localization_id=row.TextLocalizationsId,
+                    code=row.Code,
+                    content=row.Content,
+                    is_manually_checked=row.IsManuallyChecked,
+                    last_update_timestamp=dtime_to_timestamp(row.LastUpdateTimestamp),
+                )
+            )
+        for row in session.execute(
+            select(stage_marks).where(stage_marks.c.TextId.in_(text_ids))
+        ):
+            result[row.TextId].stage_marks[row.Stage] = row.Fingerprint
+        return result
+
+    @staticmethod
+    def _check_manually_checked_warnings(
+        session, text_warnings: list[PrebuildTextWarning]
+    ) -> None:
+        # Content can't be changed and marked as checked in one update
+        checked = {
+            (text_warning.text_localization_id, text_warning.code): text_warning
+            for text_warning in text_warnings
+            if text_warning.is_manually_checked
+        }
+        if not checked:
+            return
+        localization_ids = list({key[0] for key in checked})
+        for i in range(0, len(localization_ids), _PREFETCH_CHUNK_SIZE):
+            rows = session.execute(
+                select(
+                    TextWarningOrm.TextLocalizationsId,
+                    TextWarningOrm.Code,
+                    TextWarningOrm.Content,
+                ).where(
+                    TextWarningOrm.TextLocalizationsId.in_(
+                        localization_ids[i : i + _PREFETCH_CHUNK_SIZE]
+                    )
+                )
+            )
+            for localization_id, code, content in rows:
+                text_warning = checked.get((localization_id, code))
+                assert (
+                    text_warning is None
+                    or not text_warning.content
+                    or text_warning.content == content
+                ), f"Can't update warning content and set IsManuallyChecked flag at the same time"
+
+    def _backup_database(self, database_path) -> str | None:
+        return BackupManager(database_path, self.backup_policy).backup()
 
     def _drop_tables(self) -> None:
         BaseOrm.metadata.drop_all(self.engine)
@@ -192,7 +589,7 @@ class PrebuildDBase:
     def _bootstrap_tables(self) -> None:
         BaseOrm.metadata.create_all(self.engine)
 
-    @_session_decorator
+    @session_decorator
     def _bootstrap_languages(self, session) -> None:
         for lang in Language:
             session.add(
@@ -201,11 +598,20 @@ class PrebuildDBase:
                     LanguageName=lang.value.name,
                 )
             )
-        session.commit()
+
+
+def _updated_text_ids(since: int):
+    # SQLite keeps the timestamps in UTC
+    since_dtime = datetime.datetime.fromtimestamp(since, datetime.timezone.utc)
+    texts = TextOrm.__table__
+    return select(texts.c.TextId).where(
+        texts.c.LastUpdateTimestamp >= since_dtime.replace(tzinfo=None)
+    )
 
 
 def main():
     from pprint import pprint
+
     dbase = PrebuildDBase("./")
     q = dbase.get_question(107)
     pprint(q.comment_text)
@@ -20,7 +20,6 @@ type AnswersIndex = dict[AnswerKey, PrebuildText]
 
 class TextMimicService:
 
-    questions: list[PrebuildQuestion] = []
     question_text_origin_index: QuestionsIndex = {}
     question_text_local_index: QuestionsIndex = {}
     answer_origin_index: AnswersIndex = {}
@@ -30,11 +29,14 @@ class TextMimicService:
         pass
 
     def load_source_data(self, data_dir: str) -> None:
-        self.questions = PrebuildDBase(data_dir).get_questions()
-        for question in self.questions:
-            self._index_question(question)
-            for answer in question.answers:
-                self._index_answer(answer)
+        dbase = PrebuildDBase(data_dir)
+        try:
+            for question in dbase.iter_questions():
+                self._index_question(question)
+                for answer in question.answers:
+                    self._index_answer(answer)
+        finally:
+            dbase.close()
         """
         with open("/tmp/origin", "w") as fd:
             for key in sorted(self.answer_origin_index):
@@ -0,0 +1,80 @@
+import os
+import threading
+from dataclasses import dataclass, field
+from dataclasses_json import DataClassJsonMixin
+from quiz_dataset_tools.prebuild.types import PrebuildQuestion, PrebuildTextWarning
+
+
+JOURNAL_INTERVAL = 50
+
+
+@dataclass
+class JournalEntry(DataClassJsonMixin):
+    question_id: int
+    # Fingerprint of the question the result was made from
+    input_fingerprint: str
+    # None if the stage didn't change the question
+    question: PrebuildQuestion | None = None
+    warnings: list[PrebuildTextWarning] = field(default_factory=lambda: [])
+
+
+class StageJournal:
+    # Append-only JSONL file with results of processed questions, it lets an
+    # interrupted stage skip the questions it already processed
+    def __init__(self, path: str, interval: int = JOURNAL_INTERVAL):
+        assert interval > 0, f"Bad journal interval: {interval}"
+        self.path = path
+        self.interval = interval
+        self.entries: dict[int, JournalEntry] = {}
+        self.pending: list[JournalEntry] = []
+        self.lock = threading.Lock()
+
+    def load(self) -> int:
+        # Returns the number of loaded entries
+        self.entries = {}
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, "r") as fd:
+            for line in fd:
+                try:
+                    entry = JournalEntry.from_json(line)
+                except (ValueError, KeyError):
+                    # The last line may be cut if the process was killed
+                    continue
+                self.entries[entry.question_id] = entry
+        return len(self.entries)
+
+    def get(self, question_id: int, input_fingerprint: str) -> JournalEntry | None:
+        entry = self.entries.get(question_id)
+        if entry is None or entry.input_fingerprint != input_fingerprint:
+            return None
+        return entry
+
+    def record(self, entry: JournalEntry) -> None:
+        with self.lock:
+            self.entries[entry.question_id] = entry
+            self.pending.append(entry)
+            if len(self.pending) >= self.interval:
+                self._flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            self._flush()
+
+    def remove(self) -> None:
+        with self.lock:
+            self.entries = {}
+            self.pending = []
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _flush(self) -> None:
+        if not self.pending:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a") as fd:
+            for entry in self.pending:
+                fd.write(entry.to_json(ensure_ascii=False) + "\n")
+            fd.flush()
+            os.fsync(fd.fileno())
+        self.pending = []
@@ -0,0 +1,57 @@
+import os
+from dataclasses import dataclass, field
+from dataclasses_json import DataClassJsonMixin
+from quiz_dataset_tools.util.gpt import GPTMetrics
+
+
+@dataclass
+class StageMetrics(DataClassJsonMixin):
+    stage: str
+    data_dir: str
+    started_at: int
+    questions: int = 0
+    load_seconds: float = 0.0
+    process_seconds: float = 0.0
+    save_seconds: float = 0.0
+    questions_per_second: float = 0.0
+    written_entities: int = 0
+    # Bytes the process wrote to storage while saving, None if unknown
+    bytes_written: int | None = None
+    warnings: int = 0
+    # GPT usage by service name
+    gpt: dict[str, GPTMetrics] = field(default_factory=dict)
+
+    def add_gpt_usage(
+        self, before: dict[str, GPTMetrics], after: dict[str, GPTMetrics]
+    ) -> None:
+        for name, metrics in after.items():
+            usage = metrics - before.get(name, GPTMetrics())
+            if usage != GPTMetrics():
+                self.gpt[name] = usage
+
+    def add_bytes_written(self, before: int | None, after: int | None) -> None:
+        if before is None or after is None:
+            return
+        self.bytes_written = (self.bytes_written or 0) + after - before
+
+    def emit(self, metrics_path: str | None = None) -> None:
+        # One JSON record per line, to stdout and to the metrics file if set
+        record = self.to_json(ensure_ascii=False)
+        print(record)
+        if metrics_path:
+            os.makedirs(os.path.dirname(metrics_path) or ".", exist_ok=True)
+            with open(metrics_path, "a") as fd:
+                fd.write(record + "\n")
+
+
+def process_bytes_written() -> int | None:
+    # Linux only, storage level writes of the current process
+    try:
+        with open("/proc/self/io", "r") as fd:
+            for line in fd:
+                name, _, value = line.partition(":")
+                if name == "write_bytes":
+                    return int(value)
+    except OSError:
+        pass
+    return None
@@ -46,6 +46,7 @@ class TextOrm(BaseOrm):
         back_populates="Text"
     )
     Warnings: Mapped[List["TextWarningOrm"]] = relationship(back_populates="Text")
+    StageMarks: Mapped[List["TextStageMarkOrm"]] = relationship(back_populates="Text")
 
     @staticmethod
     def from_obj(obj: PrebuildText) -> "TextOrm":
@@ -57,6 +58,7 @@ class TextOrm(BaseOrm):
             Localizations=TextLocalizationOrm.from_obj(obj.localizations),
             Original=original,
             Warnings=[TextWarningOrm.from_obj(warning) for warning in obj.warnings],
+            StageMarks=TextStageMarkOrm.from_obj(obj.stage_marks),
             IsManuallyChecked=obj.is_manually_checked,
         )
 
@@ -72,11 +74,17 @@ class TextOrm(BaseOrm):
             warnings=[warning_orm.to_obj() for warning_orm in self.Warnings],
             is_manually_checked=self.IsManuallyChecked,
             last_update_timestamp=dtime_to_timestamp(self.LastUpdateTimestamp),
+            stage_marks=TextStageMarkOrm.to_obj(self.StageMarks),
         )
 
     def update(self, obj: PrebuildText) -> None:
+        # Localization changes don't touch the Texts row, the timestamp is
+        # bumped explicitly to let partial runs find updated texts
+        if TextLocalizationOrm.to_obj(self.Localizations) != obj.localizations:
+            self.LastUpdateTimestamp = func.now()
         TextLocalizationOrm.update_all(self.Localizations, obj.localizations)
         TextWarningOrm.update_all(self.Warnings, obj.warnings)
+        TextStageMarkOrm.update_all(self.StageMarks, obj.stage_marks)
         self.IsManuallyChecked = obj.is_manually_checked
 
 
@@ -84,7 +92,7 @@ class TextLocalizationOrm(BaseOrm):
     __tablename__ = "TextLocalizations"
 
     TextLocalizationsId: Mapped[int] = mapped_column(primary_key=True)
-    TextId: Mapped[int] = mapped_column(ForeignKey("Texts.TextId"))
+    TextId: Mapped[int] = mapped_column(ForeignKey("Texts.TextId"), index=True)
     LanguageId: Mapped[int] = mapped_column(ForeignKey("Languages.LanguageId"))
     Content: Mapped[str]
 
@@ -143,7 +151,7 @@ class TextWarningOrm(BaseOrm):
     )
 
     TextWarningId: Mapped[int] = mapped_column(primary_key=True)
-    TextId: Mapped[int] = mapped_column(ForeignKey("Texts.TextId"))
+    TextId: Mapped[int] = mapped_column(ForeignKey("Texts.TextId"), index=True)
     TextLocalizationsId: Mapped[int] = mapped_column(
         ForeignKey("TextLocalizations.TextLocalizationsId")
     )
@@ -220,11 +228,44 @@ class TextWarningOrm(BaseOrm):
         return None
 
 
+class TextStageMarkOrm(BaseOrm):
+    __tablename__ = "TextStageMarks"
+
+    TextId: Mapped[int] = mapped_column(ForeignKey("Texts.TextId"), primary_key=True)
+    Stage: Mapped[str] = mapped_column(primary_key=True)
+    Fingerprint: Mapped[str]
+
+    Text: Mapped["TextOrm"] = relationship(back_populates="StageMarks")
+
+    @staticmethod
+    def from_obj(obj: dict[str, str]) -> list["TextStageMarkOrm"]:
+        return [
+            TextStageMarkOrm(Stage=stage, Fingerprint=fingerprint)
+            for stage, fingerprint in obj.items()
+        ]
+
+    @staticmethod
+    def to_obj(orms: list["TextStageMarkOrm"]) -> dict[str, str]:
+        return {orm.Stage: orm.Fingerprint for orm in orms}
+
+    @staticmethod
+    def update_all(orms: list["TextStageMarkOrm"], obj: dict[str, str]) -> None:
+        existing = {orm.Stage: orm for orm in orms}
+        for stage, fingerprint in obj.items():
+            mark_orm = existing.get(stage)
+            if mark_orm is None:
+                orms.append(TextStageMarkOrm(Stage=stage, Fingerprint=fingerprint))
+            elif mark_orm.Fingerprint != fingerprint:
+                mark_orm.Fingerprint = fingerprint
+
+
 class AnswerOrm(BaseOrm):
     __tablename__ = "Answers"
 
     AnswerId: Mapped[int] = mapped_column(primary_key=True)
-    QuestionId: Mapped[int] = mapped_column(ForeignKey("Questions.QuestionId"))
+    QuestionId: Mapped[int] = mapped_column(
+        ForeignKey("Questions.QuestionId"), index=True
+    )
     TextId: Mapped[int] = mapped_column(ForeignKey("Texts.TextId"))
     IsRightAnswer: Mapped[bool]
 
@@ -279,7 +320,7 @@ class QuestionOrm(BaseOrm):
     __tablename__ = "Questions"
 
     QuestionId: Mapped[int] = mapped_column(primary_key=True)
-    TestId: Mapped[int] = mapped_column(ForeignKey("Tests.TestId"))
+    TestId: Mapped[int] = mapped_column(ForeignKey("Tests.TestId"), index=True)
     TextId: Mapped[int] = mapped_column(ForeignKey("Texts.TextId"))
     CommentTextId: Mapped[int] = mapped_column(ForeignKey("Texts.TextId"))
     Image: Mapped[str | None]
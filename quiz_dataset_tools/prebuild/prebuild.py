@@ -1,9 +1,13 @@
 import copy
+import os
+import time
 from quiz_dataset_tools.util.text_overrides import TextOverrides
 from quiz_dataset_tools.parser.parser import Parser
 from quiz_dataset_tools.util.language import Language, TextLocalizations
 from quiz_dataset_tools.util.data import Test, Question, Answer, TextTransformer
 from quiz_dataset_tools.util.fs import dump_list, load_list
+from quiz_dataset_tools.util.backup import BackupPolicy
+from quiz_dataset_tools.util.sqlite import SqlitePragmas
 from quiz_dataset_tools.prebuild.dbase import PrebuildDBase
 from quiz_dataset_tools.prebuild.types import (
     PrebuildText,
@@ -12,19 +16,31 @@ from quiz_dataset_tools.prebuild.types import (
     PrebuildTest,
 )
 from quiz_dataset_tools.prebuild.translation.translation import Translator
-from quiz_dataset_tools.prebuild.stage import BaseStage, StageState
+from quiz_dataset_tools.util.gpt import get_gpt_metrics, set_batch
+from quiz_dataset_tools.util.gpt_batch import BatchBackend, GPTBatch
+from quiz_dataset_tools.prebuild.metrics import StageMetrics, process_bytes_written
+from quiz_dataset_tools.prebuild.journal import JOURNAL_INTERVAL, StageJournal
+from quiz_dataset_tools.prebuild.stage import (
+    BaseStage,
+    StageState,
+    VerificationStage,
+)
 from quiz_dataset_tools.prebuild.stages.passthrough import PassthroughStage
 from quiz_dataset_tools.prebuild.stages.compose import ComposeMode, ComposeStage
 from quiz_dataset_tools.prebuild.stages.override import OverrideStage
 from quiz_dataset_tools.prebuild.stages.dump_overrides import DumpOverridesStage
 from quiz_dataset_tools.prebuild.stages.translate import TranslateStage
 from quiz_dataset_tools.prebuild.stages.final import FinalStage
-from quiz_dataset_tools.prebuild.stages.doctor import DoctorStage
+from quiz_dataset_tools.prebuild.stages.doctor import DOCTOR_MAX_WORKERS, DoctorStage
 from quiz_dataset_tools.prebuild.stages.question_comment import (
     QuestionCommentStage,
 )
 
 
+# Prompts depending on the answers of other prompts take more than one batch
+BATCH_MAX_ROUNDS = 3
+
+
 class PrebuildBuilder:
     def __init__(self) -> None:
         self.data_path: str = "data"
@@ -35,6 +51,20 @@ class PrebuildBuilder:
         self.languages: list[Language] = []
         self.compose_mode: ComposeMode = ComposeMode.SKIP
         self.questions_per_test: int = 15
+        self.dbase_pragmas: SqlitePragmas | None = None
+        self.backup_policy: BackupPolicy | None = None
+        # None lets every stage use its own default
+        self.max_workers: int | None = None
+        self.journal_interval: int = JOURNAL_INTERVAL
+        self.metrics_path: str | None = None
+        # Stages load only the selected tests and questions, None selects all
+        self.test_ids: list[int] | None = None
+        self.question_ids: list[int] | None = None
+        self.since: int | None = None
+        # Ignore the stage marks and process every text
+        self.force: bool = False
+        # GPT cache misses of a stage are sent as batches before it runs
+        self.batch_backend: BatchBackend | None = None
 
     def set_data_path(self, data_path: str) -> None:
         self.data_path = data_path
@@ -54,6 +84,41 @@ class PrebuildBuilder:
     def set_languages(self, languages: list[Language]) -> None:
         self.languages = languages
 
+    def set_dbase_pragmas(self, pragmas: SqlitePragmas) -> None:
+        self.dbase_pragmas = pragmas
+
+    def set_backup_policy(self, backup_policy: BackupPolicy) -> None:
+        self.backup_policy = backup_policy
+
+    def set_max_workers(self, max_workers: int | None) -> None:
+        self.max_workers = max_workers
+
+    def set_journal_interval(self, journal_interval: int) -> None:
+        # Zero disables the journal
+        self.journal_interval = journal_interval
+
+    def set_metrics_path(self, metrics_path: str | None) -> None:
+        # Stage metrics are appended to the file as JSON lines
+        self.metrics_path = metrics_path
+
+    def set_filter(
+        self,
+        test_ids: list[int] | None = None,
+        question_ids: list[int] | None = None,
+        since: int | None = None,
+    ) -> None:
+        # Filters are combined, since is a unix timestamp of the oldest text
+        # update to select
+        self.test_ids = test_ids
+        self.question_ids = question_ids
+        self.since = since
+
+    def set_force(self, force: bool) -> None:
+        self.force = force
+
+    def set_batch_backend(self, batch_backend: BatchBackend | None) -> None:
+        self.batch_backend = batch_backend
+
     def set_compose_mode(self, mode: str) -> None:
         self.compose_mode = ComposeMode.from_str(mode)
 
@@ -64,43 +129,183 @@ class PrebuildBuilder:
         create_db_stage.process(state)
 
     def run_translate(self) -> None:
-        assert self.translator
-        self._run_stage_on_dbase(TranslateStage(self.translator))
+        self.run_pipeline([self.make_translate_stage()])
 
     def run_override(self) -> None:
+        self.run_pipeline([self.make_override_stage()])
+
+    def run_dump_overrides(self) -> None:
+        self.run_pipeline([self.make_dump_overrides_stage()])
+
+    def run_doctor(self, domain: str) -> None:
+        self.run_pipeline([self.make_doctor_stage(domain)])
+
+    def run_question_comment(self, domain: str) -> None:
+        self.run_pipeline([self.make_question_comment_stage(domain)])
+
+    def make_translate_stage(self) -> TranslateStage:
+        assert self.translator
+        translate_stage = TranslateStage(self.translator)
+        translate_stage.set_max_workers(self.max_workers or 1)
+        return translate_stage
+
+    def make_override_stage(self) -> OverrideStage:
         assert self.languages
         assert self.overrides
-        self._run_stage_on_dbase(OverrideStage(self.languages, self.overrides))
+        return OverrideStage(self.languages, self.overrides)
 
-    def run_dump_overrides(self) -> None:
+    def make_dump_overrides_stage(self) -> DumpOverridesStage:
         assert self.languages
         assert self.overrides
-        self._run_stage_on_dbase(DumpOverridesStage(self.languages, self.overrides))
+        return DumpOverridesStage(self.languages, self.overrides)
 
-    def run_doctor(self, domain: str) -> None:
+    def make_doctor_stage(self, domain: str) -> DoctorStage:
         doctor_stage = DoctorStage(domain)
-        self._run_stage_on_dbase(doctor_stage)
-        doctor_stage.flush()
+        doctor_stage.set_max_workers(self.max_workers or DOCTOR_MAX_WORKERS)
+        return doctor_stage
 
-    def run_question_comment(self, domain: str) -> None:
+    def make_question_comment_stage(self, domain: str) -> QuestionCommentStage:
         images_dir = self.output_dir + "/images"
         question_comment_stage = QuestionCommentStage(domain, images_dir)
-        self._run_stage_on_dbase(question_comment_stage)
-        question_comment_stage.flush()
+        question_comment_stage.set_max_workers(self.max_workers or 1)
+        return question_comment_stage
+
+    def make_stage(self, name: str, domain: str) -> BaseStage:
+        if name == "translate":
+            return self.make_translate_stage()
+        elif name == "override":
+            return self.make_override_stage()
+        elif name == "dump-overrides":
+            return self.make_dump_overrides_stage()
+        elif name == "doctor":
+            return self.make_doctor_stage(domain)
+        elif name == "question-comments":
+            return self.make_question_comment_stage(domain)
+        raise Exception(f"Unknown stage '{name}'")
 
     @staticmethod
     def load_tests(data_dir: str) -> list[PrebuildTest]:
-        return PrebuildDBase(data_dir).get_tests()
+        dbase = PrebuildDBase(data_dir)
+        try:
+            return dbase.read_tests()
+        finally:
+            dbase.close()
 
     @staticmethod
     def load_questions(data_dir: str) -> list[PrebuildQuestion]:
-        return PrebuildDBase(data_dir).get_questions()
+        dbase = PrebuildDBase(data_dir)
+        try:
+            return dbase.read_questions()
+        finally:
+            dbase.close()
+
+    def run_pipeline(self, stages: list[BaseStage], checkpoint: bool = False) -> None:
+        # The state is passed between the stages in memory and saved once at
+        # the end, or after every stage with checkpoint
+        for stage in stages:
+            if self.force:
+                stage.set_force(True)
+            stage.setup()
+        dbase = PrebuildDBase(
+            f"{self.output_dir}",
+            pragmas=self.dbase_pragmas,
+            backup_policy=self.backup_policy,
+        )
+        # Journals of the stages which results are not saved yet
+        journals: list[StageJournal] = []
+        stage_metrics: list[StageMetrics] = []
+        try:
+            load_start = time.perf_counter()
+            state = self._load_stage_state_from_dbase(dbase)
+            load_seconds = time.perf_counter() - load_start
+            for index, stage in enumerate(stages):
+                metrics = StageMetrics(
+                    stage=type(stage).__name__,
+                    data_dir=self.output_dir,
+                    started_at=int(time.time()),
+                    load_seconds=load_seconds,
+                )
+                stage_metrics.append(metrics)
+                load_seconds = 0.0
+                # Checks refer to localizations by id, new ones get it on save
+                if isinstance(stage, VerificationStage) and _has_changes(state):
+                    state = self._checkpoint_stage_state(
+                        dbase, state, journals, metrics
+                    )
+                if self.batch_backend:
+                    self._run_stage_batches(stage, state)
+                journal = self._open_stage_journal(index, stage)
+                if journal:
+                    journals.append(journal)
+                print(f"Run {type(stage).__name__}")
+                gpt_metrics = get_gpt_metrics()
+                warnings_count = len(state.text_warnings)
+                process_start = time.perf_counter()
+                try:
+                    state = stage.process(state)
+                finally:
+                    if journal:
+                        journal.flush()
+                stage.flush()
+                metrics.process_seconds = time.perf_counter() - process_start
+                metrics.questions = len(state.questions)
+                if metrics.process_seconds > 0:
+                    metrics.questions_per_second = (
+                        metrics.questions / metrics.process_seconds
+                    )
+                metrics.warnings = len(state.text_warnings) - warnings_count
+                metrics.add_gpt_usage(gpt_metrics, get_gpt_metrics())
+                if checkpoint:
+                    state = self._checkpoint_stage_state(
+                        dbase, state, journals, metrics
+                    )
+            if _has_changes(state):
+                self._save_stage_state_measured(dbase, state, stage_metrics[-1])
+            _remove_journals(journals)
+        finally:
+            dbase.close()
+        for metrics in stage_metrics:
+            metrics.emit(self.metrics_path)
+
+    def _run_stage_batches(self, stage: BaseStage, state: StageState) -> None:
+        # Dry runs of the stage collect the prompts missing in the caches,
+        # their results are dropped. The real run then reads the caches.
+        assert self.batch_backend
+        journal = stage.journal
+        stage.journal = None
+        try:
+            for _ in range(BATCH_MAX_ROUNDS):
+                batch = GPTBatch()
+                set_batch(batch)
+                try:
+                    stage.process(state)
+                finally:
+                    set_batch(None)
+                if not batch:
+                    return
+                if not batch.submit(self.batch_backend, f"{self.output_dir}/batch"):
+                    return
+        finally:
+            stage.journal = journal
 
-    def _run_stage_on_dbase(self, stage: BaseStage) -> None:
-        stage.setup()
-        state = self._load_stage_state_from_dbase()
-        state = stage.process(state)
-        self._save_stage_state_to_dbase(state)
+    def _open_stage_journal(self, index: int, stage: BaseStage) -> StageJournal | None:
+        if not self.journal_interval:
+            return None
+        # Results made with other stage settings can't be replayed
+        journal_dir = f"{self.output_dir}/journal"
+        journal_prefix = f"{index}-{type(stage).__name__}"
+        journal_name = f"{journal_prefix}-{stage.get_settings_digest()}.jsonl"
+        if os.path.isdir(journal_dir):
+            for name in os.listdir(journal_dir):
+                if name.startswith(f"{journal_prefix}-") and name != journal_name:
+                    print(f"Drop journal made with other settings: {name}")
+                    os.remove(os.path.join(journal_dir, name))
+        journal = StageJournal(f"{journal_dir}/{journal_name}", self.journal_interval)
+        loaded = journal.load()
+        if loaded:
+            print(f"Resume {type(stage).__name__}: {loaded} questions in the journal")
+        stage.set_journal(journal)
+        return journal
 
     def _load_initial_state(self) -> StageState:
         assert self.parser
@@ -140,26 +345,58 @@ class PrebuildBuilder:
         )
         """
 
-    def _load_stage_state_from_dbase(self) -> StageState:
-        dbase = PrebuildDBase(f"{self.output_dir}")
-        return StageState(
-            tests=dbase.get_tests(),
-            questions=dbase.get_questions(),
-            text_warnings=[],
-        )
+    def _load_stage_state_from_dbase(self, dbase: PrebuildDBase) -> StageState:
+        with dbase.unit_of_work():
+            state = StageState(
+                tests=self._read_selected_tests(dbase),
+                questions=list(
+                    dbase.iter_questions(
+                        test_ids=self.test_ids,
+                        question_ids=self.question_ids,
+                        since=self.since,
+                    )
+                ),
+                text_warnings=[],
+            )
+        state.track_changes()
+        return state
+
+    def _read_selected_tests(self, dbase: PrebuildDBase) -> list[PrebuildTest]:
+        # Selected questions don't select their tests
+        if self.question_ids is not None:
+            return []
+        return dbase.read_tests(test_ids=self.test_ids, since=self.since)
+
+    def _checkpoint_stage_state(
+        self,
+        dbase: PrebuildDBase,
+        state: StageState,
+        journals: list[StageJournal],
+        metrics: StageMetrics,
+    ) -> StageState:
+        self._save_stage_state_measured(dbase, state, metrics)
+        _remove_journals(journals)
+        load_start = time.perf_counter()
+        state = self._load_stage_state_from_dbase(dbase)
+        metrics.load_seconds += time.perf_counter() - load_start
+        return state
+
+    def _save_stage_state_measured(
+        self, dbase: PrebuildDBase, state: StageState, metrics: StageMetrics
+    ) -> None:
+        bytes_written = process_bytes_written()
+        save_start = time.perf_counter()
+        metrics.written_entities += self._save_stage_state_to_dbase(dbase, state)
+        metrics.save_seconds += time.perf_counter() - save_start
+        metrics.add_bytes_written(bytes_written, process_bytes_written())
 
-    def _save_stage_state_to_dbase(self, state: StageState) -> None:
-        dbase = PrebuildDBase(f"{self.output_dir}", backup=True)
-        for test in state.tests:
-            dbase.update_test(test)
-        for question in state.questions:
-            dbase.update_question(question)
-        for text_warning in state.text_warnings:
-            if text_warning.content:
-                dbase.add_text_warning(text_warning)
-            else:
-                dbase.delete_text_warning(text_warning)
-        dbase.close()
+    def _save_stage_state_to_dbase(
+        self, dbase: PrebuildDBase, state: StageState
+    ) -> int:
+        dbase.backup()
+        written = dbase.save_state(state)
+        print(f"Saved {written} changed entities")
+        return written
 
     def _make_prebuild_test(self, test_id, test: Test) -> PrebuildTest:
         return PrebuildTest(
@@ -207,3 +444,17 @@ class PrebuildBuilder:
             output_dir=f"{self.output_dir}/{stage_name}/questions",
             chunk_size=15,
         )
+
+
+def _has_changes(state: StageState) -> bool:
+    return bool(
+        state.text_warnings
+        or state.get_changed_tests()
+        or state.get_changed_questions()
+    )
+
+
+def _remove_journals(journals: list[StageJournal]) -> None:
+    for journal in journals:
+        journal.remove()
+    journals.clear()
@@ -1,9 +1,12 @@
 import copy
-import tqdm
+import hashlib
 import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Callable, TypeVar
+from quiz_dataset_tools.util.concurrency import adaptive_map
+from quiz_dataset_tools.prebuild.journal import JournalEntry, StageJournal
 from quiz_dataset_tools.prebuild.types import (
+    PrebuildText,
     PrebuildTextWarning,
     PrebuildAnswer,
     PrebuildQuestion,
@@ -11,7 +14,7 @@ from quiz_dataset_tools.prebuild.types import (
 )
 
 
-WORKERS_COUNT = 10
+T = TypeVar("T")
 
 
 @dataclass
@@ -19,28 +22,191 @@ class StageState:
     tests: list[PrebuildTest]
     questions: list[PrebuildQuestion]
     text_warnings: list[PrebuildTextWarning]
+    # Content fingerprints captured when the state was loaded,
+    # empty if the state isn't tracked and everything is considered changed.
+    test_fingerprints: dict[int, str] = field(default_factory=dict)
+    question_fingerprints: dict[int, str] = field(default_factory=dict)
+
+    def snapshot(self) -> "StageState":
+        # New lists that share the entities, stages replace the entities
+        # they change instead of mutating them (copy-on-write)
+        return StageState(
+            tests=list(self.tests),
+            questions=list(self.questions),
+            text_warnings=list(self.text_warnings),
+            test_fingerprints=self.test_fingerprints,
+            question_fingerprints=self.question_fingerprints,
+        )
+
+    def track_changes(self) -> None:
+        self.test_fingerprints = {
+            test.test_id: fingerprint(test) for test in self.tests
+        }
+        self.question_fingerprints = {
+            question.question_id: fingerprint(question) for question in self.questions
+        }
+
+    def get_changed_tests(self) -> list[PrebuildTest]:
+        return [
+            test
+            for test in self.tests
+            if self.test_fingerprints.get(test.test_id) != fingerprint(test)
+        ]
+
+    def get_changed_questions(self) -> list[PrebuildQuestion]:
+        return [
+            question
+            for question in self.questions
+            if self.question_fingerprints.get(question.question_id)
+            != fingerprint(question)
+        ]
+
+
+def fingerprint(obj: PrebuildTest | PrebuildQuestion) -> str:
+    # Dataclass repr covers every field recursively and is much cheaper
+    # than a JSON dump.
+    return hashlib.blake2b(repr(obj).encode(), digest_size=16).hexdigest()
+
+
+def get_texts(entity: PrebuildTest | PrebuildQuestion) -> list[PrebuildText]:
+    if isinstance(entity, PrebuildTest):
+        return [entity.title]
+    texts = [entity.text] + [answer.text for answer in entity.answers]
+    if entity.comment_text:
+        texts.append(entity.comment_text)
+    return texts
 
 
 class BaseStage:
+    # Results of processed questions, lets an interrupted run resume
+    journal: StageJournal | None = None
+    # Upper bound of concurrently processed questions, the actual number
+    # adapts to the remote services (see util.concurrency)
+    max_workers: int = 1
+    # Texts keep a mark of the content the stage processed last time, the
+    # stage skips tests and questions with all the texts marked. A mark is
+    # "<settings digest>:<content fingerprint>". None disables the marks.
+    mark_name: str | None = None
+    # Process everything regardless of the marks
+    force: bool = False
+
+    def set_journal(self, journal: StageJournal) -> None:
+        self.journal = journal
+
+    def set_max_workers(self, max_workers: int) -> None:
+        assert max_workers > 0, f"Bad workers count: {max_workers}"
+        self.max_workers = max_workers
+
+    def set_force(self, force: bool) -> None:
+        self.force = force
+
+    def get_mark_salt(self) -> str:
+        # Stage settings the result depends on, changing them invalidates
+        # the marks
+        return ""
+
+    def should_skip(self, entity: PrebuildTest | PrebuildQuestion) -> bool:
+        return not self.force and self.is_marked(entity)
+
+    def is_marked(self, entity: PrebuildTest | PrebuildQuestion) -> bool:
+        if not self.mark_name:
+            return False
+        prefix = self._get_mark_prefix()
+        return all(
+            text.stage_marks.get(self.mark_name)
+            == prefix + text.get_content_fingerprint()
+            for text in get_texts(entity)
+        )
+
+    def set_marks(self, entity: PrebuildTest | PrebuildQuestion) -> None:
+        # Only the mark of this stage is set. The marks of the other stages
+        # stay valid for the texts this stage left as they were, the changed
+        # texts are checked again by them.
+        if not self.mark_name:
+            return
+        prefix = self._get_mark_prefix()
+        for text in get_texts(entity):
+            text.stage_marks[self.mark_name] = prefix + text.get_content_fingerprint()
+
+    def get_settings_digest(self) -> str:
+        return hashlib.blake2b(self.get_mark_salt().encode(), digest_size=8).hexdigest()
+
+    def _get_mark_prefix(self) -> str:
+        return f"{self.get_settings_digest()}:"
+
     def setup(self):
         pass
 
     def process(self, state: StageState) -> StageState:
         return state
 
+    def flush(self):
+        pass
+
 
 class DataUpdateBaseStage(BaseStage):
+    # Tests and questions are updated concurrently with more than one
+    # worker, update_* methods must be thread-safe then
+
     def process(self, state: StageState) -> StageState:
-        result_state = copy.deepcopy(state)
-        for test in tqdm.tqdm(result_state.tests):
-            self.update_test(test)
-        for question in tqdm.tqdm(result_state.questions):
-            question_copy = copy.deepcopy(question)
-            for answer in question.answers:
-                self.update_answer(question_copy, answer)
-            self.update_question(question)
+        result_state = state.snapshot()
+        result_state.tests = self._map(self._process_test, state.tests)
+        result_state.questions = self._map(self._process_question, state.questions)
         return result_state
 
+    def _map(self, func: Callable[[T], T], items: list[T]) -> list[T]:
+        return adaptive_map(func, items, self.max_workers)
+
+    def _process_test(self, test: PrebuildTest) -> PrebuildTest:
+        if self.should_skip(test):
+            return test
+        input_fingerprint = fingerprint(test)
+        try:
+            test_copy = test.copy()
+            self.update_test(test_copy)
+            self.set_marks(test_copy)
+        except Exception as e:
+            raise Exception(f"Failed to update test {test.test_id}: {e}") from e
+        # Keep the shared instance if nothing was changed
+        return test if fingerprint(test_copy) == input_fingerprint else test_copy
+
+    def _process_question(self, question: PrebuildQuestion) -> PrebuildQuestion:
+        if self.should_skip(question):
+            return question
+        input_fingerprint = fingerprint(question)
+        if self.journal:
+            entry = self.journal.get(question.question_id, input_fingerprint)
+            if entry:
+                return entry.question or question
+        result = self._update_question(question, input_fingerprint)
+        if self.journal:
+            self.journal.record(
+                JournalEntry(
+                    question_id=question.question_id,
+                    input_fingerprint=input_fingerprint,
+                    question=None if result is question else result,
+                )
+            )
+        return result
+
+    def _update_question(
+        self, question: PrebuildQuestion, input_fingerprint: str
+    ) -> PrebuildQuestion:
+        try:
+            question_copy = question.copy()
+            # Answers see the question as it was before the stage
+            for answer in question_copy.answers:
+                self.update_answer(question, answer)
+            self.update_question(question_copy)
+            self.set_marks(question_copy)
+        except Exception as e:
+            raise Exception(
+                f"Failed to update question {question.question_id}: {e}"
+            ) from e
+        if fingerprint(question_copy) == input_fingerprint:
+            return question
+        return question_copy
+
     def update_test(self, test: PrebuildTest) -> None:
         pass
 
@@ -53,13 +219,16 @@ class DataUpdateBaseStage(BaseStage):
 
 class VerificationStage(BaseStage):
     def process(self, state: StageState) -> StageState:
-        result_state = copy.deepcopy(state)
-        with ThreadPoolExecutor(max_workers=WORKERS_COUNT) as executor:
-            for result in tqdm.tqdm(
-                executor.map(self._process_question, result_state.questions),
-                total=len(result_state.questions),
-            ):
-                result_state.text_warnings.extend(result)
+        # Checks only read the questions, no copies needed
+        result_state = state.snapshot()
+        for warnings in adaptive_map(
+            self._process_question, result_state.questions, self.max_workers
+        ):
+            result_state.text_warnings.extend(warnings)
+        if self.mark_name:
+            result_state.questions = [
+                self._mark_question(question) for question in result_state.questions
+            ]
         return result_state
 
     def check_question(self, question: PrebuildQuestion) -> list[PrebuildTextWarning]:
@@ -70,10 +239,36 @@ class VerificationStage(BaseStage):
     ) -> list[PrebuildTextWarning]:
         return []
 
+    def _mark_question(self, question: PrebuildQuestion) -> PrebuildQuestion:
+        # Copy-on-write, checks don't change the questions otherwise
+        if self.is_marked(question):
+            return question
+        question_copy = question.copy()
+        self.set_marks(question_copy)
+        return question_copy
+
     def _process_question(self, question: PrebuildQuestion):
-        question_copy = copy.deepcopy(question)
+        if self.should_skip(question):
+            return []
+        if self.journal:
+            input_fingerprint = fingerprint(question)
+            entry = self.journal.get(question.question_id, input_fingerprint)
+            if entry:
+                return entry.warnings
+        warnings = self._check_question(question)
+        if self.journal:
+            self.journal.record(
+                JournalEntry(
+                    question_id=question.question_id,
+                    input_fingerprint=input_fingerprint,
+                    warnings=warnings,
+                )
+            )
+        return warnings
+
+    def _check_question(self, question: PrebuildQuestion):
         warnings = []
         for answer in question.answers:
-            warnings.extend(self.check_answer(question_copy, answer))
+            warnings.extend(self.check_answer(question, answer))
         warnings.extend(self.check_question(question))
         return warnings
@@ -33,7 +33,7 @@ class ComposeStage(BaseStage):
         self.random_seed = random_seed
 
     def process(self, state: StageState) -> StageState:
-        result_state = copy.deepcopy(state)
+        result_state = state.snapshot()
         if self.mode == ComposeMode.SKIP:
             pass
         elif self.mode == ComposeMode.FIX_MISSED:
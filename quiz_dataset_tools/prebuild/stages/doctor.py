@@ -21,9 +21,13 @@ from quiz_dataset_tools.prebuild.types import (
 
 ANSWERS_COUNT = 4
 ANSWERS_AUTO_ADD = False
+# Checks of different questions are independent GPT calls
+DOCTOR_MAX_WORKERS = 10
 
 
 class DoctorStage(VerificationStage):
+    mark_name = "doctor"
+
     def __init__(self, domain: str):
         self.canonical_doctor = TextCanonicalDoctor(domain)
         self.sanity_doctor = TextSanityDoctor()
@@ -1,6 +1,6 @@
 import os, shutil
 from quiz_dataset_tools.util.fs import prepare_output_dir
-from quiz_dataset_tools.prebuild.stage import DataUpdateBaseStage
+from quiz_dataset_tools.prebuild.stage import DataUpdateBaseStage, StageState
 from quiz_dataset_tools.prebuild.types import PrebuildTest, PrebuildQuestion
 from quiz_dataset_tools.prebuild.dbase import PrebuildDBase
 
@@ -17,6 +17,11 @@ class FinalStage(DataUpdateBaseStage):
         prepare_output_dir(self.images_dir)
         self.dbase.bootstrap()
 
+    def process(self, state: StageState) -> StageState:
+        # Insert the whole initial state in one transaction
+        with self.dbase.unit_of_work():
+            return super().process(state)
+
     def update_test(self, test: PrebuildTest) -> None:
         self.dbase.add_test(test)
 
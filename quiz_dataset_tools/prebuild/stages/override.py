@@ -13,11 +13,20 @@ from quiz_dataset_tools.prebuild.overrides import (
 
 
 class OverrideStage(DataUpdateBaseStage):
+    mark_name = "override"
+
     def __init__(self, languages: list[Language], overrides: TextOverrides):
         self.languages = languages
         self.overrides = overrides
         self.matched_count = 0
         self.missed_count = 0
+        # New overrides are applied to every text
+        self.mark_salt = ",".join(lang.name for lang in languages) + (
+            f":{overrides.get_fingerprint()}"
+        )
+
+    def get_mark_salt(self) -> str:
+        return self.mark_salt
 
     def update_question(self, question: PrebuildQuestion) -> None:
         self._override_text(question.text, make_question_context(question))
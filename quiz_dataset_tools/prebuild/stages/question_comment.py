@@ -11,6 +11,7 @@ from quiz_dataset_tools.prebuild.extra.question_comment import (
 
 class QuestionCommentStage(DataUpdateBaseStage):
     service: QuestionCommentService
+    mark_name = "question-comments"
 
     def __init__(self, domain: str, images_dir: str):
         self.service = QuestionCommentService(domain, images_dir)
@@ -12,10 +12,14 @@ from quiz_dataset_tools.prebuild.translation.translation import (
 
 class TranslateStage(DataUpdateBaseStage):
     translator: Translator
+    mark_name = "translate"
 
     def __init__(self, translator: Translator):
         self.translator = translator
 
+    def get_mark_salt(self) -> str:
+        return ",".join(sorted(lang.name for lang in self.translator.languages))
+
     def update_test(self, test: PrebuildTest) -> None:
         test.title = self.translator.translate_test(test.title)
 
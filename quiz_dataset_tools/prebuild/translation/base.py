@@ -18,6 +18,33 @@ class BaseTranslator:
     ) -> str:
         return answer_content
 
+    # The *_multi methods translate into several languages at once, one call
+    # per language by default
+
+    def translate_question_multi(
+        self, question_content: str, langs: list[Language]
+    ) -> dict[Language, str]:
+        return {lang: self.translate_question(question_content, lang) for lang in langs}
+
+    def translate_question_comment_multi(
+        self, question_comment_content: str, langs: list[Language]
+    ) -> dict[Language, str]:
+        return {
+            lang: self.translate_question_comment(question_comment_content, lang)
+            for lang in langs
+        }
+
+    def translate_answer_multi(
+        self,
+        answer_content: str,
+        question_content: str,
+        langs: list[Language],
+    ) -> dict[Language, str]:
+        return {
+            lang: self.translate_answer(answer_content, question_content, lang)
+            for lang in langs
+        }
+
     def save_cache(self):
         pass
 
@@ -1,14 +1,25 @@
-from typing import override
+import json
+import logging
+from typing import Callable, override
 from quiz_dataset_tools.constants import (
     DOMAIN_TEST_TYPE,
     DOMAIN_UNITS_SYSTEM,
     GPT_MODEL,
 )
 from quiz_dataset_tools.util.language import Language
-from quiz_dataset_tools.util.gpt import GPTServiceWithCache
+from quiz_dataset_tools.util.gpt import BATCH_PLACEHOLDER, GPTServiceWithCache
 from quiz_dataset_tools.prebuild.translation.base import BaseTranslator
 
 
+logger = logging.getLogger(__name__)
+
+SINGLE_OUTPUT = "Print only the final version without comments."
+MULTI_OUTPUT = (
+    "Print only a JSON object that maps each language code ({codes}) to the final"
+    " version of its translation, without comments."
+)
+
+
 class GPTTranslator(BaseTranslator):
     test_type: str
     units_system: str
@@ -21,8 +32,77 @@ class GPTTranslator(BaseTranslator):
 
     @override
     def translate_question(self, question_content: str, dest_lang: Language) -> str:
-        prompt = f"""
-Translate the following {self.test_type} question into {dest_lang.value.name}, using a formal tone appropriate for a driving exam and targeting an average-level audience.
+        return self._call_gpt(
+            self._question_prompt(question_content, dest_lang.value.name, SINGLE_OUTPUT)
+        )
+
+    @override
+    def translate_question_multi(
+        self, question_content: str, dest_langs: list[Language]
+    ) -> dict[Language, str]:
+        return self._translate_multi(
+            dest_langs,
+            lambda dest, output: self._question_prompt(question_content, dest, output),
+        )
+
+    def translate_question_comment(
+        self, question_comment_content: str, dest_lang: Language
+    ) -> str:
+        return self._call_gpt(
+            self._question_comment_prompt(
+                question_comment_content, dest_lang.value.name, SINGLE_OUTPUT
+            )
+        )
+
+    @override
+    def translate_question_comment_multi(
+        self, question_comment_content: str, dest_langs: list[Language]
+    ) -> dict[Language, str]:
+        return self._translate_multi(
+            dest_langs,
+            lambda dest, output: self._question_comment_prompt(
+                question_comment_content, dest, output
+            ),
+        )
+
+    @override
+    def translate_answer(
+        self,
+        answer_content: str,
+        question_content: str,
+        dest_lang: Language,
+    ) -> str:
+        return self._call_gpt(
+            self._answer_prompt(
+                answer_content, question_content, dest_lang.value.name, SINGLE_OUTPUT
+            )
+        )
+
+    @override
+    def translate_answer_multi(
+        self,
+        answer_content: str,
+        question_content: str,
+        dest_langs: list[Language],
+    ) -> dict[Language, str]:
+        return self._translate_multi(
+            dest_langs,
+            lambda dest, output: self._answer_prompt(
+                answer_content, question_content, dest, output
+            ),
+        )
+
+    @override
+    def save_cache(self):
+        self.gpt_service.save_cache()
+
+    @override
+    def load_cache(self):
+        self.gpt_service.load_cache()
+
+    def _question_prompt(self, question_content: str, dest: str, output: str) -> str:
+        return f"""
+Translate the following {self.test_type} question into {dest}, using a formal tone appropriate for a driving exam and targeting an average-level audience.
 Maintain consistency with standard driving terminology.
 Stay as literal as possible without interpreting the meaning.
 Assume that there are multiple answers provided to chose from.
@@ -30,38 +110,32 @@ Keep units in {self.units_system} and do not convert.
 ```
 {question_content}
 ```
-Then, review the translation as a native language speaker and revise any phrasing that may sound unnatural. Print only the final version without comments.
+Then, review the translation as a native language speaker and revise any phrasing that may sound unnatural. {output}
         """
-        return self._call_gpt(prompt)
 
-    def translate_question_comment(
-        self, question_comment_content: str, dest_lang: Language
+    def _question_comment_prompt(
+        self, question_comment_content: str, dest: str, output: str
     ) -> str:
-        prompt = f"""
-Translate the following {self.test_type} question comment into {dest_lang.value.name}, using a formal tone appropriate for a driving exam and targeting an average-level audience.
+        return f"""
+Translate the following {self.test_type} question comment into {dest}, using a formal tone appropriate for a driving exam and targeting an average-level audience.
 Maintain consistency with standard driving terminology.
 Stay as literal as possible without interpreting the meaning.
 Keep units in {self.units_system} and do not convert.
 ```
 {question_comment_content}
 ```
-Then, review the translation as a native language speaker and revise any phrasing that may sound unnatural. Print only the final version without comments.
+Then, review the translation as a native language speaker and revise any phrasing that may sound unnatural. {output}
         """
-        return self._call_gpt(prompt)
 
-    @override
-    def translate_answer(
-        self,
-        answer_content: str,
-        question_content: str,
-        dest_lang: Language,
+    def _answer_prompt(
+        self, answer_content: str, question_content: str, dest: str, output: str
     ) -> str:
-        prompt = f"""
+        return f"""
 Translate the following {self.test_type} question answer
 ```
 {answer_content}
 ```
-into {dest_lang.value.name}, using a formal tone appropriate for a driving exam and targeting an average-level audience.
+into {dest}, using a formal tone appropriate for a driving exam and targeting an average-level audience.
 Maintain consistency with standard driving terminology.
 Stay as literal as possible without interpreting the meaning.
 Keep units in {self.units_system} and do not convert.
@@ -70,17 +144,80 @@ Assume that the question is
 {question_content}
 ```
 Don't include the question in the response.
-Then, review the translation as a native language speaker and revise any phrasing that may sound unnatural. Print only the final version without comments.
+Then, review the translation as a native language speaker and revise any phrasing that may sound unnatural. {output}
         """
-        return self._call_gpt(prompt)
 
-    @override
-    def save_cache(self):
-        self.gpt_service.save_cache()
+    def _translate_multi(
+        self, dest_langs: list[Language], make_prompt: Callable[[str, str], str]
+    ) -> dict[Language, str]:
+        # Languages missing in the cache are asked in one prompt, each result
+        # is cached under its single language prompt, the response itself is
+        # not cached. Languages the response lacks are asked one by one.
+        results: dict[Language, str] = {}
+        missing_langs = []
+        for lang in sorted(dest_langs, key=lambda lang: lang.value.language_id):
+            cached = self.gpt_service.get_cached(
+                make_prompt(lang.value.name, SINGLE_OUTPUT)
+            )
+            if cached:
+                results[lang] = _clean(cached)
+            else:
+                missing_langs.append(lang)
+        if len(missing_langs) > 1:
+            names = ", ".join(
+                f"{lang.value.name} ({lang.name})" for lang in missing_langs
+            )
+            codes = ", ".join(lang.name for lang in missing_langs)
 
-    @override
-    def load_cache(self):
-        self.gpt_service.load_cache()
+            def put_translations(response: str) -> dict[Language, str]:
+                translations = _parse_translations(response, missing_langs)
+                for lang, translation in translations.items():
+                    self.gpt_service.put_cached(
+                        make_prompt(lang.value.name, SINGLE_OUTPUT), translation
+                    )
+                return translations
+
+            response = self.gpt_service.send_prompt_uncached(
+                make_prompt(names, MULTI_OUTPUT.format(codes=codes)),
+                put_translations,
+            )
+            # Placeholder of a batch dry run, the translations are cached
+            # when the batch comes back
+            if response == BATCH_PLACEHOLDER:
+                return {lang: BATCH_PLACEHOLDER for lang in dest_langs}
+            for lang, translation in put_translations(response).items():
+                results[lang] = _clean(translation)
+        for lang in missing_langs:
+            if lang not in results:
+                results[lang] = self._call_gpt(
+                    make_prompt(lang.value.name, SINGLE_OUTPUT)
+                )
+        return results
 
     def _call_gpt(self, prompt: str):
-        return self.gpt_service.send_prompt(prompt).strip("\n\t '`\"«»")
+        return _clean(self.gpt_service.send_prompt(prompt))
+
+
+def _clean(content: str) -> str:
+    return content.strip("\n\t '`\"«»")
+
+
+def _parse_translations(response: str, langs: list[Language]) -> dict[Language, str]:
+    # Valid translations of a multi language response by language
+    start = response.find("{")
+    end = response.rfind("}")
+    try:
+        data = json.loads(response[start : end + 1]) if 0 <= start < end else None
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        logger.warning(f"Bad multi language translation: {response}")
+        return {}
+    translations = {}
+    for lang in langs:
+        translation = data.get(lang.name)
+        if isinstance(translation, str) and _clean(translation):
+            translations[lang] = translation
+        else:
+            logger.warning(f"No {lang.name} translation in: {response}")
+    return translations
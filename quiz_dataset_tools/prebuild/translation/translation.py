@@ -17,14 +17,14 @@ class Translator:
         self.languages = set(languages)
 
     def translate_test(self, test_text: PrebuildText) -> PrebuildText:
-        def translate_fn(content: str, lang: Language) -> str:
-            return content
+        def translate_fn(content: str, langs: list[Language]) -> dict[Language, str]:
+            return {lang: content for lang in langs}
 
         return self._translate_text(test_text, translate_fn)
 
     def translate_question(self, question_text: PrebuildText) -> PrebuildText:
-        def translate_fn(content: str, lang: Language) -> str:
-            return self.impl.translate_question(content, lang)
+        def translate_fn(content: str, langs: list[Language]) -> dict[Language, str]:
+            return self.impl.translate_question_multi(content, langs)
 
         return self._translate_text(question_text, translate_fn)
 
@@ -35,8 +35,8 @@ class Translator:
         if not self._has_canonical_content(question_comment_text):
             return None
 
-        def translate_fn(content: str, lang: Language) -> str:
-            return self.impl.translate_question_comment(content, lang)
+        def translate_fn(content: str, langs: list[Language]) -> dict[Language, str]:
+            return self.impl.translate_question_comment_multi(content, langs)
 
         return self._translate_text(question_comment_text, translate_fn)
 
@@ -45,8 +45,8 @@ class Translator:
     ) -> PrebuildText:
         question_content = self._get_canonical_content(question_text)
 
-        def translate_fn(content: str, lang: Language) -> str:
-            return self.impl.translate_answer(content, question_content, lang)
+        def translate_fn(content: str, langs: list[Language]) -> dict[Language, str]:
+            return self.impl.translate_answer_multi(content, question_content, langs)
 
         return self._translate_text(answer_text, translate_fn)
 
@@ -69,29 +69,37 @@ class Translator:
         return canonical_local.content
 
     def _translate_text(
-        self, text: PrebuildText, translate_fn: Callable[[str, Language], str]
+        self,
+        text: PrebuildText,
+        translate_fn: Callable[[str, list[Language]], dict[Language, str]],
     ) -> PrebuildText:
         canonical_local_content = self._get_canonical_content(text)
         is_stable_content = is_stable_text(canonical_local_content)
         translated_text = copy.copy(text)
-        for lang in self.languages:
+        langs = []
+        for lang in sorted(self.languages, key=lambda lang: lang.value.language_id):
             if lang == self.canonical_lang:
                 continue
             translated_local = translated_text.localizations.get(lang)
             if translated_local and translated_local.content and not is_stable_content:
                 continue
-            # Overwrite translation in case if stability
-            # condition was updated
-            translated_local_content = (
-                canonical_local_content
-                if is_stable_content
-                else translate_fn(canonical_local_content, lang)
-            )
+            langs.append(lang)
+        if not langs:
+            return translated_text
+        # Overwrite translation in case if stability
+        # condition was updated
+        translated_contents = (
+            {lang: canonical_local_content for lang in langs}
+            if is_stable_content
+            else translate_fn(canonical_local_content, langs)
+        )
+        for lang in langs:
+            translated_local = translated_text.localizations.get(lang)
             translated_local_id = (
                 translated_local.text_localization_id if translated_local else None
             )
             translated_text.localizations.set(
-                lang, translated_local_content, translated_local_id
+                lang, translated_contents[lang], translated_local_id
             )
         return translated_text
 
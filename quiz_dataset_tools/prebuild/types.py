@@ -1,4 +1,6 @@
-from dataclasses import dataclass, field
+import copy
+import hashlib
+from dataclasses import dataclass, field, replace
 from dataclasses_json import DataClassJsonMixin
 from quiz_dataset_tools.paraphrase.types import ParaphrasedText
 from quiz_dataset_tools.util.language import (
@@ -28,6 +30,31 @@ class PrebuildText(DataClassJsonMixin):
     warnings: list[PrebuildTextWarning] = field(default_factory=lambda: [])
     is_manually_checked: bool = False
     last_update_timestamp: int | None = None
+    # Stage name to the mark of the content the stage processed last time
+    stage_marks: dict[str, str] = field(default_factory=lambda: {})
+
+    def get_content_fingerprint(self) -> str:
+        # Covers the content only, localization ids are assigned on save
+        parts = []
+        if self.original:
+            original = self.original.get(Language.EN)
+            parts.append(f"original:{original.content if original else ''}")
+        for lang in Language:
+            localization = self.localizations.get(lang)
+            if localization is not None:
+                parts.append(f"{lang.name}:{localization.content}")
+        return hashlib.blake2b("\n".join(parts).encode(), digest_size=16).hexdigest()
+
+    def copy(self) -> "PrebuildText":
+        # Copy-on-write copy, much cheaper than deepcopy
+        return replace(
+            self,
+            localizations=self.localizations.copy(),
+            original=self.original.copy() if self.original else None,
+            paraphrase=copy.copy(self.paraphrase),
+            warnings=[copy.copy(warning) for warning in self.warnings],
+            stage_marks=dict(self.stage_marks),
+        )
 
     def get_canonical(self) -> TextLocalization:
         local_canonical = self.localizations.get_canonical()
@@ -48,6 +75,9 @@ class PrebuildAnswer(DataClassJsonMixin):
     answer_id: int | None = None
     question_id: int | None = None
 
+    def copy(self) -> "PrebuildAnswer":
+        return replace(self, text=self.text.copy())
+
 
 @dataclass
 class PrebuildQuestion(DataClassJsonMixin):
@@ -59,6 +89,14 @@ class PrebuildQuestion(DataClassJsonMixin):
     audio: str | None = None
     comment_text: PrebuildText | None = None
 
+    def copy(self) -> "PrebuildQuestion":
+        return replace(
+            self,
+            text=self.text.copy(),
+            answers=[answer.copy() for answer in self.answers],
+            comment_text=self.comment_text.copy() if self.comment_text else None,
+        )
+
 
 @dataclass
 class PrebuildQuestionImage(DataClassJsonMixin):
@@ -71,3 +109,6 @@ class PrebuildTest(DataClassJsonMixin):
     test_id: int
     title: PrebuildText
     position: int | None = None
+
+    def copy(self) -> "PrebuildTest":
+        return replace(self, title=self.title.copy())
@@ -1,4 +1,5 @@
 from fastapi import UploadFile
+from quiz_dataset_tools.constants import DOMAINS
 from quiz_dataset_tools.prebuild.dbase import PrebuildDBase
 from quiz_dataset_tools.server.models.tests import GetTestsRequest, GetTestsResponse
 from quiz_dataset_tools.server.models.questions import (
@@ -18,7 +19,7 @@ from quiz_dataset_tools.server.models.text_warnings import (
 
 
 class DatabaseService:
-    domains_list = ["bc", "ca", "fl", "ny", "on", "tx"]
+    domains_list = DOMAINS
 
     def __init__(self, data_dir: str):
         self.data_dir = data_dir
@@ -39,13 +40,13 @@ class DatabaseService:
 
     def get_tests(self, req: GetTestsRequest) -> GetTestsResponse:
         return GetTestsResponse(
-            error_code=0, payload=self.get_dbase(req.domain).get_tests()
+            error_code=0, payload=self.get_dbase(req.domain).read_tests()
         )
 
     def get_questions(self, req: GetQuestionsRequest) -> GetQuestionsResponse:
         return GetQuestionsResponse(
             error_code=0,
-            payload=self.get_dbase(req.domain).get_questions_by_test(req.test_id),
+            payload=self.get_dbase(req.domain).read_questions(test_ids=[req.test_id]),
         )
 
     def set_question_image(
@@ -24,8 +24,8 @@ class MimicService:
     def search_test_texts(
         self, req: SearchTestMimicTextsRequest
     ) -> SearchTestMimicTextsResponse:
-        questions = self.database_service.get_dbase(req.domain).get_questions_by_test(
-            req.test_id
+        questions = self.database_service.get_dbase(req.domain).read_questions(
+            test_ids=[req.test_id]
         )
         return SearchTestMimicTextsResponse(
             error_code=0,
@@ -1,12 +1,30 @@
 #!/usr/bin/env python3
 
 import click
+import time
+from typing import Any, Callable
 from quiz_dataset_tools.util.language import Language
 from quiz_dataset_tools.util.builder import DatabaseBuilder
 from quiz_dataset_tools.util.dbase import DriverTestDBase
 from quiz_dataset_tools.util.fs import prepare_output_dir
 from quiz_dataset_tools.util.text_overrides import TextOverrides
+from quiz_dataset_tools.util.backup import BackupPolicy
+from quiz_dataset_tools.util.sqlite import SqlitePragmas
+from quiz_dataset_tools.util.gpt_batch import OpenAIBatchBackend
+from quiz_dataset_tools.util.rate_limit import RATE_LIMIT_FILE, RateLimiter
+from quiz_dataset_tools.util.image import (
+    IMAGE_MAX_SIZE,
+    IMAGE_QUALITY,
+    set_image_options,
+)
+from quiz_dataset_tools.util.domains import (
+    get_domains_list,
+    print_summary,
+    run_domains,
+)
 from quiz_dataset_tools.prebuild.prebuild import PrebuildBuilder
+from quiz_dataset_tools.prebuild.stages.doctor import DOCTOR_MAX_WORKERS
+from quiz_dataset_tools.prebuild.journal import JOURNAL_INTERVAL
 from quiz_dataset_tools.parser.parser import Parser
 from quiz_dataset_tools.parser.dbase import DatabaseParser
 from quiz_dataset_tools.parser.usa import (
@@ -72,6 +90,157 @@ option_fallback_language = click.option(
 )
 
 
+option_sqlite_pragmas = click.option(
+    "--sqlite-pragmas",
+    show_default=True,
+    default="",
+    type=str,
+    help="Comma separated prebuild.db pragma overrides, e.g. synchronous=FULL,busy_timeout=5000.",
+)
+
+
+option_backup_policy = click.option(
+    "--backup-policy",
+    show_default=True,
+    default="",
+    type=str,
+    help="Comma separated prebuild.db backup retention overrides, e.g. keep_last=5,keep_daily=7.",
+)
+
+
+def option_max_workers(default: int | None = 1):
+    # None leaves the default to the stages
+    return click.option(
+        "--max-workers",
+        show_default=default is not None,
+        default=default,
+        type=click.IntRange(min=1),
+        help="Upper bound of questions processed concurrently, the actual number adapts to the API rate limits."
+        + (
+            f" Defaults to {DOCTOR_MAX_WORKERS} for doctor and 1 for the other stages."
+            if default is None
+            else ""
+        ),
+    )
+
+
+option_journal_interval = click.option(
+    "--journal-interval",
+    show_default=True,
+    default=JOURNAL_INTERVAL,
+    type=click.IntRange(min=0),
+    help="Number of processed questions between journal writes, an interrupted run resumes from the journal. Zero disables the journal.",
+)
+
+
+option_metrics = click.option(
+    "--metrics",
+    is_flag=True,
+    default=False,
+    help="Append per-stage metrics to output/domains/{domain}/metrics.jsonl.",
+)
+
+
+option_domains = click.option(
+    "--domain",
+    "--domains",
+    "domains",
+    required=True,
+    type=str,
+    help="Comma separated domains to work with or 'all', every domain runs in its own process.",
+)
+
+
+def option_filters(func):
+    # Partial runs, the filters are combined
+    func = click.option(
+        "--since",
+        required=False,
+        type=int,
+        help="Select entities with texts updated since the unix timestamp.",
+    )(func)
+    func = click.option(
+        "--question-ids",
+        required=False,
+        type=str,
+        help="Comma separated question ids to select, no tests are selected then.",
+    )(func)
+    func = click.option(
+        "--test-ids",
+        required=False,
+        type=str,
+        help="Comma separated test ids to select.",
+    )(func)
+    return func
+
+
+option_force = click.option(
+    "--force",
+    is_flag=True,
+    default=False,
+    help="Process every text, even the ones the stage processed before without changes since then.",
+)
+
+
+option_batch = click.option(
+    "--batch",
+    is_flag=True,
+    default=False,
+    help="Send the GPT prompts missing in the cache with the Batch API before every stage.",
+)
+
+
+option_max_requests = click.option(
+    "--max-requests",
+    show_default=True,
+    default=10,
+    type=click.IntRange(min=1),
+    help="Number of GPT requests in flight shared by all the domains.",
+)
+
+
+def option_image(func):
+    # Images sent with the GPT prompts
+    func = click.option(
+        "--image-quality",
+        show_default=True,
+        default=IMAGE_QUALITY,
+        type=click.IntRange(min=1, max=95),
+        help="JPEG quality of the images sent to GPT.",
+    )(func)
+    func = click.option(
+        "--image-max-size",
+        show_default=True,
+        default=IMAGE_MAX_SIZE,
+        type=click.IntRange(min=1),
+        help="Images sent to GPT are scaled down to fit the size on either side.",
+    )(func)
+    return func
+
+
+def option_rate_limits(func):
+    func = click.option(
+        "--rate-limit-file",
+        show_default=True,
+        default=RATE_LIMIT_FILE,
+        type=str,
+        help="Rate limit state shared by the domains and concurrent runs, empty keeps it in memory (a single domain only).",
+    )(func)
+    func = click.option(
+        "--tpm",
+        required=False,
+        type=click.IntRange(min=1),
+        help="GPT tokens per minute of all the domains, no limit by default.",
+    )(func)
+    func = click.option(
+        "--rpm",
+        required=False,
+        type=click.IntRange(min=1),
+        help="GPT requests per minute of all the domains, no limit by default.",
+    )(func)
+    return func
+
+
 @main.command()
 @option_domain
 @option_parser
@@ -90,11 +259,45 @@ def prebuild_init(
 
 
 @main.command()
-@option_domain
+@option_domains
 @option_languages
+@option_sqlite_pragmas
+@option_backup_policy
+@option_max_workers()
+@option_journal_interval
+@option_metrics
+@option_filters
+@option_force
+@option_batch
+@option_max_requests
+@option_rate_limits
 def prebuild_translate(
+    domains: str,
+    max_requests: int,
+    rpm: int | None,
+    tpm: int | None,
+    rate_limit_file: str,
+    **kwargs,
+) -> None:
+    rate_limiter = get_rate_limiter(rpm, tpm, rate_limit_file)
+    run_for_domains(
+        run_prebuild_translate, domains, max_requests, rate_limiter, **kwargs
+    )
+
+
+def run_prebuild_translate(
     domain: str,
     languages: str,
+    sqlite_pragmas: str,
+    backup_policy: str,
+    max_workers: int,
+    journal_interval: int,
+    metrics: bool,
+    test_ids: str | None,
+    question_ids: str | None,
+    since: int | None,
+    force: bool,
+    batch: bool,
 ) -> None:
     languages_list = get_languages_list(languages)
     translator = Translator(
@@ -105,29 +308,104 @@ def prebuild_translate(
 
     builder = PrebuildBuilder()
     builder.set_output_dir(get_prebuild_dir(domain))
+    builder.set_dbase_pragmas(SqlitePragmas.from_str(sqlite_pragmas))
+    builder.set_backup_policy(BackupPolicy.from_str(backup_policy))
+    if metrics:
+        builder.set_metrics_path(get_metrics_path(domain))
+    builder.set_filter(get_ids_list(test_ids), get_ids_list(question_ids), since)
+    builder.set_force(force)
+    if batch:
+        builder.set_batch_backend(OpenAIBatchBackend())
     builder.set_languages(languages_list)
     builder.set_translator(translator)
+    builder.set_max_workers(max_workers)
+    builder.set_journal_interval(journal_interval)
     builder.run_translate()
 
     translator.save_cache()
 
 
 @main.command()
-@option_domain
+@option_domains
+@option_sqlite_pragmas
+@option_backup_policy
+@option_max_workers()
+@option_journal_interval
+@option_metrics
+@option_filters
+@option_force
+@option_batch
+@option_max_requests
+@option_image
+@option_rate_limits
 def prebuild_question_comments(
+    domains: str,
+    max_requests: int,
+    rpm: int | None,
+    tpm: int | None,
+    rate_limit_file: str,
+    **kwargs,
+) -> None:
+    rate_limiter = get_rate_limiter(rpm, tpm, rate_limit_file)
+    run_for_domains(
+        run_prebuild_question_comments, domains, max_requests, rate_limiter, **kwargs
+    )
+
+
+def run_prebuild_question_comments(
     domain: str,
+    sqlite_pragmas: str,
+    backup_policy: str,
+    max_workers: int,
+    journal_interval: int,
+    metrics: bool,
+    test_ids: str | None,
+    question_ids: str | None,
+    since: int | None,
+    force: bool,
+    batch: bool,
+    image_max_size: int,
+    image_quality: int,
 ) -> None:
+    set_image_options(image_max_size, image_quality)
     builder = PrebuildBuilder()
     builder.set_output_dir(get_prebuild_dir(domain))
+    builder.set_dbase_pragmas(SqlitePragmas.from_str(sqlite_pragmas))
+    builder.set_backup_policy(BackupPolicy.from_str(backup_policy))
+    if metrics:
+        builder.set_metrics_path(get_metrics_path(domain))
+    builder.set_filter(get_ids_list(test_ids), get_ids_list(question_ids), since)
+    builder.set_force(force)
+    if batch:
+        builder.set_batch_backend(OpenAIBatchBackend())
+    builder.set_max_workers(max_workers)
+    builder.set_journal_interval(journal_interval)
     builder.run_question_comment(domain)
 
 
 @main.command()
-@option_domain
+@option_domains
 @option_data_path
-def prebuild_override(
+@option_sqlite_pragmas
+@option_backup_policy
+@option_metrics
+@option_filters
+@option_force
+def prebuild_override(domains: str, **kwargs) -> None:
+    # No GPT requests, the request budget is not used
+    run_for_domains(run_prebuild_override, domains, 1, **kwargs)
+
+
+def run_prebuild_override(
     domain: str,
     data_path: str,
+    sqlite_pragmas: str,
+    backup_policy: str,
+    metrics: bool,
+    test_ids: str | None,
+    question_ids: str | None,
+    since: int | None,
+    force: bool,
 ) -> None:
     languages = [lang for lang in Language]
 
@@ -136,6 +414,12 @@ def prebuild_override(
 
     builder = PrebuildBuilder()
     builder.set_output_dir(get_prebuild_dir(domain))
+    builder.set_dbase_pragmas(SqlitePragmas.from_str(sqlite_pragmas))
+    builder.set_backup_policy(BackupPolicy.from_str(backup_policy))
+    if metrics:
+        builder.set_metrics_path(get_metrics_path(domain))
+    builder.set_filter(get_ids_list(test_ids), get_ids_list(question_ids), since)
+    builder.set_force(force)
     builder.set_languages(languages)
     builder.set_overrides(overrides)
     builder.run_override()
@@ -145,16 +429,31 @@ def prebuild_override(
 @option_domain
 @option_languages
 @option_data_path
+@option_sqlite_pragmas
+@option_backup_policy
+@option_metrics
+@option_filters
 def prebuild_dump_overrides(
     domain: str,
     languages: str,
     data_path: str,
+    sqlite_pragmas: str,
+    backup_policy: str,
+    metrics: bool,
+    test_ids: str | None,
+    question_ids: str | None,
+    since: int | None,
 ) -> None:
     overrides = TextOverrides(data_path=data_path)
     overrides.load()
 
     builder = PrebuildBuilder()
     builder.set_output_dir(get_prebuild_dir(domain))
+    builder.set_dbase_pragmas(SqlitePragmas.from_str(sqlite_pragmas))
+    builder.set_backup_policy(BackupPolicy.from_str(backup_policy))
+    if metrics:
+        builder.set_metrics_path(get_metrics_path(domain))
+    builder.set_filter(get_ids_list(test_ids), get_ids_list(question_ids), since)
     builder.set_languages(get_languages_list(languages))
     builder.set_overrides(overrides)
     builder.run_dump_overrides()
@@ -163,15 +462,164 @@ def prebuild_dump_overrides(
 
 
 @main.command()
-@option_domain
+@option_domains
+@option_sqlite_pragmas
+@option_backup_policy
+@option_max_workers(default=DOCTOR_MAX_WORKERS)
+@option_journal_interval
+@option_metrics
+@option_filters
+@option_force
+@option_batch
+@option_max_requests
+@option_rate_limits
 def prebuild_doctor(
+    domains: str,
+    max_requests: int,
+    rpm: int | None,
+    tpm: int | None,
+    rate_limit_file: str,
+    **kwargs,
+) -> None:
+    rate_limiter = get_rate_limiter(rpm, tpm, rate_limit_file)
+    run_for_domains(run_prebuild_doctor, domains, max_requests, rate_limiter, **kwargs)
+
+
+def run_prebuild_doctor(
     domain: str,
+    sqlite_pragmas: str,
+    backup_policy: str,
+    max_workers: int,
+    journal_interval: int,
+    metrics: bool,
+    test_ids: str | None,
+    question_ids: str | None,
+    since: int | None,
+    force: bool,
+    batch: bool,
 ) -> None:
     builder = PrebuildBuilder()
     builder.set_output_dir(get_prebuild_dir(domain))
+    builder.set_dbase_pragmas(SqlitePragmas.from_str(sqlite_pragmas))
+    builder.set_backup_policy(BackupPolicy.from_str(backup_policy))
+    if metrics:
+        builder.set_metrics_path(get_metrics_path(domain))
+    builder.set_filter(get_ids_list(test_ids), get_ids_list(question_ids), since)
+    builder.set_force(force)
+    if batch:
+        builder.set_batch_backend(OpenAIBatchBackend())
+    builder.set_max_workers(max_workers)
+    builder.set_journal_interval(journal_interval)
     builder.run_doctor(domain)
 
 
+@main.command()
+@option_domains
+@click.option(
+    "--stages",
+    required=True,
+    type=str,
+    help="Comma separated list of stages to run in order: translate, override, dump-overrides, question-comments, doctor.",
+)
+@option_languages
+@option_data_path
+@option_sqlite_pragmas
+@option_backup_policy
+@option_max_workers(default=None)
+@option_journal_interval
+@click.option(
+    "--checkpoint",
+    is_flag=True,
+    default=False,
+    help="Save the state after every stage.",
+)
+@option_metrics
+@option_filters
+@option_force
+@option_batch
+@option_max_requests
+@option_image
+@option_rate_limits
+def prebuild_pipeline(
+    domains: str,
+    max_requests: int,
+    rpm: int | None,
+    tpm: int | None,
+    rate_limit_file: str,
+    **kwargs,
+) -> None:
+    stage_names = [name.strip() for name in kwargs["stages"].split(",")]
+    if "dump-overrides" in stage_names and len(get_domains_list(domains)) > 1:
+        # The domains would overwrite each other's dumps
+        raise click.UsageError("dump-overrides writes the overrides of one domain")
+    rate_limiter = get_rate_limiter(rpm, tpm, rate_limit_file)
+    run_for_domains(
+        run_prebuild_pipeline, domains, max_requests, rate_limiter, **kwargs
+    )
+
+
+def run_prebuild_pipeline(
+    domain: str,
+    stages: str,
+    languages: str,
+    data_path: str,
+    sqlite_pragmas: str,
+    backup_policy: str,
+    max_workers: int | None,
+    journal_interval: int,
+    checkpoint: bool,
+    metrics: bool,
+    test_ids: str | None,
+    question_ids: str | None,
+    since: int | None,
+    force: bool,
+    batch: bool,
+    image_max_size: int,
+    image_quality: int,
+) -> None:
+    set_image_options(image_max_size, image_quality)
+    stage_names = [name.strip() for name in stages.split(",") if name.strip()]
+    languages_list = get_languages_list(languages)
+
+    builder = PrebuildBuilder()
+    builder.set_output_dir(get_prebuild_dir(domain))
+    builder.set_dbase_pragmas(SqlitePragmas.from_str(sqlite_pragmas))
+    builder.set_backup_policy(BackupPolicy.from_str(backup_policy))
+    if metrics:
+        builder.set_metrics_path(get_metrics_path(domain))
+    builder.set_filter(get_ids_list(test_ids), get_ids_list(question_ids), since)
+    builder.set_force(force)
+    if batch:
+        builder.set_batch_backend(OpenAIBatchBackend())
+    builder.set_languages(languages_list)
+    builder.set_max_workers(max_workers)
+    builder.set_journal_interval(journal_interval)
+
+    translator = None
+    if "translate" in stage_names:
+        translator = Translator(
+            impl=GPTTranslator(domain=domain),
+            languages=languages_list,
+        )
+        translator.load_cache()
+        builder.set_translator(translator)
+    overrides = None
+    if "override" in stage_names or "dump-overrides" in stage_names:
+        overrides = TextOverrides(data_path=data_path)
+        overrides.load()
+        builder.set_overrides(overrides)
+
+    builder.run_pipeline(
+        [builder.make_stage(name, domain) for name in stage_names],
+        checkpoint=checkpoint,
+    )
+
+    if translator:
+        translator.save_cache()
+    if overrides and "dump-overrides" in stage_names:
+        overrides.save()
+
+
 @main.command()
 @option_domain
 @option_languages
@@ -209,6 +657,34 @@ def build_doctor(domain: str) -> None:
     print("All checks were passed. Main DB is good.")
 
 
+def run_for_domains(
+    func: Callable[..., None],
+    domains: str,
+    max_requests: int,
+    rate_limiter: RateLimiter | None = None,
+    **kwargs: Any,
+) -> None:
+    domains_list = get_domains_list(domains)
+    if rate_limiter and not rate_limiter.state_path and len(domains_list) > 1:
+        # Every domain process would get the full budget
+        raise click.UsageError("Rate limits of several domains need --rate-limit-file")
+    start = time.perf_counter()
+    results = run_domains(func, domains_list, max_requests, rate_limiter, **kwargs)
+    if len(results) > 1:
+        print_summary(results, time.perf_counter() - start)
+    failed_domains = [result.domain for result in results if result.error]
+    if failed_domains:
+        raise click.ClickException(f"Failed domains: {', '.join(failed_domains)}")
+
+
+def get_rate_limiter(
+    rpm: int | None, tpm: int | None, rate_limit_file: str
+) -> RateLimiter | None:
+    if not rpm and not tpm:
+        return None
+    return RateLimiter(rpm, tpm, state_path=rate_limit_file or None)
+
+
 def get_parser(parser: str, data_path: str) -> Parser:
     if parser == "dbase":
         return DatabaseParser(data_path)
@@ -231,6 +707,10 @@ def get_prebuild_dir(domain: str):
     return f"output/domains/{domain}/prebuild"
 
 
+def get_metrics_path(domain: str):
+    return f"output/domains/{domain}/metrics.jsonl"
+
+
 def get_build_dir(domain: str):
     return f"output/domains/{domain}/build"
 
@@ -242,6 +722,12 @@ def get_languages_list(languages: str) -> list[Language]:
     return languages_list
 
 
+def get_ids_list(ids: str | None) -> list[int] | None:
+    if ids is None:
+        return None
+    return [int(value) for value in ids.split(",") if value.strip()]
+
+
 def get_language(language_name: str) -> Language:
     language = Language.from_name(language_name)
     if not language:
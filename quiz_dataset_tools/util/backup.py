@@ -0,0 +1,176 @@
+import os
+import json
+import hashlib
+import sqlite3
+from dataclasses import dataclass, fields
+from datetime import datetime
+
+
+BACKUP_DIR_NAME = "backups"
+MANIFEST_NAME = "manifest.json"
+TIMESTAMP_FORMAT = "%Y-%m-%d-%H%M%S-%f"
+
+
+@dataclass
+class BackupPolicy:
+    # Newest backups that are always kept
+    keep_last: int = 5
+    # Additionally keep the newest backup of each of the last N days
+    keep_daily: int = 7
+
+    @staticmethod
+    def from_str(policy: str) -> "BackupPolicy":
+        # Comma separated list of overrides, e.g. "keep_last=3,keep_daily=0"
+        result = BackupPolicy()
+        known_fields = [f.name for f in fields(BackupPolicy)]
+        for entry in policy.split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+            name, sep, value = entry.partition("=")
+            name = name.strip().lower()
+            if not sep or name not in known_fields:
+                raise Exception(f"Unknown backup policy setting: {entry}")
+            try:
+                count = int(value)
+            except ValueError:
+                raise Exception(f"Bad backup policy value: {entry}")
+            if count < 0:
+                raise Exception(f"Bad backup policy value: {entry}")
+            setattr(result, name, count)
+        return result
+
+
+class BackupManager:
+    def __init__(self, database_path: str, policy: BackupPolicy | None = None):
+        self.database_path = database_path
+        self.policy = policy or BackupPolicy()
+        self.backup_dir = os.path.join(
+            os.path.dirname(os.path.abspath(database_path)), BACKUP_DIR_NAME
+        )
+        self.backup_prefix = os.path.basename(database_path) + "."
+        self.manifest_path = os.path.join(
+            self.backup_dir, self.backup_prefix + MANIFEST_NAME
+        )
+
+    def backup(self) -> str | None:
+        # Returns the new backup path or None if the database didn't change
+        # since the last backup. The size and mtime of the database and WAL
+        # files are checked first, the content is hashed only when they
+        # changed.
+        if not os.path.exists(self.database_path):
+            return None
+        manifest = self._read_manifest()
+        backup_exists = os.path.exists(self._backup_path(manifest.get("backup", "")))
+        # Taken before the content is read, later commits are seen next time
+        signature = self._file_signature()
+        if backup_exists and manifest.get("signature") == signature:
+            return None
+        os.makedirs(self.backup_dir, exist_ok=True)
+        source = sqlite3.connect(self.database_path)
+        try:
+            source_hash = self._content_hash(source)
+            if (
+                source_hash is not None
+                and manifest.get("source_hash") == source_hash
+                and backup_exists
+            ):
+                backup_path = None
+                backup_name = manifest["backup"]
+            else:
+                backup_name = self.backup_prefix + datetime.now().strftime(
+                    TIMESTAMP_FORMAT
+                )
+                backup_path = self._backup_path(backup_name)
+                temp_path = f"{backup_path}.temp"
+                target = sqlite3.connect(temp_path)
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                os.rename(temp_path, backup_path)
+        finally:
+            source.close()
+        self._write_manifest(
+            {"source_hash": source_hash, "signature": signature, "backup": backup_name}
+        )
+        if backup_path:
+            self.apply_retention()
+        return backup_path
+
+    def list_backups(self) -> list[tuple[datetime, str]]:
+        # Sorted from the newest to the oldest
+        if not os.path.isdir(self.backup_dir):
+            return []
+        result = []
+        for name in os.listdir(self.backup_dir):
+            if not name.startswith(self.backup_prefix):
+                continue
+            try:
+                timestamp = datetime.strptime(
+                    name[len(self.backup_prefix) :], TIMESTAMP_FORMAT
+                )
+            except ValueError:
+                continue
+            result.append((timestamp, self._backup_path(name)))
+        return sorted(result, reverse=True)
+
+    def apply_retention(self) -> list[str]:
+        # Returns the removed backup paths
+        backups = self.list_backups()
+        keep = set(path for _, path in backups[: self.policy.keep_last])
+        if backups and self.policy.keep_daily > 0:
+            newest_day = backups[0][0].date()
+            kept_days = set()
+            for timestamp, path in backups:
+                day = timestamp.date()
+                if (newest_day - day).days >= self.policy.keep_daily:
+                    break
+                if day not in kept_days:
+                    kept_days.add(day)
+                    keep.add(path)
+        removed = []
+        for _, path in backups:
+            if path not in keep:
+                os.remove(path)
+                removed.append(path)
+        return removed
+
+    def _content_hash(self, source: sqlite3.Connection) -> str | None:
+        # The main file has the full content only after a complete checkpoint,
+        # None means that the hash can't be trusted
+        busy, _, _ = source.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        if busy:
+            return None
+        with open(self.database_path, "rb") as fd:
+            return hashlib.file_digest(fd, "sha256").hexdigest()
+
+    def _file_signature(self) -> list[list[int] | None]:
+        # Size and mtime of the database and its WAL, every commit changes
+        # one of them. An empty WAL is left out, the checkpoints touch it.
+        signature: list[list[int] | None] = []
+        for path in [self.database_path, f"{self.database_path}-wal"]:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stat = None
+            if stat is None or stat.st_size == 0:
+                signature.append(None)
+            else:
+                signature.append([stat.st_size, stat.st_mtime_ns])
+        return signature
+
+    def _backup_path(self, name: str) -> str:
+        return os.path.join(self.backup_dir, name)
+
+    def _read_manifest(self) -> dict:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, "r") as fd:
+            return json.load(fd)
+
+    def _write_manifest(self, manifest: dict) -> None:
+        temp_path = f"{self.manifest_path}.temp"
+        with open(temp_path, "w") as fd:
+            json.dump(manifest, fd)
+        os.rename(temp_path, self.manifest_path)
@@ -1,10 +1,21 @@
 import csv
 import os
 import threading
-from typing import Dict, Callable
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Dict, Callable, Iterator
 
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None  # type: ignore[assignment]
 
-_lock = threading.Lock()
+
+# Lookup outcomes
+CACHE_HIT = "hit"
+CACHE_MISS = "miss"
+# Waited for the same key retrieved by another thread
+CACHE_COALESCED = "coalesced"
 
 
 class StringCache:
@@ -17,49 +28,112 @@ class StringCache:
         self.name = name
         self.cache: Dict[str, str] = {}
         self.cache_updates = 0
+        # Guards the updates, reads of the cached keys don't take it
+        self.lock = threading.Lock()
+        # Retrievals in flight by key, one per key
+        self.pending: Dict[str, Future[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
 
     def get_or_retrieve(self, src_text: str, retriever: Callable[[str], str]):
+        return self.lookup(src_text, retriever)[0]
+
+    def lookup(self, src_text: str, retriever: Callable[[str], str]) -> tuple[str, str]:
+        # Returns the result and the outcome. Concurrent callers of the same
+        # key wait for the first one instead of retrieving it again.
         if not src_text:
-            return ""
+            return "", CACHE_HIT
         cached_result = self.cache.get(src_text)
         if cached_result:
-            return cached_result
-        result = retriever(src_text)
-        with _lock:
+            # A statistic, not worth the lock on the hot path
+            self.hits += 1
+            return cached_result, CACHE_HIT
+        with self.lock:
+            # Cached meanwhile by the retrieval in flight
+            cached_result = self.cache.get(src_text)
+            if cached_result:
+                self.hits += 1
+                return cached_result, CACHE_HIT
+            pending = self.pending.get(src_text)
+            if pending:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                future: Future[str] = Future()
+                self.pending[src_text] = future
+        if pending:
+            return pending.result(), CACHE_COALESCED
+        try:
+            result = retriever(src_text)
+        except BaseException as e:
+            with self.lock:
+                del self.pending[src_text]
+            future.set_exception(e)
+            raise
+        # Cached before it leaves pending, later callers find it either way
+        self.put(src_text, result)
+        with self.lock:
+            del self.pending[src_text]
+        future.set_result(result)
+        return result, CACHE_MISS
+
+    def get(self, src_text: str) -> str | None:
+        return self.cache.get(src_text)
+
+    def put(self, src_text: str, result: str) -> None:
+        with self.lock:
             self.cache[src_text] = result
             self.cache_updates += 1
-            if self.cache_updates >= StringCache.CACHE_UPDATES_TO_FLUSH:
-                self._save()
+            flush = self.cache_updates >= StringCache.CACHE_UPDATES_TO_FLUSH
+            if flush:
                 self.cache_updates = 0
-        return result
+        if flush:
+            self.save()
 
     def save(self):
-        with _lock:
-            self._save()
+        # print(f"{self.name}::save_cache: size = {len(self.cache)}")
+        # The file is written from a snapshot, the lookups and puts go on
+        # meanwhile
+        with self.lock:
+            snapshot = dict(self.cache)
+        cache = self._save(snapshot)
+        with self.lock:
+            for key, value in cache.items():
+                self.cache.setdefault(key, value)
 
     def load(self):
-        with _lock:
-            self._load()
+        cache_file = StringCache.CACHE_FILE_TEMPL.format(self.domain, self.name)
+        cache = self._read(cache_file)
+        with self.lock:
+            self.cache = cache
+        # print(f"{self.name}::load_cache: {len(self.cache)} records loaded")
 
-    def _save(self):
-        # print(f"{self.name}::save_cache: size = {len(self.cache)}")
-        cache_file_temp = StringCache.CACHE_FILE_TEMP_TEMPL.format(
-            self.domain, self.name
+    def _save(self, snapshot: Dict[str, str]) -> Dict[str, str]:
+        # The domain processes share the cache files, the entries saved by
+        # the others since they were loaded are merged in, not overwritten.
+        # Every process and thread writes its own temp file. Returns the
+        # saved entries.
+        cache_file_temp = (
+            StringCache.CACHE_FILE_TEMP_TEMPL.format(self.domain, self.name)
+            + f".{os.getpid()}.{threading.get_ident()}"
         )
         cache_file = StringCache.CACHE_FILE_TEMPL.format(self.domain, self.name)
-        head_tail = os.path.split(cache_file_temp)
-        os.makedirs(head_tail[0], exist_ok=True)
-        if os.path.exists(cache_file_temp):
-            os.remove(cache_file_temp)
-        with open(cache_file_temp, "w", newline="") as fd:
-            writer = csv.writer(fd, delimiter=",", quoting=csv.QUOTE_ALL)
-            for key, value in self.cache.items():
-                writer.writerow([key, value])
-        os.rename(cache_file_temp, cache_file)
+        for path in [cache_file_temp, cache_file]:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._file_lock(cache_file):
+            cache = self._read(cache_file)
+            cache.update(snapshot)
+            with open(cache_file_temp, "w", newline="") as fd:
+                writer = csv.writer(fd, delimiter=",", quoting=csv.QUOTE_ALL)
+                for key, value in cache.items():
+                    writer.writerow([key, value])
+            os.replace(cache_file_temp, cache_file)
+        return cache
 
-    def _load(self):
-        cache_file = StringCache.CACHE_FILE_TEMPL.format(self.domain, self.name)
-        cache = {}
+    @staticmethod
+    def _read(cache_file: str) -> Dict[str, str]:
+        cache: Dict[str, str] = {}
         if not os.path.exists(cache_file):
             return cache
         with open(cache_file, newline="") as fd:
@@ -68,5 +142,18 @@ class StringCache:
                 if len(row) != 2:
                     raise Exception(f"Invalid cache format: {row}")
                 cache[row[0]] = row[1]
-        self.cache = cache
-        # print(f"{self.name}::load_cache: {len(self.cache)} records loaded")
+        return cache
+
+    @staticmethod
+    @contextmanager
+    def _file_lock(cache_file: str) -> Iterator[None]:
+        # Held across the read, merge and rename of the cache file
+        if fcntl is None:
+            yield
+            return
+        with open(cache_file + ".lock", "a") as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
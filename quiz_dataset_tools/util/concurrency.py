@@ -0,0 +1,137 @@
+import threading
+import tqdm
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Limit a pool starts with, short runs don't wait for the limit to grow
+INITIAL_LIMIT = 4
+
+
+class AdaptiveLimiter:
+    # AIMD concurrency limit: it grows by one after a window of successful
+    # remote calls and halves when the remote side throttles
+    def __init__(
+        self, max_limit: int, min_limit: int = 1, initial_limit: int | None = None
+    ):
+        assert 0 < min_limit <= max_limit, f"Bad limits: {min_limit}, {max_limit}"
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = min(max(initial_limit or min_limit, min_limit), max_limit)
+        self.active = 0
+        self.successes = 0
+        # Bumped on every decrease
+        self.generation = 0
+        self.condition = threading.Condition()
+
+    def acquire(self) -> int:
+        # Returns the generation the slot was taken in
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+            return self.generation
+
+    def release(self) -> None:
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def on_success(self) -> None:
+        with self.condition:
+            self.successes += 1
+            if self.successes >= self.limit and self.limit < self.max_limit:
+                self.limit += 1
+                self.successes = 0
+                self.condition.notify_all()
+
+    def on_throttle(self, generation: int) -> None:
+        with self.condition:
+            # Calls started before the last decrease were throttled by the
+            # old limit, the limit is halved once for all of them
+            if generation != self.generation:
+                return
+            self.generation += 1
+            self.limit = max(self.min_limit, self.limit // 2)
+            self.successes = 0
+
+
+_local = threading.local()
+
+
+def report_request() -> None:
+    # Called by remote clients before every request
+    _local.requests = getattr(_local, "requests", 0) + 1
+
+
+def report_success() -> None:
+    limiter = getattr(_local, "limiter", None)
+    if limiter:
+        limiter.on_success()
+
+
+def report_throttle() -> None:
+    # Rate limit or timeout response
+    limiter = getattr(_local, "limiter", None)
+    if limiter:
+        limiter.on_throttle(_local.generation)
+
+
+def adaptive_map(
+    func: Callable[[T], R], items: list[T], max_workers: int = 1
+) -> list[R]:
+    # Items are processed in the calling thread until one of them makes
+    # a remote request, fully cached runs never pay for threads. The rest
+    # goes to a pool limited by AdaptiveLimiter. The result keeps the
+    # input order.
+    results: list[R] = []
+    with tqdm.tqdm(total=len(items)) as progress:
+        for item in items:
+            _local.requests = 0
+            results.append(func(item))
+            progress.update(1)
+            if _local.requests and max_workers > 1:
+                break
+        rest = items[len(results) :]
+        if rest:
+            results.extend(_map_threaded(func, rest, max_workers, progress))
+    return results
+
+
+def _map_threaded(
+    func: Callable[[T], R], items: list[T], max_workers: int, progress: tqdm.tqdm
+) -> list[R]:
+    limiter = AdaptiveLimiter(
+        max_workers, initial_limit=min(max_workers, INITIAL_LIMIT)
+    )
+    failed = threading.Event()
+
+    def run(item: T, generation: int) -> R:
+        _local.limiter = limiter
+        _local.generation = generation
+        try:
+            return func(item)
+        except BaseException:
+            failed.set()
+            raise
+        finally:
+            _local.limiter = None
+            limiter.release()
+            progress.update(1)
+
+    futures: list[Future[R]] = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for item in items:
+                generation = limiter.acquire()
+                if failed.is_set():
+                    limiter.release()
+                    break
+                futures.append(executor.submit(run, item, generation))
+            return [future.result() for future in futures]
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
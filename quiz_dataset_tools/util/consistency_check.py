@@ -6,9 +6,8 @@ def check_prebuild_main_consistency(prebuild_dir: str, build_dir: str):
     prebuild_db = PrebuildDBase(prebuild_dir)
     main_db = MainDBase(build_dir)
     # Check that QuestionId are equal
-    prebuild_questions = prebuild_db.get_questions()
     prebuild_questions_flat = []
-    for question in prebuild_questions:
+    for question in prebuild_db.iter_questions():
         for answer in question.answers:
             prebuild_questions_flat.append(
                 (
@@ -18,7 +17,9 @@ def check_prebuild_main_consistency(prebuild_dir: str, build_dir: str):
                     answer.text.localizations.EN,
                 )
             )
+    prebuild_db.close()
     main_questions = main_db.get_questions()
+    main_db.close()
     main_questions_flat = []
     for question in main_questions:
         for answer in question.answers:
@@ -0,0 +1,119 @@
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import AbstractContextManager
+from dataclasses import dataclass, field
+from typing import Any, Callable
+from quiz_dataset_tools.constants import DOMAINS
+from quiz_dataset_tools.util.gpt import (
+    GPTMetrics,
+    get_gpt_metrics,
+    set_rate_limiter,
+    set_request_slots,
+)
+from quiz_dataset_tools.util.rate_limit import RateLimiter
+
+
+@dataclass
+class DomainResult:
+    domain: str
+    seconds: float
+    error: str | None = None
+    # GPT usage by service name
+    gpt: dict[str, GPTMetrics] = field(default_factory=dict)
+
+
+def get_domains_list(domains: str) -> list[str]:
+    # "all" or comma separated domain names
+    if domains.strip() == "all":
+        return list(DOMAINS)
+    domains_list = [domain.strip() for domain in domains.split(",") if domain.strip()]
+    if not domains_list:
+        raise Exception(f"No domains in '{domains}'")
+    return domains_list
+
+
+def run_domains(
+    func: Callable[..., None],
+    domains: list[str],
+    max_requests: int,
+    rate_limiter: RateLimiter | None = None,
+    **kwargs: Any,
+) -> list[DomainResult]:
+    # Runs func(domain, **kwargs) for every domain in its own process, the
+    # processes share a budget of max_requests in-flight GPT requests.
+    # A single domain runs in this process and its errors are raised as is.
+    if len(domains) == 1:
+        set_rate_limiter(rate_limiter)
+        try:
+            return [_run_domain(func, domains[0], kwargs, catch=False)]
+        finally:
+            set_rate_limiter(None)
+    # Fresh interpreters, the processes don't inherit the threads and locks
+    # of this one
+    context = multiprocessing.get_context("spawn")
+    request_slots = context.BoundedSemaphore(max_requests)
+    with ProcessPoolExecutor(
+        max_workers=len(domains),
+        mp_context=context,
+        initializer=_init_domain_process,
+        initargs=(request_slots, rate_limiter),
+    ) as executor:
+        futures = [
+            executor.submit(_run_domain, func, domain, kwargs) for domain in domains
+        ]
+        return [future.result() for future in futures]
+
+
+def _init_domain_process(
+    request_slots: AbstractContextManager, rate_limiter: RateLimiter | None
+) -> None:
+    set_request_slots(request_slots)
+    set_rate_limiter(rate_limiter)
+
+
+def _run_domain(
+    func: Callable[..., None],
+    domain: str,
+    kwargs: dict[str, Any],
+    catch: bool = True,
+) -> DomainResult:
+    gpt_metrics = get_gpt_metrics()
+    start = time.perf_counter()
+    error = None
+    try:
+        func(domain, **kwargs)
+    except Exception as e:
+        if not catch:
+            raise
+        traceback.print_exc()
+        error = str(e)
+    result = DomainResult(
+        domain=domain, seconds=time.perf_counter() - start, error=error
+    )
+    for name, metrics in get_gpt_metrics().items():
+        usage = metrics - gpt_metrics.get(name, GPTMetrics())
+        if usage != GPTMetrics():
+            result.gpt[name] = usage
+    return result
+
+
+def print_summary(results: list[DomainResult], seconds: float) -> None:
+    print(
+        f"{'Domain':<8} {'Status':<8} {'Seconds':>8} {'Requests':>9} {'Cached':>9}"
+        f" {'Coalesced':>9}"
+    )
+    for result in results:
+        requests = sum(metrics.requests for metrics in result.gpt.values())
+        cache_hits = sum(metrics.cache_hits for metrics in result.gpt.values())
+        coalesced = sum(metrics.coalesced for metrics in result.gpt.values())
+        status = "failed" if result.error else "ok"
+        print(
+            f"{result.domain:<8} {status:<8} {result.seconds:>8.1f}"
+            f" {requests:>9} {cache_hits:>9} {coalesced:>9}"
+        )
+        if result.error:
+            print(f"  {result.error}")
+    total = sum(result.seconds for result in results)
+    print(f"Wall time {seconds:.1f}s, sum of domains {total:.1f}s")
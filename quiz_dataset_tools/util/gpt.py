@@ -1,11 +1,26 @@
+import copy
+import random
 import time
 import logging
-from openai import OpenAI
+import threading
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import dataclass, fields
+from dataclasses_json import DataClassJsonMixin
+from openai import APITimeoutError, OpenAI, RateLimitError
 from openai.types.chat import ChatCompletionMessageParam
-from typing import Any, Optional
+from typing import TYPE_CHECKING, Any, Callable, Optional
 from quiz_dataset_tools.config import config
-from quiz_dataset_tools.util.cache import StringCache
+from quiz_dataset_tools.util.cache import CACHE_COALESCED, CACHE_HIT, StringCache
+from quiz_dataset_tools.util.concurrency import (
+    report_request,
+    report_success,
+    report_throttle,
+)
 from quiz_dataset_tools.util.image import load_image_as_base64
+from quiz_dataset_tools.util.rate_limit import RateLimiter
+
+if TYPE_CHECKING:
+    from quiz_dataset_tools.util.gpt_batch import GPTBatch
 
 
 # Configure logging
@@ -16,12 +31,169 @@ logger = logging.getLogger(__name__)
 
 client = OpenAI(api_key=config["openai"]["api_key"])
 
+# Retry delays without Retry-After: doubled from the base up to the cap,
+# plus a random part of the base so the workers don't retry in step
+RETRY_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+# Rough prompt size estimate for the rate limiter
+CHARS_PER_TOKEN = 4
+MESSAGE_TOKENS = 4
+IMAGE_TOKENS = 765
+
+
+@dataclass
+class GPTMetrics(DataClassJsonMixin):
+    # Prompts asked by callers
+    prompts: int = 0
+    # Prompts served from the cache
+    cache_hits: int = 0
+    # Prompts that waited for the same prompt in flight
+    coalesced: int = 0
+    # API requests including the failed attempts
+    requests: int = 0
+    retries: int = 0
+    failures: int = 0
+
+    def __sub__(self, other: "GPTMetrics") -> "GPTMetrics":
+        return GPTMetrics(
+            **{
+                f.name: getattr(self, f.name) - getattr(other, f.name)
+                for f in fields(self)
+            }
+        )
+
+
+_metrics_lock = threading.Lock()
+_metrics: dict[str, GPTMetrics] = {}
+
+
+def _count(name: str, **counters: int) -> None:
+    with _metrics_lock:
+        metrics = _metrics.setdefault(name, GPTMetrics())
+        for counter, value in counters.items():
+            setattr(metrics, counter, getattr(metrics, counter) + value)
+
+
+# Limits in-flight requests of all the processes sharing it
+_request_slots: AbstractContextManager | None = None
+
+
+def set_request_slots(slots: AbstractContextManager | None) -> None:
+    global _request_slots
+    _request_slots = slots
+
+
+# Requests and tokens per minute of all the services
+_rate_limiter: RateLimiter | None = None
+
+
+def set_rate_limiter(rate_limiter: RateLimiter | None) -> None:
+    global _rate_limiter
+    _rate_limiter = rate_limiter
+
+
+def estimate_prompt_tokens(messages: list[Any]) -> int:
+    tokens = 0
+    for message in messages:
+        tokens += MESSAGE_TOKENS
+        content = message["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        for part in content:
+            if part["type"] == "text":
+                tokens += len(part["text"]) // CHARS_PER_TOKEN + 1
+            else:
+                tokens += IMAGE_TOKENS
+    return tokens
+
+
+def get_retry_delay(base: float, attempt: int) -> float:
+    # Exponential backoff with jitter after the failed attempt
+    return min(RETRY_MAX_DELAY, base * 2 ** (attempt - 1)) + random.uniform(0, base)
+
+
+def get_retry_after(e: Exception) -> float | None:
+    # Seconds the server asked to wait, None if it didn't
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        # HTTP date form is not used by the API
+        pass
+    return None
+
+
+# Cache misses are collected here instead of being sent, see GPTBatch
+_batch: "GPTBatch | None" = None
+
+# Returned for the collected prompts, the results are thrown away
+BATCH_PLACEHOLDER = ""
+
+
+def set_batch(batch: "GPTBatch | None") -> None:
+    global _batch
+    _batch = batch
+
+
+def get_gpt_metrics() -> dict[str, GPTMetrics]:
+    # Copy of the process wide counters by service name
+    with _metrics_lock:
+        return {name: copy.copy(metrics) for name, metrics in _metrics.items()}
+
+
+def make_messages(
+    prompt: str,
+    image_file: str | None = None,
+    system_prompt: str | None = None,
+) -> list[Any]:
+    content: list[Any] = [
+        {"type": "text", "text": prompt},
+    ]
+    if image_file:
+        base64_image = load_image_as_base64(image_file)
+        content.append(
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{base64_image}",
+                },
+            }
+        )
+    messages: list[Any] = [
+        {
+            "role": "user",
+            "content": content,
+        },
+    ]
+    if system_prompt:
+        messages.append(
+            {
+                "role": "developer",
+                "content": system_prompt,
+            }
+        )
+    return messages
+
 
 class GPTService:
-    def __init__(self, model: str, max_retries: int = 3, retry_delay: float = 100.0):
+    def __init__(
+        self,
+        model: str,
+        max_retries: int = 3,
+        retry_delay: float = RETRY_DELAY,
+        metrics_name: str | None = None,
+    ):
         self.model = model
         self.max_retries = max_retries
         self.retry_delay = retry_delay
+        self.metrics_name = metrics_name or model
 
     def send_prompt(
         self,
@@ -38,39 +210,20 @@ class GPTService:
         :param system_prompt: Optional system role message.
         :return: Response string.
         """
-        content: list[Any] = [
-            {"type": "text", "text": prompt},
-        ]
-        if image_file:
-            base64_image = load_image_as_base64(image_file)
-            content.append(
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}",
-                    },
-                }
-            )
-        messages: list[Any] = [
-            {
-                "role": "user",
-                "content": content,
-            },
-        ]
-        if system_prompt:
-            messages.append(
-                {
-                    "role": "developer",
-                    "content": system_prompt,
-                }
-            )
-
+        messages = make_messages(prompt, image_file, system_prompt)
+        tokens = estimate_prompt_tokens(messages)
         for attempt in range(1, self.max_retries + 1):
+            _count(self.metrics_name, requests=1, retries=1 if attempt > 1 else 0)
+            report_request()
+            if _rate_limiter:
+                _rate_limiter.acquire(tokens)
             try:
-                completion = client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                )
+                with _request_slots or nullcontext():
+                    completion = client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                    )
+                report_success()
                 # print(completion)
                 if not completion.choices:
                     break
@@ -80,9 +233,18 @@ class GPTService:
                 return result
             except Exception as e:
                 logger.warning(f"Request failed on attempt {attempt}: {e}")
+                if isinstance(e, (RateLimitError, APITimeoutError)):
+                    report_throttle()
+                retry_after = get_retry_after(e)
+                if retry_after is not None and _rate_limiter:
+                    _rate_limiter.pause(retry_after)
                 if attempt == self.max_retries:
+                    _count(self.metrics_name, failures=1)
                     raise
-                time.sleep(self.retry_delay * attempt)  # exponential backoff
+                if retry_after is not None:
+                    time.sleep(retry_after)
+                else:
+                    time.sleep(get_retry_delay(self.retry_delay, attempt))
         raise Exception(f"Prompt failed: {prompt}")
 
 
@@ -91,16 +253,62 @@ class GPTServiceWithCache:
     cache: StringCache
 
     def __init__(self, domain: str, model: str):
-        self.impl = GPTService(model)
+        self.impl = GPTService(model, metrics_name=domain)
         self.cache = StringCache(domain, model)
 
     def send_prompt(self, prompt: str, image_file: str | None = None) -> str:
         cache_key = prompt
         if image_file:
             cache_key = f"{cache_key} image:{image_file}"
-        return self.cache.get_or_retrieve(
+        if _batch is not None:
+            cached_result = self.cache.get(cache_key)
+            if cached_result is not None:
+                return cached_result
+            _batch.add(
+                self.cache,
+                cache_key,
+                self.impl.model,
+                make_messages(prompt, image_file),
+            )
+            return BATCH_PLACEHOLDER
+        result, outcome = self.cache.lookup(
             cache_key, lambda _: self.impl.send_prompt(prompt, image_file)
         )
+        _count(
+            self.impl.metrics_name,
+            prompts=1,
+            cache_hits=1 if outcome == CACHE_HIT else 0,
+            coalesced=1 if outcome == CACHE_COALESCED else 0,
+        )
+        return result
+
+    def send_prompt_uncached(
+        self, prompt: str, on_batch_result: Callable[[str], object]
+    ) -> str:
+        # The caller caches what it needs from the result. A batch run
+        # collects the prompt and passes its result to on_batch_result.
+        if _batch is not None:
+            _batch.add(
+                self.cache,
+                prompt,
+                self.impl.model,
+                make_messages(prompt),
+                on_result=on_batch_result,
+            )
+            return BATCH_PLACEHOLDER
+        _count(self.impl.metrics_name, prompts=1)
+        return self.impl.send_prompt(prompt)
+
+    def get_cached(self, prompt: str) -> str | None:
+        # The result of a prompt if it is cached, nothing is sent
+        result = self.cache.get(prompt)
+        if result:
+            _count(self.impl.metrics_name, prompts=1, cache_hits=1)
+        return result or None
+
+    def put_cached(self, prompt: str, result: str) -> None:
+        # Result of the prompt obtained in another way
+        self.cache.put(prompt, result)
 
     def save_cache(self) -> None:
         self.cache.save()
@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Callable
+from quiz_dataset_tools.util.cache import StringCache
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_POLL_INTERVAL = 60.0
+BATCH_DONE_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+@dataclass
+class BatchRequest:
+    cache: StringCache
+    cache_key: str
+    model: str
+    messages: list[Any]
+    # Takes the result instead of the cache, the caller caches what it needs
+    on_result: Callable[[str], object] | None = None
+
+
+class GPTBatch:
+    # Cache-miss prompts collected while a stage runs in batch mode, they are
+    # sent at once and the results go to the caches
+    def __init__(self) -> None:
+        self.requests: list[BatchRequest] = []
+        self.keys: set[tuple[str, str, str]] = set()
+        self.lock = threading.Lock()
+
+    def add(
+        self,
+        cache: StringCache,
+        cache_key: str,
+        model: str,
+        messages: list[Any],
+        on_result: Callable[[str], object] | None = None,
+    ) -> None:
+        key = (cache.domain, cache.name, cache_key)
+        with self.lock:
+            if key in self.keys:
+                return
+            self.keys.add(key)
+            self.requests.append(
+                BatchRequest(cache, cache_key, model, messages, on_result)
+            )
+
+    def __len__(self) -> int:
+        return len(self.requests)
+
+    def submit(self, backend: "BatchBackend", batch_dir: str) -> int:
+        # Returns the number of results put to the caches
+        os.makedirs(batch_dir, exist_ok=True)
+        name = time.strftime("%Y%m%d-%H%M%S")
+        input_path = os.path.join(batch_dir, f"{name}.input.jsonl")
+        output_path = os.path.join(batch_dir, f"{name}.output.jsonl")
+        with open(input_path, "w") as fd:
+            for index, request in enumerate(self.requests):
+                line = {
+                    "custom_id": str(index),
+                    "method": "POST",
+                    "url": BATCH_ENDPOINT,
+                    "body": {"model": request.model, "messages": request.messages},
+                }
+                fd.write(json.dumps(line, ensure_ascii=False) + "\n")
+        print(f"Submit batch of {len(self.requests)} prompts: {input_path}")
+        backend.run(input_path, output_path)
+        ingested = 0
+        with open(output_path, "r") as fd:
+            for result_line in fd:
+                result = json.loads(result_line)
+                request = self.requests[int(result["custom_id"])]
+                content = _get_content(result)
+                if content is None:
+                    logger.warning(f"Batch request failed: {result}")
+                    continue
+                if request.on_result:
+                    request.on_result(content)
+                else:
+                    request.cache.put(request.cache_key, content)
+                ingested += 1
+        for cache in {id(r.cache): r.cache for r in self.requests}.values():
+            cache.save()
+        print(f"Batch done: {ingested} of {len(self.requests)} results")
+        return ingested
+
+
+def _get_content(result: dict) -> str | None:
+    response = result.get("response") or {}
+    if result.get("error") or response.get("status_code") != 200:
+        return None
+    choices = response["body"].get("choices")
+    if not choices:
+        return None
+    return choices[0]["message"]["content"] or None
+
+
+class BatchBackend(ABC):
+    @abstractmethod
+    def run(self, input_path: str, output_path: str) -> None:
+        # Processes the requests JSONL and writes the results JSONL
+        ...
+
+
+class OpenAIBatchBackend(BatchBackend):
+    def __init__(self, poll_interval: float = BATCH_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+
+    def run(self, input_path: str, output_path: str) -> None:
+        from quiz_dataset_tools.util.gpt import client
+
+        with open(input_path, "rb") as fd:
+            input_file = client.files.create(file=fd, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        while batch.status not in BATCH_DONE_STATUSES:
+            time.sleep(self.poll_interval)
+            batch = client.batches.retrieve(batch.id)
+            print(f"Batch {batch.id}: {batch.status} {batch.request_counts}")
+        if batch.status != "completed" or not batch.output_file_id:
+            raise Exception(f"Batch {batch.id} is {batch.status}: {batch.errors}")
+        with open(output_path, "w") as fd:
+            fd.write(client.files.content(batch.output_file_id).text)
+
+
+class LocalBatchBackend(BatchBackend):
+    # Offline stand-in, the responder makes the answer for a request body
+    def __init__(self, responder: Callable[[dict], str]):
+        self.responder = responder
+
+    def run(self, input_path: str, output_path: str) -> None:
+        with open(input_path, "r") as input_fd, open(output_path, "w") as output_fd:
+            for line in input_fd:
+                request = json.loads(line)
+                result = {
+                    "id": f"batch_req_{request['custom_id']}",
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {
+                            "object": "chat.completion",
+                            "model": request["body"]["model"],
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "message": {
+                                        "role": "assistant",
+                                        "content": self.responder(request["body"]),
+                                    },
+                                    "finish_reason": "stop",
+                                }
+                            ],
+                        },
+                    },
+                    "error": None,
+                }
+                output_fd.write(json.dumps(result, ensure_ascii=False) + "\n")
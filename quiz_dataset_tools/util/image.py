@@ -1,9 +1,19 @@
 import base64
+import hashlib
 import os
+import threading
+from collections import OrderedDict
 from PIL import Image
 from io import BytesIO
 
 
+# Vision models scale the images down to fit their tiles anyway
+IMAGE_MAX_SIZE = 1024
+IMAGE_QUALITY = 85
+# Encoded payloads kept in memory
+IMAGE_CACHE_SIZE = 256
+
+
 def convert_png_to_webp(input_file: str, output_file: str, quality: int = 90) -> None:
     """
     Converts a PNG image to WEBP format.
@@ -30,22 +40,58 @@ def convert_png_to_webp(input_file: str, output_file: str, quality: int = 90) ->
         img.save(output_file, "webp", quality=quality)
 
 
-def load_image_as_base64(image_path: str) -> str:
-    with Image.open(image_path) as img:
-        return _pil_to_base64_jpeg(img)
+_image_max_size = IMAGE_MAX_SIZE
+_image_quality = IMAGE_QUALITY
+_payloads: OrderedDict[tuple[bytes, int, int], str] = OrderedDict()
+_payloads_lock = threading.Lock()
+
+
+def set_image_options(max_size: int, quality: int) -> None:
+    # Used by load_image_as_base64 calls without explicit options
+    global _image_max_size, _image_quality
+    _image_max_size = max_size
+    _image_quality = quality
+
+
+def load_image_as_base64(
+    image_path: str, max_size: int | None = None, quality: int | None = None
+) -> str:
+    """
+    Loads an image as a Base64 encoded JPEG no larger than max_size on either
+    side. Payloads are memoized by the image content.
+    """
+    max_size = max_size or _image_max_size
+    quality = quality or _image_quality
+    with open(image_path, "rb") as fd:
+        data = fd.read()
+    key = (hashlib.blake2b(data, digest_size=16).digest(), max_size, quality)
+    with _payloads_lock:
+        payload = _payloads.get(key)
+        if payload is not None:
+            _payloads.move_to_end(key)
+            return payload
+    with Image.open(BytesIO(data)) as img:
+        img.thumbnail((max_size, max_size))
+        payload = _pil_to_base64_jpeg(img, quality)
+    with _payloads_lock:
+        _payloads[key] = payload
+        while len(_payloads) > IMAGE_CACHE_SIZE:
+            _payloads.popitem(last=False)
+    return payload
 
 
-def _pil_to_base64_jpeg(pil_image) -> str:
+def _pil_to_base64_jpeg(pil_image, quality: int = IMAGE_QUALITY) -> str:
     """
     Converts a PIL Image object to a Base64 encoded string.
     Args:
         pil_image (PIL.Image.Image): The PIL Image object to convert.
+        quality (int): Quality of the JPEG image (1-95).
     Returns:
         str: The Base64 encoded string of the image.
     """
     buffered = BytesIO()
     rgb_image = pil_image.convert("RGB")
-    rgb_image.save(buffered, format="JPEG")
+    rgb_image.save(buffered, format="JPEG", quality=quality)
     img_bytes = buffered.getvalue()
     base64_string = base64.b64encode(img_bytes).decode("utf-8")
     return base64_string
@@ -68,6 +68,17 @@ class TextLocalizations:
     def get_canonical(self) -> TextLocalization | None:
         return self.get(Language.EN)
 
+    def copy(self) -> "TextLocalizations":
+        # Localizations are copied too, they may be changed in place
+        result = TextLocalizations()
+        for lang in Language:
+            localization = self.get(lang)
+            if localization is not None:
+                result.set(
+                    lang, localization.content, localization.text_localization_id
+                )
+        return result
+
     def transform(self, transformer: StringTransformer) -> "TextLocalizations":
         result = TextLocalizations()
         for lang in Language:
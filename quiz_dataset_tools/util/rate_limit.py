@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None  # type: ignore[assignment]
+
+
+# Next to the GPT caches, runs sharing the caches share the quota
+RATE_LIMIT_FILE = "cache/rate_limit.json"
+
+
+@dataclass
+class RateLimitState:
+    # Bucket levels, negative when the callers reserved ahead
+    requests: float
+    tokens: float
+    updated: float
+    # Set from Retry-After, nothing is sent before it
+    blocked_until: float = 0.0
+
+
+class RateLimiter:
+    # Token buckets for requests and tokens per minute. Callers reserve
+    # their share up front and wait the returned time, so concurrent callers
+    # queue up instead of racing into 429s. With state_path the buckets are
+    # kept in a file locked with fcntl and shared by the processes.
+    def __init__(
+        self,
+        rpm: int | None = None,
+        tpm: int | None = None,
+        state_path: str | None = None,
+    ):
+        assert rpm is None or rpm > 0, f"Bad rpm: {rpm}"
+        assert tpm is None or tpm > 0, f"Bad tpm: {tpm}"
+        if state_path and fcntl is None:
+            raise Exception("Shared rate limit needs fcntl")
+        self.rpm = rpm
+        self.tpm = tpm
+        self.state_path = state_path
+        self.state = self._make_state()
+        self.lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # Passed to the domain processes, they get their own thread lock
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens: int) -> float:
+        # Takes one request and the tokens, returns seconds to wait before
+        # sending
+        with self._locked_state() as state:
+            now = time.time()
+            self._refill(state, now)
+            state.requests -= 1
+            # A prompt over the limit waits for the full bucket only
+            state.tokens -= min(tokens, self.tpm or tokens)
+            wait = state.blocked_until - now
+            if self.rpm and state.requests < 0:
+                wait = max(wait, -state.requests * 60.0 / self.rpm)
+            if self.tpm and state.tokens < 0:
+                wait = max(wait, -state.tokens * 60.0 / self.tpm)
+            return max(wait, 0.0)
+
+    def acquire(self, tokens: int) -> None:
+        time.sleep(self.reserve(tokens))
+
+    def pause(self, seconds: float) -> None:
+        # The server asked to retry after seconds, everyone waits
+        with self._locked_state() as state:
+            state.blocked_until = max(state.blocked_until, time.time() + seconds)
+
+    def _make_state(self) -> RateLimitState:
+        return RateLimitState(
+            requests=float(self.rpm or 0),
+            tokens=float(self.tpm or 0),
+            updated=time.time(),
+        )
+
+    def _refill(self, state: RateLimitState, now: float) -> None:
+        elapsed = max(now - state.updated, 0.0)
+        if self.rpm:
+            state.requests = min(self.rpm, state.requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            state.tokens = min(self.tpm, state.tokens + elapsed * self.tpm / 60)
+        state.updated = now
+
+    @contextmanager
+    def _locked_state(self) -> Iterator[RateLimitState]:
+        with self.lock:
+            if not self.state_path:
+                yield self.state
+                return
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            with open(self.state_path, "a+") as fd:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    fd.seek(0)
+                    content = fd.read()
+                    state = (
+                        RateLimitState(**json.loads(content))
+                        if content
+                        else self._make_state()
+                    )
+                    yield state
+                    fd.seek(0)
+                    fd.truncate()
+                    fd.write(json.dumps(asdict(state)))
+                    fd.flush()
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
@@ -0,0 +1,48 @@
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+
+POOL_SIZE = 5
+
+
+def create_sqlite_engine(database_path: str) -> Engine:
+    return create_engine(f"sqlite:///{database_path}", echo=False, pool_size=POOL_SIZE)
+
+
+def session_decorator(func):
+    # Runs the method in the current unit of work, the session is passed
+    # after self
+    def wrapper(dbase, *args, **kwargs):
+        with dbase.unit_of_work() as session:
+            return func(dbase, session, *args, **kwargs)
+
+    return wrapper
+
+
+class SessionDBase:
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.session_factory = sessionmaker(self.engine)
+        self._local = threading.local()
+
+    def close(self):
+        self.engine.dispose()
+
+    @contextmanager
+    def unit_of_work(self) -> Iterator[Session]:
+        # Calls made inside the block share one session and are committed
+        # together on exit, or rolled back if the block raises.
+        session = getattr(self._local, "session", None)
+        if session is not None:
+            yield session
+            return
+        with self.session_factory() as session:
+            self._local.session = session
+            try:
+                yield session
+                session.commit()
+            finally:
+                self._local.session = None
@@ -0,0 +1,69 @@
+from dataclasses import dataclass, fields
+from sqlalchemy import Engine, event
+
+
+# Values interpolated into the PRAGMA statements, anything else is rejected
+JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+@dataclass
+class SqlitePragmas:
+    # WAL lets readers (e.g. the server) work while a stage writes
+    journal_mode: str = "WAL"
+    # NORMAL is durable enough in WAL mode and avoids an fsync per commit
+    synchronous: str = "NORMAL"
+    # Wait for a lock instead of failing with "database is locked", ms
+    busy_timeout: int = 30000
+    # Negative value is a size in KiB
+    cache_size: int = -65536
+    mmap_size: int = 268435456
+
+    @staticmethod
+    def from_str(pragmas: str) -> "SqlitePragmas":
+        # Comma separated list of overrides, e.g. "synchronous=FULL,busy_timeout=5000"
+        result = SqlitePragmas()
+        known_fields = {f.name: f.type for f in fields(SqlitePragmas)}
+        for entry in pragmas.split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+            name, sep, value = entry.partition("=")
+            name = name.strip().lower()
+            if not sep or name not in known_fields:
+                raise Exception(f"Unknown sqlite pragma: {entry}")
+            value = value.strip()
+            if known_fields[name] is int:
+                try:
+                    setattr(result, name, int(value))
+                except ValueError:
+                    raise Exception(f"Bad sqlite pragma value: {entry}")
+            else:
+                setattr(result, name, value.upper())
+        result.validate()
+        return result
+
+    def validate(self) -> None:
+        if self.journal_mode.upper() not in JOURNAL_MODES:
+            raise Exception(
+                f"Bad sqlite journal_mode: {self.journal_mode},"
+                f" expected one of {', '.join(JOURNAL_MODES)}"
+            )
+        if self.synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise Exception(
+                f"Bad sqlite synchronous: {self.synchronous},"
+                f" expected one of {', '.join(SYNCHRONOUS_MODES)}"
+            )
+        for f in fields(self):
+            if f.type is int and type(getattr(self, f.name)) is not int:
+                raise Exception(f"Bad sqlite {f.name}: {getattr(self, f.name)}")
+
+    def apply(self, engine: Engine) -> None:
+        self.validate()
+
+        @event.listens_for(engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for f in fields(self):
+                cursor.execute(f"PRAGMA {f.name}={getattr(self, f.name)}")
+            cursor.close()
@@ -1,4 +1,5 @@
 import csv
+import hashlib
 import os
 from quiz_dataset_tools.util.language import Language
 
@@ -29,6 +30,10 @@ class TextOverrides:
     ) -> None:
         self.overrides[(context, lang.name, text, override_lang.name)] = override
 
+    def get_fingerprint(self) -> str:
+        content = repr(sorted(self.overrides.items()))
+        return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
     def save(self) -> None:
         # print(f"TextOverrides::save: size = {len(self.overrides)}")
         overrides_file_temp = TextOverrides.OVERRIDES_FILE_TEMP_TEMPL.format(
@@ -1,8 +1,14 @@
+import datetime
+import time
 import unittest
 import tempfile
 import shutil
+from contextlib import contextmanager
+from sqlalchemy import event, inspect, update
 from quiz_dataset_tools.util.language import Language, TextLocalizations
 from quiz_dataset_tools.prebuild.dbase import PrebuildDBase
+from quiz_dataset_tools.prebuild.orm import TextOrm
+from quiz_dataset_tools.prebuild.stage import StageState
 from quiz_dataset_tools.prebuild.types import (
     PrebuildText,
     PrebuildTextWarning,
@@ -13,6 +19,20 @@ from quiz_dataset_tools.prebuild.types import (
 from tests.common import make_text, make_question
 
 
+@contextmanager
+def count_queries(engine):
+    statements: list[str] = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", on_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", on_execute)
+
+
 class TestPrebuildDBase(unittest.TestCase):
     def setUp(self):
         self.tmpdir = tempfile.mkdtemp()
@@ -104,6 +124,204 @@ class TestPrebuildDBase(unittest.TestCase):
         test2_questions = self.dbase.get_questions_by_test(2)
         self.assertEqual(len(test2_questions), 1)
 
+    def _add_questions_with_answers(self, test_id: int, count: int) -> None:
+        for i in range(count):
+            question_id = test_id * 100 + i
+            # Keep text ids away from the make_text() sequence
+            text_id = 100000 + question_id * 10
+            self.dbase.add_question(
+                make_question(
+                    test_id=test_id,
+                    question_id=question_id,
+                    text_id=text_id,
+                    en=f"Q{question_id}",
+                    answers=[
+                        PrebuildAnswer(
+                            answer_id=question_id * 10 + j,
+                            question_id=question_id,
+                            text=make_text(
+                                f"A{question_id}-{j}",
+                                text_id=text_id + j + 1,
+                                fr=f"FR A{question_id}-{j}",
+                            ),
+                            is_right_answer=j == 0,
+                        )
+                        for j in range(4)
+                    ],
+                )
+            )
+
+    def test_get_questions_query_count_is_constant(self):
+        self.dbase.add_test(PrebuildTest(test_id=1, title=make_text("T1", text_id=1)))
+        self.dbase.add_test(PrebuildTest(test_id=2, title=make_text("T2", text_id=2)))
+        self._add_questions_with_answers(test_id=1, count=2)
+
+        with count_queries(self.dbase.engine) as small_domain:
+            questions = self.dbase.get_questions()
+        self.assertEqual(len(questions), 2)
+
+        self._add_questions_with_answers(test_id=2, count=10)
+
+        with count_queries(self.dbase.engine) as large_domain:
+            questions = self.dbase.get_questions()
+        self.assertEqual(len(questions), 12)
+        self.assertEqual(len(small_domain), len(large_domain))
+        self.assertLessEqual(len(large_domain), 12)
+        # Make sure the whole graph was hydrated while the session was open
+        answer = questions[-1].answers[-1]
+        self.assertEqual(
+            answer.text.localizations.get(Language.FR).content, "FR A209-3"
+        )
+
+        with count_queries(self.dbase.engine) as by_test:
+            questions = self.dbase.get_questions_by_test(2)
+        self.assertEqual(len(questions), 10)
+        self.assertEqual(len(by_test), len(large_domain))
+
+    def test_get_tests_query_count_is_constant(self):
+        for test_id in range(1, 6):
+            self.dbase.add_test(
+                PrebuildTest(test_id=test_id, title=make_text(f"T{test_id}"))
+            )
+        with count_queries(self.dbase.engine) as statements:
+            tests = self.dbase.get_tests()
+        self.assertEqual(len(tests), 5)
+        self.assertLessEqual(len(statements), 4)
+
+    def test_read_tests(self):
+        for test_id in range(1, 4):
+            self.dbase.add_test(
+                PrebuildTest(
+                    test_id=test_id,
+                    title=make_text(f"T{test_id}", fr=f"FR T{test_id}"),
+                    position=test_id,
+                )
+            )
+        with count_queries(self.dbase.engine) as statements:
+            tests = self.dbase.read_tests()
+        self.assertEqual(self.dbase.get_tests(), tests)
+        self.assertLessEqual(len(statements), 5)
+
+    def test_read_questions(self):
+        self.dbase.add_test(PrebuildTest(test_id=1, title=make_text("T1")))
+        self.dbase.add_test(PrebuildTest(test_id=2, title=make_text("T2")))
+        self._add_questions_with_answers(test_id=1, count=3)
+        self._add_questions_with_answers(test_id=2, count=2)
+        text = self.dbase.get_question(101).text
+        self.dbase.add_text_warning(
+            PrebuildTextWarning(
+                text_id=text.text_id,
+                text_localization_id=text.localizations.EN.text_localization_id,
+                code="A",
+                content="Warning A",
+            )
+        )
+
+        with count_queries(self.dbase.engine) as statements:
+            questions = self.dbase.read_questions()
+        self.assertEqual(self.dbase.get_questions(), questions)
+        self.assertEqual(["A"], [w.code for w in questions[1].text.warnings])
+        self.assertLessEqual(len(statements), 6)
+
+        self.assertEqual(
+            self.dbase.get_questions_by_test(2), self.dbase.read_questions(test_ids=[2])
+        )
+        self.assertEqual(
+            [100, 201],
+            [
+                q.question_id
+                for q in self.dbase.read_questions(question_ids=[201, 100, 999])
+            ],
+        )
+        self.assertEqual([], self.dbase.read_questions(test_ids=[3]))
+
+    def test_iter_questions(self):
+        self.dbase.add_test(PrebuildTest(test_id=1, title=make_text("T1")))
+        self.dbase.add_test(PrebuildTest(test_id=2, title=make_text("T2")))
+        self._add_questions_with_answers(test_id=1, count=5)
+        self._add_questions_with_answers(test_id=2, count=3)
+
+        expected = self.dbase.get_questions()
+        for batch_size in [1, 3, 8, 100]:
+            self.assertEqual(
+                expected, list(self.dbase.iter_questions(batch_size=batch_size))
+            )
+        self.assertEqual(
+            [200, 201, 202],
+            [q.question_id for q in self.dbase.iter_questions(test_ids=[2])],
+        )
+        self.assertEqual([], list(self.dbase.iter_questions(test_ids=[3])))
+
+    def test_read_updated_since(self):
+        self.dbase.add_test(PrebuildTest(test_id=1, title=make_text("T1")))
+        self.dbase.add_test(PrebuildTest(test_id=2, title=make_text("T2")))
+        self._add_questions_with_answers(test_id=1, count=3)
+        self._add_questions_with_answers(test_id=2, count=2)
+        with self.dbase.engine.begin() as conn:
+            conn.execute(
+                update(TextOrm.__table__).values(
+                    LastUpdateTimestamp=datetime.datetime(2020, 1, 1)
+                )
+            )
+        since = int(time.time()) - 60
+        self.assertEqual([], self.dbase.read_tests(since=since))
+        self.assertEqual([], self.dbase.read_questions(since=since))
+
+        # Localization changes bump the text timestamp
+        answer_text = self.dbase.get_question(101).answers[2].text
+        answer_text.localizations.set(Language.FR, "Changed")
+        self.dbase.update_text(answer_text)
+        title = self.dbase.read_tests(test_ids=[2])[0].title
+        title.localizations.set(Language.EN, "Changed")
+        self.dbase.update_text(title)
+
+        self.assertEqual([2], [t.test_id for t in self.dbase.read_tests(since=since)])
+        self.assertEqual(
+            [101], [q.question_id for q in self.dbase.read_questions(since=since)]
+        )
+        self.assertEqual(
+            [101],
+            [q.question_id for q in self.dbase.iter_questions(since=since)],
+        )
+        self.assertEqual([], self.dbase.read_questions(test_ids=[2], since=since))
+        self.assertEqual(
+            [100, 200],
+            [q.question_id for q in self.dbase.iter_questions(question_ids=[100, 200])],
+        )
+
+    def test_stage_marks_roundtrip(self):
+        self.dbase.add_test(PrebuildTest(test_id=1, title=make_text("T1")))
+        self._add_questions_with_answers(test_id=1, count=2)
+        state = StageState(
+            tests=[], questions=self.dbase.read_questions(), text_warnings=[]
+        )
+        state.track_changes()
+        state.questions[0].text.stage_marks["translate"] = "a:1"
+        state.questions[1].answers[0].text.stage_marks["doctor"] = "b:2"
+        self.dbase.save_state(state)
+        self.assertEqual(state.questions, self.dbase.read_questions())
+        self.assertEqual(state.questions, self.dbase.get_questions())
+
+        state.track_changes()
+        state.questions[0].text.stage_marks["translate"] = "a:3"
+        self.assertEqual(1, self.dbase.save_state(state))
+        self.assertEqual(
+            {"translate": "a:3"}, self.dbase.read_questions()[0].text.stage_marks
+        )
+
+    def test_iter_questions_is_lazy(self):
+        self.dbase.add_test(PrebuildTest(test_id=1, title=make_text("T1")))
+        self._add_questions_with_answers(test_id=1, count=6)
+
+        with count_queries(self.dbase.engine) as statements:
+            questions = self.dbase.iter_questions(batch_size=2)
+            self.assertEqual(100, next(questions).question_id)
+            first_batch = len(statements)
+            self.assertEqual(101, next(questions).question_id)
+            self.assertEqual(first_batch, len(statements))
+            self.assertEqual(102, next(questions).question_id)
+            self.assertEqual(2 * first_batch, len(statements))
+
     def test_update_test(self):
         test = PrebuildTest(
             test_id=1, title=make_text("Original", text_id=100), position=1
@@ -184,6 +402,80 @@ class TestPrebuildDBase(unittest.TestCase):
         self.assertEqual(warnings[0].code, "SPELLING")
         self.assertEqual(warnings[0].content, "Typo found")
 
+    def _add_warning_localization(self) -> tuple[int, int]:
+        self.dbase.add_test(PrebuildTest(test_id=1, title=make_text("Test")))
+        self.dbase.add_question(
+            make_question(test_id=1, question_id=1, text_id=200, en="Q1")
+        )
+        text = self.dbase.get_question(1).text
+        return text.text_id, text.localizations.EN.text_localization_id
+
+    def test_upsert_text_warnings(self):
+        text_id, loc_id = self._add_warning_localization()
+
+        def warning(code, content, checked=False):
+            return PrebuildTextWarning(
+                text_id=text_id,
+                text_localization_id=loc_id,
+                code=code,
+                content=content,
+                is_manually_checked=checked,
+            )
+
+        self.assertEqual(
+            2, self.dbase.upsert_text_warnings([warning("A", "a"), warning("B", "b")])
+        )
+        # Same content doesn't touch the row, the check flag is raised
+        self.assertEqual(
+            1,
+            self.dbase.upsert_text_warnings(
+                [warning("A", "a"), warning("B", "b", checked=True)]
+            ),
+        )
+        stored = {w.code: w for w in self.dbase.get_text_warnings(text_id)}
+        self.assertTrue(stored["B"].is_manually_checked)
+        # Unchecked update doesn't drop the flag, new content does
+        self.dbase.upsert_text_warnings([warning("B", "b")])
+        stored = {w.code: w for w in self.dbase.get_text_warnings(text_id)}
+        self.assertTrue(stored["B"].is_manually_checked)
+        self.dbase.upsert_text_warnings([warning("B", "b2")])
+        stored = {w.code: w for w in self.dbase.get_text_warnings(text_id)}
+        self.assertEqual("b2", stored["B"].content)
+        self.assertFalse(stored["B"].is_manually_checked)
+
+        with self.assertRaises(AssertionError):
+            self.dbase.upsert_text_warnings([warning("A", "a2", checked=True)])
+
+        # Empty content keeps the stored content and the check flag
+        self.dbase.upsert_text_warnings([warning("B", "", checked=True)])
+        self.assertEqual(0, self.dbase.upsert_text_warnings([warning("B", "")]))
+        self.assertEqual(0, self.dbase.upsert_text_warnings([warning("B", None)]))
+        stored = {w.code: w for w in self.dbase.get_text_warnings(text_id)}
+        self.assertEqual("b2", stored["B"].content)
+        self.assertTrue(stored["B"].is_manually_checked)
+
+        self.assertEqual(
+            1, self.dbase.delete_text_warnings([warning("A", ""), warning("C", "")])
+        )
+        self.assertEqual(["B"], [w.code for w in self.dbase.get_text_warnings(text_id)])
+
+    def test_upsert_text_warnings_in_bulk(self):
+        text_id, loc_id = self._add_warning_localization()
+        warnings = [
+            PrebuildTextWarning(
+                text_id=text_id,
+                text_localization_id=loc_id,
+                code=f"CODE_{i}",
+                content=f"Warning {i}",
+            )
+            for i in range(2000)
+        ]
+        with count_queries(self.dbase.engine) as statements:
+            self.assertEqual(2000, self.dbase.upsert_text_warnings(warnings))
+        self.assertEqual(1, len(statements))
+        self.assertEqual(0, self.dbase.upsert_text_warnings(warnings))
+        self.assertEqual(2000, len(self.dbase.get_text_warnings(text_id)))
+
     def test_multilingual_roundtrip(self):
         locs = TextLocalizations()
         locs.set(Language.EN, "Hello")
@@ -199,3 +491,175 @@ class TestPrebuildDBase(unittest.TestCase):
         self.assertEqual(title_locs.get(Language.EN).content, "Hello")
         self.assertEqual(title_locs.get(Language.FR).content, "Bonjour")
         self.assertEqual(title_locs.get(Language.ES).content, "Hola")
+
+    def test_save_state(self):
+        self.dbase.add_test(PrebuildTest(test_id=1, title=make_text("T1"), position=1))
+        self._add_questions_with_answers(test_id=1, count=3)
+
+        tests = self.dbase.get_tests()
+        questions = self.dbase.get_questions()
+        tests[0].position = 5
+        questions[0].image = "new.png"
+        questions[1].answers[2].text.localizations.set(
+            Language.FR,
+            "FR updated",
+            questions[1].answers[2].text.localizations.FR.text_localization_id,
+        )
+        text = questions[2].text
+        loc_id = text.localizations.EN.text_localization_id
+        self.dbase.save_state(
+            StageState(
+                tests=tests,
+                questions=questions,
+                text_warnings=[
+                    PrebuildTextWarning(
+                        text_id=text.text_id,
+                        text_localization_id=loc_id,
+                        code="A",
+                        content="Warning A",
+                    ),
+                    PrebuildTextWarning(
+                        text_id=text.text_id,
+                        text_localization_id=loc_id,
+                        code="B",
+                        content="Warning B",
+                    ),
+                ],
+            )
+        )
+
+        self.assertEqual(self.dbase.get_tests()[0].position, 5)
+        stored = self.dbase.get_questions()
+        self.assertEqual(stored[0].image, "new.png")
+        self.assertEqual(
+            stored[1].answers[2].text.localizations.FR.content, "FR updated"
+        )
+        warnings = self.dbase.get_text_warnings(text.text_id)
+        self.assertEqual(["A", "B"], sorted(w.code for w in warnings))
+
+        # Empty content removes the warning, new content updates it
+        self.dbase.save_state(
+            StageState(
+                tests=[],
+                questions=[],
+                text_warnings=[
+                    PrebuildTextWarning(
+                        text_id=text.text_id,
+                        text_localization_id=loc_id,
+                        code="A",
+                    ),
+                    PrebuildTextWarning(
+                        text_id=text.text_id,
+                        text_localization_id=loc_id,
+                        code="B",
+                        content="Warning B2",
+                    ),
+                ],
+            )
+        )
+        warnings = self.dbase.get_text_warnings(text.text_id)
+        self.assertEqual(1, len(warnings))
+        self.assertEqual("Warning B2", warnings[0].content)
+
+    def test_save_state_prefetches_in_bulk(self):
+        self.dbase.add_test(PrebuildTest(test_id=1, title=make_text("T1")))
+        self._add_questions_with_answers(test_id=1, count=5)
+        state = StageState(
+            tests=self.dbase.get_tests(),
+            questions=self.dbase.get_questions(),
+            text_warnings=[],
+        )
+        with count_queries(self.dbase.engine) as statements:
+            self.dbase.save_state(state)
+        # Prefetch queries only, no per question lookups
+        self.assertLessEqual(len(statements), 15)
+
+    def test_save_state_unknown_question(self):
+        self.dbase.add_test(PrebuildTest(test_id=1, title=make_text("T1")))
+        question = make_question(test_id=1, question_id=42, text_id=4200, en="Q")
+        with self.assertRaises(AssertionError):
+            self.dbase.save_state(
+                StageState(tests=[], questions=[question], text_warnings=[])
+            )
+
+    def test_save_state_writes_only_changed(self):
+        self.dbase.add_test(PrebuildTest(test_id=1, title=make_text("T1")))
+        self._add_questions_with_answers(test_id=1, count=3)
+        state = StageState(
+            tests=self.dbase.get_tests(),
+            questions=self.dbase.get_questions(),
+            text_warnings=[],
+        )
+        state.track_changes()
+
+        self.assertEqual(0, self.dbase.save_state(state))
+        with count_queries(self.dbase.engine) as statements:
+            self.dbase.save_state(state)
+        self.assertFalse([s for s in statements if s.startswith("UPDATE")])
+
+        state.questions[1].text.localizations.set(Language.FR, "FR Q101")
+        self.assertEqual(1, self.dbase.save_state(state))
+        stored = self.dbase.get_question(101)
+        self.assertEqual("FR Q101", stored.text.localizations.FR.content)
+
+    def test_unit_of_work_commits_together(self):
+        with self.dbase.unit_of_work():
+            self.dbase.add_test(PrebuildTest(test_id=1, title=make_text("T1")))
+            self.dbase.add_question(
+                make_question(test_id=1, question_id=1, text_id=300, en="Q1")
+            )
+            # Changes are visible inside the unit of work
+            self.assertEqual(1, len(self.dbase.get_tests()))
+            self.assertIsNotNone(self.dbase.get_question(1))
+        self.assertEqual(1, len(self.dbase.get_tests()))
+        self.assertIsNotNone(self.dbase.get_question(1))
+
+    def test_unit_of_work_rolls_back_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with self.dbase.unit_of_work():
+                self.dbase.add_test(PrebuildTest(test_id=1, title=make_text("T1")))
+                raise RuntimeError("stop")
+        self.assertEqual([], self.dbase.get_tests())
+
+    def test_concurrent_reader_during_write(self):
+        self.dbase.add_test(PrebuildTest(test_id=1, title=make_text("T1")))
+        reader = PrebuildDBase(self.tmpdir)
+        try:
+            with self.dbase.unit_of_work() as session:
+                self.dbase.add_test(PrebuildTest(test_id=2, title=make_text("T2")))
+                session.flush()
+                # WAL: the reader sees the last committed state without waiting
+                self.assertEqual(1, len(reader.get_tests()))
+            self.assertEqual(2, len(reader.get_tests()))
+        finally:
+            reader.close()
+
+    def test_foreign_key_indexes(self):
+        inspector = inspect(self.dbase.engine)
+        for table, column in [
+            ("TextLocalizations", "TextId"),
+            ("TextWarnings", "TextId"),
+            ("Questions", "TestId"),
+            ("Answers", "QuestionId"),
+        ]:
+            indexed = [index["column_names"] for index in inspector.get_indexes(table)]
+            self.assertIn([column], indexed, table)
+
+    def test_migrate_adds_missing_indexes(self):
+        with self.dbase.engine.begin() as connection:
+            connection.exec_driver_sql('DROP INDEX "ix_Questions_TestId"')
+        self.dbase.close()
+
+        self.dbase = PrebuildDBase(self.tmpdir)
+        indexes = inspect(self.dbase.engine).get_indexes("Questions")
+        self.assertIn("ix_Questions_TestId", [index["name"] for index in indexes])
+        # Idempotent
+        self.dbase.migrate()
+
+    def test_migrate_adds_missing_tables(self):
+        with self.dbase.engine.begin() as connection:
+            connection.exec_driver_sql('DROP TABLE "TextStageMarks"')
+        self.dbase.close()
+
+        self.dbase = PrebuildDBase(self.tmpdir)
+        self.assertTrue(inspect(self.dbase.engine).has_table("TextStageMarks"))
@@ -0,0 +1,61 @@
+import os
+import unittest
+import tempfile
+from quiz_dataset_tools.prebuild.journal import JournalEntry, StageJournal
+from quiz_dataset_tools.prebuild.types import PrebuildQuestion, PrebuildTextWarning
+from tests.common import make_text
+
+
+class TestStageJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "journal", "0-Stage.jsonl")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_entry(self, question_id: int) -> JournalEntry:
+        return JournalEntry(
+            question_id=question_id,
+            input_fingerprint=f"fp{question_id}",
+            question=PrebuildQuestion(
+                test_id=1,
+                question_id=question_id,
+                text=make_text(f"Q{question_id}", fr=f"FR Q{question_id}"),
+                answers=[],
+            ),
+            warnings=[PrebuildTextWarning(code="A", content="Warning")],
+        )
+
+    def test_roundtrip(self):
+        entries = [self.make_entry(i) for i in range(1, 4)]
+        journal = StageJournal(self.path, interval=2)
+        journal.record(entries[0])
+        self.assertFalse(os.path.exists(self.path))
+        journal.record(entries[1])
+        journal.record(entries[2])
+        journal.flush()
+
+        loaded = StageJournal(self.path)
+        self.assertEqual(3, loaded.load())
+        self.assertEqual(entries[1], loaded.get(2, "fp2"))
+        # Input was changed since the entry was recorded
+        self.assertIsNone(loaded.get(2, "fp-other"))
+        self.assertIsNone(loaded.get(4, "fp4"))
+
+    def test_cut_line_is_skipped(self):
+        journal = StageJournal(self.path, interval=1)
+        journal.record(self.make_entry(1))
+        with open(self.path, "a") as fd:
+            fd.write('{"question_id": 2, "inp')
+
+        loaded = StageJournal(self.path)
+        self.assertEqual(1, loaded.load())
+        self.assertIsNotNone(loaded.get(1, "fp1"))
+
+    def test_remove(self):
+        journal = StageJournal(self.path, interval=1)
+        journal.record(self.make_entry(1))
+        journal.remove()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(0, StageJournal(self.path).load())
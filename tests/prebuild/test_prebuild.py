@@ -0,0 +1,280 @@
+import os
+import unittest
+import tempfile
+import shutil
+from unittest.mock import patch
+from quiz_dataset_tools.util.language import Language
+from quiz_dataset_tools.util.gpt import GPTServiceWithCache
+from quiz_dataset_tools.util.gpt_batch import LocalBatchBackend
+from quiz_dataset_tools.prebuild.dbase import PrebuildDBase
+from quiz_dataset_tools.prebuild.prebuild import PrebuildBuilder
+from quiz_dataset_tools.prebuild.metrics import StageMetrics
+from quiz_dataset_tools.prebuild.stage import (
+    DataUpdateBaseStage,
+    VerificationStage,
+)
+from quiz_dataset_tools.prebuild.types import (
+    PrebuildQuestion,
+    PrebuildTest,
+    PrebuildTextWarning,
+)
+from tests.common import make_text, make_question
+
+
+class SetLocalizationStage(DataUpdateBaseStage):
+    def __init__(self, lang: Language):
+        self.lang = lang
+
+    def get_mark_salt(self) -> str:
+        return self.lang.name
+
+    def update_question(self, question: PrebuildQuestion) -> None:
+        content = question.text.localizations.EN.content
+        question.text.localizations.set(self.lang, f"{self.lang.name} {content}")
+
+
+class LocalizationWarningStage(VerificationStage):
+    def __init__(self):
+        self.flushed = False
+
+    def check_question(self, question: PrebuildQuestion) -> list[PrebuildTextWarning]:
+        localization = question.text.localizations.FR
+        assert localization.text_localization_id is not None
+        return [
+            PrebuildTextWarning(
+                text_id=question.text.text_id,
+                text_localization_id=localization.text_localization_id,
+                code="CHECK",
+                content=localization.content,
+            )
+        ]
+
+    def flush(self):
+        self.flushed = True
+
+
+class FailingStage(SetLocalizationStage):
+    def __init__(self, lang: Language, fail_question_id: int | None):
+        super().__init__(lang)
+        self.fail_question_id = fail_question_id
+        self.processed: list[int] = []
+
+    def update_question(self, question: PrebuildQuestion) -> None:
+        if question.question_id == self.fail_question_id:
+            raise Exception("Network is down")
+        self.processed.append(question.question_id)
+        super().update_question(question)
+
+
+class MarkedLocalizationStage(SetLocalizationStage):
+    mark_name = "localization"
+
+    def __init__(self, lang: Language):
+        super().__init__(lang)
+        self.updated: list[int] = []
+
+    def update_question(self, question: PrebuildQuestion) -> None:
+        self.updated.append(question.question_id)
+        super().update_question(question)
+
+
+class GPTLocalizationStage(SetLocalizationStage):
+    def __init__(self, lang: Language):
+        super().__init__(lang)
+        self.gpt = GPTServiceWithCache("test-pipeline-batch", "model")
+
+    def update_question(self, question: PrebuildQuestion) -> None:
+        content = question.text.localizations.EN.content
+        question.text.localizations.set(self.lang, self.gpt.send_prompt(content))
+
+
+class TestRunPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        dbase = PrebuildDBase(self.tmpdir)
+        dbase.bootstrap()
+        dbase.add_test(PrebuildTest(test_id=1, title=make_text("T1")))
+        dbase.add_question(make_question(test_id=1, question_id=1, text_id=10, en="Q1"))
+        dbase.add_question(make_question(test_id=1, question_id=2, text_id=20, en="Q2"))
+        dbase.close()
+
+        self.builder = PrebuildBuilder()
+        self.builder.set_output_dir(self.tmpdir)
+        self.saves_count = 0
+        save_stage_state = self.builder._save_stage_state_to_dbase
+
+        def count_saves(dbase, state):
+            self.saves_count += 1
+            return save_stage_state(dbase, state)
+
+        self.builder._save_stage_state_to_dbase = count_saves
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_questions(self) -> list[PrebuildQuestion]:
+        dbase = PrebuildDBase(self.tmpdir)
+        try:
+            return dbase.read_questions()
+        finally:
+            dbase.close()
+
+    def test_pipeline_saves_once(self):
+        self.builder.run_pipeline(
+            [SetLocalizationStage(Language.FR), SetLocalizationStage(Language.ES)]
+        )
+        self.assertEqual(1, self.saves_count)
+        question = self.read_questions()[0]
+        self.assertEqual("FR Q1", question.text.localizations.FR.content)
+        self.assertEqual("ES Q1", question.text.localizations.ES.content)
+
+    def test_pipeline_saves_before_verification(self):
+        verification_stage = LocalizationWarningStage()
+        self.builder.run_pipeline(
+            [SetLocalizationStage(Language.FR), verification_stage]
+        )
+        self.assertEqual(2, self.saves_count)
+        self.assertTrue(verification_stage.flushed)
+        question = self.read_questions()[1]
+        self.assertEqual(
+            ["FR Q2"], [warning.content for warning in question.text.warnings]
+        )
+
+    def test_pipeline_checkpoint(self):
+        self.builder.run_pipeline(
+            [SetLocalizationStage(Language.FR), SetLocalizationStage(Language.ES)],
+            checkpoint=True,
+        )
+        self.assertEqual(2, self.saves_count)
+
+    def test_pipeline_without_changes(self):
+        self.builder.run_pipeline([DataUpdateBaseStage()])
+        self.assertEqual(0, self.saves_count)
+
+    def test_pipeline_resumes_from_journal(self):
+        self.builder.set_journal_interval(1)
+        stage = FailingStage(Language.FR, fail_question_id=2)
+        with self.assertRaisesRegex(Exception, "question 2: Network is down"):
+            self.builder.run_pipeline([stage])
+        self.assertEqual(0, self.saves_count)
+        self.assertTrue(os.listdir(os.path.join(self.tmpdir, "journal")))
+
+        stage = FailingStage(Language.FR, fail_question_id=None)
+        self.builder.run_pipeline([stage])
+        # The first question is taken from the journal
+        self.assertEqual([2], stage.processed)
+        self.assertEqual(
+            ["FR Q1", "FR Q2"],
+            [q.text.localizations.FR.content for q in self.read_questions()],
+        )
+        self.assertEqual([], os.listdir(os.path.join(self.tmpdir, "journal")))
+
+    def test_pipeline_drops_journal_of_other_settings(self):
+        self.builder.set_journal_interval(1)
+        stage = FailingStage(Language.FR, fail_question_id=2)
+        with self.assertRaisesRegex(Exception, "question 2: Network is down"):
+            self.builder.run_pipeline([stage])
+
+        stage = FailingStage(Language.ES, fail_question_id=None)
+        self.builder.run_pipeline([stage])
+        self.assertEqual([1, 2], stage.processed)
+        questions = self.read_questions()
+        self.assertEqual(
+            ["ES Q1", "ES Q2"],
+            [q.text.localizations.ES.content for q in questions],
+        )
+        self.assertIsNone(questions[0].text.localizations.FR)
+        self.assertEqual([], os.listdir(os.path.join(self.tmpdir, "journal")))
+
+    def test_pipeline_without_journal(self):
+        self.builder.set_journal_interval(0)
+        self.builder.run_pipeline([SetLocalizationStage(Language.FR)])
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "journal")))
+
+    def test_pipeline_filter(self):
+        self.builder.set_filter(question_ids=[2])
+        self.builder.run_pipeline([SetLocalizationStage(Language.FR)])
+        questions = self.read_questions()
+        self.assertIsNone(questions[0].text.localizations.get(Language.FR))
+        self.assertEqual("FR Q2", questions[1].text.localizations.FR.content)
+
+    def test_pipeline_steady_state(self):
+        stage = MarkedLocalizationStage(Language.FR)
+        self.builder.run_pipeline([stage])
+        self.assertEqual([1, 2], stage.updated)
+        self.assertEqual(1, self.saves_count)
+
+        stage = MarkedLocalizationStage(Language.FR)
+        self.builder.run_pipeline([stage])
+        self.assertEqual([], stage.updated)
+        self.assertEqual(1, self.saves_count)
+
+        # An edit outside the stages invalidates the marks
+        dbase = PrebuildDBase(self.tmpdir)
+        text = dbase.read_questions(question_ids=[2])[0].text
+        text.localizations.set(Language.EN, "Q2 edited")
+        dbase.update_text(text)
+        dbase.close()
+        self.builder.run_pipeline([stage])
+        self.assertEqual([2], stage.updated)
+
+        self.builder.set_force(True)
+        stage = MarkedLocalizationStage(Language.FR)
+        self.builder.run_pipeline([stage])
+        self.assertEqual([1, 2], stage.updated)
+
+    def test_pipeline_metrics(self):
+        metrics_path = os.path.join(self.tmpdir, "metrics.jsonl")
+        self.builder.set_metrics_path(metrics_path)
+        self.builder.run_pipeline(
+            [SetLocalizationStage(Language.FR), LocalizationWarningStage()]
+        )
+        with open(metrics_path) as fd:
+            records = [StageMetrics.from_json(line) for line in fd]
+        self.assertEqual(
+            ["SetLocalizationStage", "LocalizationWarningStage"],
+            [metrics.stage for metrics in records],
+        )
+        self.assertEqual([2, 2], [metrics.questions for metrics in records])
+        self.assertEqual([0, 2], [metrics.warnings for metrics in records])
+        # Translations are saved before the checks, warnings at the end
+        self.assertEqual(4, records[1].written_entities)
+        self.assertGreater(records[0].load_seconds, 0)
+        self.assertGreater(records[1].save_seconds, 0)
+
+    @patch("quiz_dataset_tools.util.gpt.client")
+    def test_pipeline_batch(self, client):
+        client.chat.completions.create.side_effect = Exception("Not batched")
+        prompts: list[str] = []
+
+        def responder(body: dict) -> str:
+            prompt = body["messages"][0]["content"][0]["text"]
+            prompts.append(prompt)
+            return f"FR {prompt}"
+
+        self.builder.set_batch_backend(LocalBatchBackend(responder))
+        with (
+            patch(
+                "quiz_dataset_tools.util.cache.StringCache.CACHE_FILE_TEMPL",
+                self.tmpdir + "/cache/{}/{}.cache",
+            ),
+            patch(
+                "quiz_dataset_tools.util.cache.StringCache.CACHE_FILE_TEMP_TEMPL",
+                self.tmpdir + "/cache/{}/{}.cache.tmp",
+            ),
+        ):
+            self.builder.run_pipeline([GPTLocalizationStage(Language.FR)])
+        self.assertEqual(["Q1", "Q2"], sorted(prompts))
+        self.assertEqual(1, self.saves_count)
+        self.assertEqual(
+            ["FR Q1", "FR Q2"],
+            [q.text.localizations.FR.content for q in self.read_questions()],
+        )
+        # Placeholders of the dry run are not journaled
+        self.assertEqual([], os.listdir(os.path.join(self.tmpdir, "journal")))
+
+    def test_stage_max_workers(self):
+        self.assertEqual(10, self.builder.make_doctor_stage("on").max_workers)
+        self.assertEqual(1, self.builder.make_question_comment_stage("on").max_workers)
+        self.builder.set_max_workers(3)
+        self.assertEqual(3, self.builder.make_doctor_stage("on").max_workers)
@@ -1,7 +1,12 @@
+import time
 import unittest
 from unittest.mock import MagicMock
 from quiz_dataset_tools.util.language import Language, TextLocalizations
-from quiz_dataset_tools.prebuild.stage import StageState, VerificationStage
+from quiz_dataset_tools.prebuild.stage import (
+    DataUpdateBaseStage,
+    StageState,
+    VerificationStage,
+)
 from quiz_dataset_tools.prebuild.stages.compose import ComposeMode, ComposeStage
 from quiz_dataset_tools.prebuild.types import (
     PrebuildAnswer,
@@ -9,6 +14,7 @@ from quiz_dataset_tools.prebuild.types import (
     PrebuildTest,
     PrebuildTextWarning,
 )
+from quiz_dataset_tools.util.concurrency import report_request, report_success
 from tests.common import make_text
 
 
@@ -54,9 +60,10 @@ class TestVerificationStage(unittest.TestCase):
         state = StageState(tests=self.tests, questions=self.questions, text_warnings=[])
         result = self.stage.process(state)
 
-        # Should not mutate input
+        # Should not mutate input, read only questions are shared
         self.assertTrue(result is not state)
-        self.assertTrue(result.questions[0] is not state.questions[0])
+        self.assertTrue(result.questions is not state.questions)
+        self.assertTrue(result.questions[0] is state.questions[0])
         # Should have empty warnings since defaults return []
         self.assertEqual([], result.text_warnings)
 
@@ -106,3 +113,235 @@ class TestVerificationStage(unittest.TestCase):
         self.assertEqual(
             expected_warnings, sorted(result.text_warnings, key=lambda w: w.content)
         )
+
+
+class UpperCaseStage(DataUpdateBaseStage):
+    # Updates only the questions that have "X" in the text
+    def update_question(self, question: PrebuildQuestion) -> None:
+        content = question.text.localizations.EN.content
+        if "X" in content:
+            question.text.localizations.set(Language.FR, content.upper())
+
+    def update_answer(self, question: PrebuildQuestion, answer: PrebuildAnswer) -> None:
+        if "X" in question.text.localizations.EN.content:
+            answer.text.localizations.set(
+                Language.FR, question.text.localizations.EN.content
+            )
+
+
+class TestDataUpdateBaseStage(unittest.TestCase):
+    def setUp(self):
+        self.state = StageState(
+            tests=[PrebuildTest(test_id=1, title=make_text("Test 1"))],
+            questions=[
+                PrebuildQuestion(
+                    test_id=1,
+                    question_id=1,
+                    text=make_text("q1"),
+                    answers=[
+                        PrebuildAnswer(text=make_text("a1"), is_right_answer=True)
+                    ],
+                ),
+                PrebuildQuestion(
+                    test_id=1,
+                    question_id=2,
+                    text=make_text("qX2"),
+                    answers=[
+                        PrebuildAnswer(text=make_text("a2"), is_right_answer=True)
+                    ],
+                ),
+            ],
+            text_warnings=[],
+        )
+
+    def test_copy_on_write(self):
+        questions = list(self.state.questions)
+        result = UpperCaseStage().process(self.state)
+
+        # Unchanged entities are shared
+        self.assertTrue(result.tests[0] is self.state.tests[0])
+        self.assertTrue(result.questions[0] is questions[0])
+        # Changed question is replaced, the input is left intact
+        self.assertTrue(result.questions[1] is not questions[1])
+        self.assertEqual("QX2", result.questions[1].text.localizations.FR.content)
+        self.assertEqual(
+            "qX2", result.questions[1].answers[0].text.localizations.FR.content
+        )
+        self.assertIsNone(questions[1].text.localizations.FR)
+        self.assertIsNone(questions[1].answers[0].text.localizations.FR)
+        self.assertEqual(questions, self.state.questions)
+
+    def test_changed_questions_after_stage(self):
+        self.state.track_changes()
+        result = UpperCaseStage().process(self.state)
+        self.assertEqual([result.questions[1]], result.get_changed_questions())
+        self.assertEqual([], self.state.get_changed_questions())
+
+
+class MarkedUpperCaseStage(UpperCaseStage):
+    mark_name = "upper"
+
+    def __init__(self, salt: str = ""):
+        self.salt = salt
+        self.updated: list[int] = []
+
+    def get_mark_salt(self) -> str:
+        return self.salt
+
+    def update_question(self, question: PrebuildQuestion) -> None:
+        self.updated.append(question.question_id)
+        super().update_question(question)
+
+
+class CountingVerificationStage(VerificationStage):
+    mark_name = "check"
+
+    def __init__(self):
+        self.checked: list[int] = []
+
+    def check_question(self, question: PrebuildQuestion) -> list[PrebuildTextWarning]:
+        self.checked.append(question.question_id)
+        return []
+
+
+class TestStageMarks(unittest.TestCase):
+    def setUp(self):
+        self.state = StageState(
+            tests=[],
+            questions=[
+                PrebuildQuestion(
+                    test_id=1,
+                    question_id=i,
+                    text=make_text(f"q{'X' * (i - 1)}{i}"),
+                    answers=[
+                        PrebuildAnswer(text=make_text(f"a{i}"), is_right_answer=True)
+                    ],
+                )
+                for i in [1, 2]
+            ],
+            text_warnings=[],
+        )
+
+    def test_unchanged_questions_are_skipped(self):
+        stage = MarkedUpperCaseStage()
+        result = stage.process(self.state)
+        self.assertEqual([1, 2], stage.updated)
+        # Marks are set on copies
+        self.assertEqual({}, self.state.questions[0].text.stage_marks)
+        self.assertEqual(["upper"], list(result.questions[0].text.stage_marks))
+
+        stage = MarkedUpperCaseStage()
+        rerun = stage.process(result)
+        self.assertEqual([], stage.updated)
+        self.assertEqual(result.questions, rerun.questions)
+
+    def test_changed_questions_are_reprocessed(self):
+        result = MarkedUpperCaseStage().process(self.state)
+        result.questions[1].answers[0].text.localizations.set(Language.EN, "b2")
+        stage = MarkedUpperCaseStage()
+        stage.process(result)
+        self.assertEqual([2], stage.updated)
+
+    def test_force_and_salt(self):
+        result = MarkedUpperCaseStage().process(self.state)
+        stage = MarkedUpperCaseStage()
+        stage.set_force(True)
+        stage.process(result)
+        self.assertEqual([1, 2], stage.updated)
+        stage = MarkedUpperCaseStage(salt="other")
+        stage.process(result)
+        self.assertEqual([1, 2], stage.updated)
+
+    def test_stage_changes_are_checked_again(self):
+        checked = CountingVerificationStage().process(self.state)
+        # The update stage changes the second question only
+        updated = MarkedUpperCaseStage().process(checked)
+        stage = CountingVerificationStage()
+        stage.process(updated)
+        self.assertEqual([2], stage.checked)
+
+    def test_verification_marks(self):
+        stage = CountingVerificationStage()
+        result = stage.process(self.state)
+        self.assertEqual([1, 2], stage.checked)
+        self.assertEqual({}, self.state.questions[0].text.stage_marks)
+        stage = CountingVerificationStage()
+        stage.process(result)
+        self.assertEqual([], stage.checked)
+
+
+class SlowStage(DataUpdateBaseStage):
+    # Earlier questions finish later to check the result order
+    def update_question(self, question: PrebuildQuestion) -> None:
+        # Pretends to be a remote call so the questions run concurrently
+        report_request()
+        report_success()
+        time.sleep(0.01 * (10 - question.question_id % 10))
+        if question.question_id == 13:
+            raise Exception("broken question")
+        question.text.localizations.set(Language.FR, f"fr-{question.question_id}")
+
+
+class TestDataUpdateConcurrency(unittest.TestCase):
+    def make_state(self, count: int) -> StageState:
+        return StageState(
+            tests=[],
+            questions=[
+                PrebuildQuestion(
+                    test_id=1, question_id=i, text=make_text(f"Q{i}"), answers=[]
+                )
+                for i in range(count)
+            ],
+            text_warnings=[],
+        )
+
+    def test_concurrent_result_order(self):
+        stage = SlowStage()
+        stage.set_max_workers(4)
+        result = stage.process(self.make_state(10))
+        self.assertEqual(
+            [f"fr-{i}" for i in range(10)],
+            [q.text.localizations.FR.content for q in result.questions],
+        )
+
+    def test_error_has_question_id(self):
+        for max_workers in [1, 4]:
+            stage = SlowStage()
+            stage.set_max_workers(max_workers)
+            with self.assertRaisesRegex(Exception, "question 13: broken question"):
+                stage.process(self.make_state(20))
+
+
+class TestStageState(unittest.TestCase):
+    def setUp(self):
+        self.state = StageState(
+            tests=[PrebuildTest(test_id=1, title=make_text("Test 1"))],
+            questions=[
+                PrebuildQuestion(
+                    test_id=1, question_id=1, text=make_text("Q1"), answers=[]
+                ),
+                PrebuildQuestion(
+                    test_id=1, question_id=2, text=make_text("Q2"), answers=[]
+                ),
+            ],
+            text_warnings=[],
+        )
+
+    def test_untracked_state_is_all_changed(self):
+        self.assertEqual(self.state.tests, self.state.get_changed_tests())
+        self.assertEqual(self.state.questions, self.state.get_changed_questions())
+
+    def test_track_changes(self):
+        self.state.track_changes()
+        self.assertEqual([], self.state.get_changed_tests())
+        self.assertEqual([], self.state.get_changed_questions())
+
+        self.state.questions[1].text.localizations.set(Language.FR, "fr-Q2")
+        self.state.tests[0].position = 3
+        self.assertEqual(self.state.tests, self.state.get_changed_tests())
+        self.assertEqual([self.state.questions[1]], self.state.get_changed_questions())
+
+    def test_track_changes_survives_snapshot(self):
+        self.state.track_changes()
+        state_copy = VerificationStage().process(self.state)
+        self.assertEqual([], state_copy.get_changed_questions())
@@ -39,6 +39,37 @@ class FakeTranslator(BaseTranslator):
         return self.data.get((answer_content, lang), f"un-{answer_content}")
 
 
+class RecordingTranslator(BaseTranslator):
+    def __init__(self):
+        self.calls: list[tuple[str, list[Language]]] = []
+
+    @override
+    def translate_question_multi(
+        self, question_content: str, langs: list[Language]
+    ) -> dict[Language, str]:
+        self.calls.append((question_content, langs))
+        return {lang: f"{lang.name} {question_content}" for lang in langs}
+
+
+class TestTranslator(unittest.TestCase):
+    def test_missing_languages_in_one_call(self):
+        impl = RecordingTranslator()
+        translator = Translator(
+            impl=impl, languages=[Language.RU, Language.EN, Language.FR, Language.ES]
+        )
+        text = make_text("Hello")
+        text.localizations.set(Language.FR, "Bonjour")
+        translated = translator.translate_question(text)
+        self.assertEqual([("Hello", [Language.ES, Language.RU])], impl.calls)
+        self.assertEqual("Bonjour", translated.localizations.FR.content)
+        self.assertEqual("ES Hello", translated.localizations.ES.content)
+        self.assertEqual("RU Hello", translated.localizations.RU.content)
+
+        # Nothing to translate
+        translator.translate_question(translated)
+        self.assertEqual(1, len(impl.calls))
+
+
 class TestTranslateStage(unittest.TestCase):
     def setUp(self):
         pass
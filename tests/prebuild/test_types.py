@@ -82,3 +82,34 @@ class TestPrebuildText(unittest.TestCase):
         text = PrebuildText(localizations=TextLocalizations())
         with self.assertRaises(AssertionError):
             text.get_original_canonical()
+
+
+class TestPrebuildQuestionCopy(unittest.TestCase):
+    def test_copy_is_independent(self):
+        text = PrebuildText(
+            localizations=TextLocalizations(EN=TextLocalization("Q", 1)),
+            original=TextLocalizations(EN=TextLocalization("Q")),
+            stage_marks={"doctor": "a:b"},
+        )
+        answer = PrebuildAnswer(
+            text=PrebuildText(
+                localizations=TextLocalizations(EN=TextLocalization("A"))
+            ),
+            is_right_answer=True,
+        )
+        question = PrebuildQuestion(
+            test_id=1, question_id=1, text=text, answers=[answer]
+        )
+        question_copy = question.copy()
+        self.assertEqual(question, question_copy)
+
+        question_copy.text.localizations.EN.content = "Changed"
+        question_copy.text.localizations.set(Language.FR, "FR")
+        question_copy.text.stage_marks["doctor"] = "c:d"
+        question_copy.answers[0].text.localizations.set(Language.FR, "FR")
+        question_copy.answers.append(answer)
+        self.assertEqual("Q", question.text.localizations.EN.content)
+        self.assertIsNone(question.text.localizations.FR)
+        self.assertEqual({"doctor": "a:b"}, question.text.stage_marks)
+        self.assertIsNone(question.answers[0].text.localizations.FR)
+        self.assertEqual(1, len(question.answers))
@@ -0,0 +1,119 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+from quiz_dataset_tools.util.gpt import set_batch
+from quiz_dataset_tools.util.gpt_batch import GPTBatch, LocalBatchBackend
+from quiz_dataset_tools.util.language import Language
+from quiz_dataset_tools.prebuild.translation.gpt import GPTTranslator
+
+
+class TestGPTTranslator(unittest.TestCase):
+    def setUp(self):
+        self.translator = GPTTranslator("on")
+        self.send_prompt = MagicMock()
+        self.translator.gpt_service.impl.send_prompt = self.send_prompt
+
+    def prompts(self) -> list[str]:
+        return [call.args[0] for call in self.send_prompt.call_args_list]
+
+    def test_one_request_for_all_languages(self):
+        self.send_prompt.return_value = json.dumps(
+            {"FR": "« Bonjour »", "ES": "Hola", "RU": "Привет"}
+        )
+        self.assertEqual(
+            {Language.FR: "Bonjour", Language.ES: "Hola", Language.RU: "Привет"},
+            self.translator.translate_question_multi(
+                "Hello", [Language.RU, Language.FR, Language.ES]
+            ),
+        )
+        [prompt] = self.prompts()
+        # Sorted, the prompt does not depend on the order of the languages
+        self.assertIn("French (FR), Spanish (ES), Russian (RU)", prompt)
+        # Only the single language results are cached
+        self.assertIsNone(self.translator.gpt_service.cache.get(prompt))
+        self.assertEqual(3, len(self.translator.gpt_service.cache.cache))
+        # Each language is cached under its own prompt
+        self.assertEqual(
+            "Hola", self.translator.translate_question("Hello", Language.ES)
+        )
+        self.assertEqual(1, self.send_prompt.call_count)
+
+    def test_cached_languages_are_not_asked(self):
+        self.send_prompt.return_value = "Bonjour"
+        self.translator.translate_answer("Hello", "Greeting?", Language.FR)
+        self.send_prompt.return_value = '```json\n{"ES": "Hola", "RU": "Привет"}\n```'
+        self.assertEqual(
+            {Language.FR: "Bonjour", Language.ES: "Hola", Language.RU: "Привет"},
+            self.translator.translate_answer_multi(
+                "Hello", "Greeting?", [Language.FR, Language.ES, Language.RU]
+            ),
+        )
+        prompt = self.prompts()[-1]
+        self.assertIn("Spanish (ES), Russian (RU)", prompt)
+        self.assertNotIn("French", prompt)
+
+    def test_fallback_to_single_language(self):
+        self.send_prompt.side_effect = [
+            json.dumps({"FR": "Bonjour", "ES": ""}),
+            "Hola",
+        ]
+        with self.assertLogs("quiz_dataset_tools.prebuild.translation.gpt"):
+            result = self.translator.translate_question_comment_multi(
+                "Hello", [Language.FR, Language.ES]
+            )
+        self.assertEqual({Language.FR: "Bonjour", Language.ES: "Hola"}, result)
+        self.assertIn("into Spanish,", self.prompts()[1])
+
+    def test_fallback_on_bad_json(self):
+        self.send_prompt.side_effect = ["Bonjour / Hola", "Bonjour", "Hola"]
+        with self.assertLogs("quiz_dataset_tools.prebuild.translation.gpt"):
+            result = self.translator.translate_question_multi(
+                "Hello", [Language.FR, Language.ES]
+            )
+        self.assertEqual({Language.FR: "Bonjour", Language.ES: "Hola"}, result)
+        self.assertEqual(3, self.send_prompt.call_count)
+
+    def test_batch_caches_single_languages(self):
+        batch = GPTBatch()
+        set_batch(batch)
+        try:
+            self.assertEqual(
+                {Language.FR: "", Language.ES: ""},
+                self.translator.translate_question_multi(
+                    "Hello", [Language.FR, Language.ES]
+                ),
+            )
+        finally:
+            set_batch(None)
+        [request] = batch.requests
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with (
+                patch(
+                    "quiz_dataset_tools.util.cache.StringCache.CACHE_FILE_TEMPL",
+                    os.path.join(tmpdir, "{}/{}.cache"),
+                ),
+                patch(
+                    "quiz_dataset_tools.util.cache.StringCache.CACHE_FILE_TEMP_TEMPL",
+                    os.path.join(tmpdir, "{}/{}.cache.tmp"),
+                ),
+            ):
+                batch.submit(
+                    LocalBatchBackend(lambda _: '{"FR": "Bonjour", "ES": "Hola"}'),
+                    tmpdir,
+                )
+        cache = self.translator.gpt_service.cache.cache
+        self.assertNotIn(request.cache_key, cache)
+        self.assertEqual(2, len(cache))
+        self.assertEqual(
+            {Language.FR: "Bonjour", Language.ES: "Hola"},
+            self.translator.translate_question_multi(
+                "Hello", [Language.FR, Language.ES]
+            ),
+        )
+        self.send_prompt.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from quiz_dataset_tools.util.backup import (
+    BackupManager,
+    BackupPolicy,
+    TIMESTAMP_FORMAT,
+)
+
+
+class TestBackupManager(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.database_path = os.path.join(self.tmpdir.name, "prebuild.db")
+        with sqlite3.connect(self.database_path) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE Items (Value TEXT)")
+            connection.execute("INSERT INTO Items VALUES ('first')")
+        connection.close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _insert(self, value: str) -> None:
+        connection = sqlite3.connect(self.database_path)
+        with connection:
+            connection.execute("INSERT INTO Items VALUES (?)", (value,))
+        connection.close()
+
+    def _read_values(self, path: str) -> list[str]:
+        connection = sqlite3.connect(path)
+        try:
+            return [row[0] for row in connection.execute("SELECT Value FROM Items")]
+        finally:
+            connection.close()
+
+    def _touch_backup(self, manager: BackupManager, timestamp: datetime) -> str:
+        path = os.path.join(
+            manager.backup_dir,
+            manager.backup_prefix + timestamp.strftime(TIMESTAMP_FORMAT),
+        )
+        os.makedirs(manager.backup_dir, exist_ok=True)
+        open(path, "w").close()
+        return path
+
+    def test_backup_copies_content(self):
+        manager = BackupManager(self.database_path)
+        backup_path = manager.backup()
+        self.assertIsNotNone(backup_path)
+        self.assertEqual(["first"], self._read_values(backup_path))
+
+    def test_backup_skipped_when_unchanged(self):
+        manager = BackupManager(self.database_path)
+        first = manager.backup()
+        self.assertIsNone(manager.backup())
+        self.assertEqual([first], [path for _, path in manager.list_backups()])
+
+        self._insert("second")
+        second = manager.backup()
+        self.assertIsNotNone(second)
+        self.assertEqual(["first", "second"], self._read_values(second))
+        self.assertEqual(2, len(manager.list_backups()))
+
+    def test_unchanged_database_is_not_read(self):
+        manager = BackupManager(self.database_path)
+        manager.backup()
+        # The first check sees the WAL the backup checkpointed
+        manager.backup()
+        with patch.object(BackupManager, "_content_hash") as content_hash:
+            self.assertIsNone(manager.backup())
+            self.assertIsNone(manager.backup())
+        content_hash.assert_not_called()
+        self._insert("second")
+        self.assertIsNotNone(manager.backup())
+
+    def test_missing_database(self):
+        missing_path = os.path.join(self.tmpdir.name, "missing.db")
+        self.assertIsNone(BackupManager(missing_path).backup())
+        self.assertFalse(os.path.exists(missing_path))
+
+    def test_policy_from_str(self):
+        self.assertEqual(BackupPolicy(), BackupPolicy.from_str(""))
+        self.assertEqual(
+            BackupPolicy(keep_last=2, keep_daily=0),
+            BackupPolicy.from_str("keep_last=2, keep_daily=0"),
+        )
+        for policy in ["keep=1", "keep_last", "keep_last=two", "keep_daily=-1"]:
+            with self.assertRaises(Exception):
+                BackupPolicy.from_str(policy)
+
+    def test_backup_after_removed_backup(self):
+        manager = BackupManager(self.database_path)
+        os.remove(manager.backup())
+        self.assertIsNotNone(manager.backup())
+
+    def test_retention_keep_last(self):
+        manager = BackupManager(
+            self.database_path, BackupPolicy(keep_last=2, keep_daily=0)
+        )
+        now = datetime.now()
+        paths = [
+            self._touch_backup(manager, now - timedelta(minutes=i)) for i in range(4)
+        ]
+        removed = manager.apply_retention()
+        self.assertEqual(sorted(paths[2:]), sorted(removed))
+        self.assertEqual(paths[:2], [path for _, path in manager.list_backups()])
+
+    def test_retention_keep_daily(self):
+        manager = BackupManager(
+            self.database_path, BackupPolicy(keep_last=1, keep_daily=3)
+        )
+        now = datetime(2024, 5, 10, 12, 0)
+        newest = self._touch_backup(manager, now)
+        same_day = self._touch_backup(manager, now - timedelta(hours=1))
+        day_before = self._touch_backup(manager, now - timedelta(days=1))
+        day_before_older = self._touch_backup(manager, now - timedelta(days=1, hours=1))
+        too_old = self._touch_backup(manager, now - timedelta(days=3))
+        removed = manager.apply_retention()
+        self.assertEqual(sorted([same_day, day_before_older, too_old]), sorted(removed))
+        self.assertEqual(
+            [newest, day_before], [path for _, path in manager.list_backups()]
+        )
+
+    def test_list_backups_ignores_foreign_files(self):
+        manager = BackupManager(self.database_path)
+        manager.backup()
+        os.makedirs(manager.backup_dir, exist_ok=True)
+        open(os.path.join(manager.backup_dir, "prebuild.db.old"), "w").close()
+        open(os.path.join(manager.backup_dir, "other.db"), "w").close()
+        self.assertEqual(1, len(manager.list_backups()))
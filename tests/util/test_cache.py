@@ -1,8 +1,16 @@
 import unittest
 import os
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch
-from quiz_dataset_tools.util.cache import StringCache
+from quiz_dataset_tools.util.cache import (
+    CACHE_COALESCED,
+    CACHE_HIT,
+    CACHE_MISS,
+    StringCache,
+)
 
 
 class TestStringCache(unittest.TestCase):
@@ -27,6 +35,59 @@ class TestStringCache(unittest.TestCase):
         cache.get_or_retrieve("key", lambda s: "value")
         self.assertEqual(cache.cache["key"], "value")
 
+    def test_lookup_outcomes(self):
+        cache = StringCache(domain="test", name="test")
+        self.assertEqual(("KEY", CACHE_MISS), cache.lookup("key", str.upper))
+        self.assertEqual(("KEY", CACHE_HIT), cache.lookup("key", str.upper))
+        self.assertEqual((1, 1, 0), (cache.hits, cache.misses, cache.coalesced))
+
+    def test_concurrent_lookups_coalesce(self):
+        cache = StringCache(domain="test", name="test")
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def retriever(src_text: str) -> str:
+            calls.append(src_text)
+            started.set()
+            release.wait(5)
+            return src_text.upper()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            first = executor.submit(cache.lookup, "key", retriever)
+            started.wait(5)
+            others = [executor.submit(cache.lookup, "key", retriever) for _ in range(3)]
+            while cache.coalesced < 3:
+                time.sleep(0.001)
+            release.set()
+            self.assertEqual(("KEY", CACHE_MISS), first.result())
+            for other in others:
+                self.assertEqual(("KEY", CACHE_COALESCED), other.result())
+        self.assertEqual(["key"], calls)
+        self.assertEqual({}, cache.pending)
+
+    def test_coalesced_lookups_share_errors(self):
+        cache = StringCache(domain="test", name="test")
+        release = threading.Event()
+
+        def retriever(src_text: str) -> str:
+            release.wait(5)
+            raise Exception("Network is down")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(cache.lookup, "key", retriever)
+            while not cache.pending:
+                time.sleep(0.001)
+            other = executor.submit(cache.lookup, "key", retriever)
+            while not cache.coalesced:
+                time.sleep(0.001)
+            release.set()
+            for future in [first, other]:
+                with self.assertRaisesRegex(Exception, "Network is down"):
+                    future.result()
+        # The next lookup retries
+        self.assertEqual(("KEY", CACHE_MISS), cache.lookup("key", str.upper))
+
     def test_save_and_load(self):
         with tempfile.TemporaryDirectory() as tmpdir:
             cache_file = os.path.join(tmpdir, "test.cache")
@@ -50,3 +111,78 @@ class TestStringCache(unittest.TestCase):
                 cache2.load()
                 self.assertEqual(cache2.cache["key1"], "val1")
                 self.assertEqual(cache2.cache["key2"], "val2")
+
+    def test_savers_keep_each_other_entries(self):
+        # The domain processes share the cache files, each loaded them
+        # before the others saved
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with (
+                patch.object(
+                    StringCache,
+                    "CACHE_FILE_TEMPL",
+                    os.path.join(tmpdir, "{}/{}.cache"),
+                ),
+                patch.object(
+                    StringCache,
+                    "CACHE_FILE_TEMP_TEMPL",
+                    os.path.join(tmpdir, "{}/{}.cache.tmp"),
+                ),
+            ):
+                caches = [StringCache(domain="d", name="n") for _ in range(4)]
+                for cache in caches:
+                    cache.load()
+
+                def fill(index: int) -> None:
+                    for i in range(50):
+                        caches[index].put(f"key{index}-{i}", f"val{i}")
+                    caches[index].save()
+
+                with ThreadPoolExecutor(max_workers=4) as executor:
+                    list(executor.map(fill, range(4)))
+
+                cache = StringCache(domain="d", name="n")
+                cache.load()
+                self.assertEqual(200, len(cache.cache))
+                self.assertEqual("val7", cache.cache["key3-7"])
+                self.assertEqual(
+                    ["n.cache", "n.cache.lock"], sorted(os.listdir(f"{tmpdir}/d"))
+                )
+
+    def test_save_creates_directories(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with (
+                patch.object(
+                    StringCache, "CACHE_FILE_TEMPL", os.path.join(tmpdir, "{}/{}.cache")
+                ),
+                patch.object(
+                    StringCache,
+                    "CACHE_FILE_TEMP_TEMPL",
+                    os.path.join(tmpdir, "tmp/{}/{}.cache.tmp"),
+                ),
+            ):
+                cache = StringCache(domain="d", name="n")
+                cache.put("key", "val")
+                cache.save()
+                self.assertTrue(os.path.exists(os.path.join(tmpdir, "d/n.cache")))
+
+    def test_save_does_not_block_lookups(self):
+        cache = StringCache(domain="d", name="n")
+        cache.cache = {"key": "val"}
+        saving = threading.Event()
+        release = threading.Event()
+
+        def slow_save(snapshot: dict[str, str]) -> dict[str, str]:
+            saving.set()
+            release.wait(5)
+            return {**snapshot, "other": "saved"}
+
+        with patch.object(cache, "_save", side_effect=slow_save):
+            thread = threading.Thread(target=cache.save)
+            thread.start()
+            self.assertTrue(saving.wait(1))
+            self.assertEqual(("val", CACHE_HIT), cache.lookup("key", str.upper))
+            self.assertEqual(("NEW", CACHE_MISS), cache.lookup("new", str.upper))
+            release.set()
+            thread.join()
+        # Entries saved by the others are picked up, the new one is kept
+        self.assertEqual({"key": "val", "new": "NEW", "other": "saved"}, cache.cache)
@@ -0,0 +1,130 @@
+import time
+import threading
+import unittest
+from quiz_dataset_tools.util.concurrency import (
+    AdaptiveLimiter,
+    adaptive_map,
+    report_request,
+    report_success,
+    report_throttle,
+)
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    def test_additive_increase(self):
+        limiter = AdaptiveLimiter(max_limit=3)
+        self.assertEqual(1, limiter.limit)
+        limiter.on_success()
+        self.assertEqual(2, limiter.limit)
+        limiter.on_success()
+        self.assertEqual(2, limiter.limit)
+        limiter.on_success()
+        self.assertEqual(3, limiter.limit)
+        for _ in range(10):
+            limiter.on_success()
+        self.assertEqual(3, limiter.limit)
+
+    def test_initial_limit(self):
+        self.assertEqual(4, AdaptiveLimiter(max_limit=10, initial_limit=4).limit)
+        self.assertEqual(2, AdaptiveLimiter(max_limit=2, initial_limit=4).limit)
+        limiter = AdaptiveLimiter(max_limit=10, min_limit=3, initial_limit=1)
+        self.assertEqual(3, limiter.limit)
+
+    def test_multiplicative_decrease(self):
+        limiter = AdaptiveLimiter(max_limit=8)
+        limiter.limit = 8
+        generation = limiter.generation
+        limiter.on_throttle(generation)
+        self.assertEqual(4, limiter.limit)
+        # The other calls of the same generation don't halve it again
+        limiter.on_throttle(generation)
+        self.assertEqual(4, limiter.limit)
+        limiter.on_throttle(limiter.generation)
+        self.assertEqual(2, limiter.limit)
+        limiter.on_throttle(limiter.generation)
+        limiter.on_throttle(limiter.generation)
+        self.assertEqual(1, limiter.limit)
+
+    def test_acquire_waits_for_release(self):
+        limiter = AdaptiveLimiter(max_limit=2)
+        limiter.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            limiter.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(acquired.wait(0.05))
+        limiter.release()
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+
+
+class TestAdaptiveMap(unittest.TestCase):
+    def test_cached_items_run_inline(self):
+        threads = set()
+
+        def func(item: int) -> int:
+            threads.add(threading.get_ident())
+            return item * 2
+
+        self.assertEqual([0, 2, 4, 6], adaptive_map(func, [0, 1, 2, 3], 4))
+        self.assertEqual({threading.get_ident()}, threads)
+
+    def test_remote_items_run_concurrently(self):
+        lock = threading.Lock()
+        active = 0
+        max_active = 0
+
+        def func(item: int) -> int:
+            nonlocal active, max_active
+            report_request()
+            with lock:
+                active += 1
+                max_active = max(max_active, active)
+            time.sleep(0.01 * (5 - item % 5))
+            with lock:
+                active -= 1
+            report_success()
+            return item
+
+        items = list(range(30))
+        self.assertEqual(items, adaptive_map(func, items, 4))
+        self.assertGreater(max_active, 1)
+        self.assertLessEqual(max_active, 4)
+
+    def test_throttling_limits_concurrency(self):
+        lock = threading.Lock()
+        active = 0
+        # Concurrency seen by every item
+        item_active: dict[int, int] = {}
+
+        def func(item: int) -> int:
+            nonlocal active
+            report_request()
+            with lock:
+                active += 1
+                item_active[item] = active
+            time.sleep(0.001)
+            with lock:
+                active -= 1
+            report_throttle()
+            return item
+
+        adaptive_map(func, list(range(20)), 4)
+        # Starts at the initial limit and halves down to one
+        self.assertGreater(max(item_active.values()), 1)
+        self.assertEqual([1] * 10, [item_active[item] for item in range(10, 20)])
+
+    def test_error(self):
+        def func(item: int) -> int:
+            report_request()
+            report_success()
+            if item == 7:
+                raise Exception("broken item")
+            return item
+
+        with self.assertRaisesRegex(Exception, "broken item"):
+            adaptive_map(func, list(range(20)), 4)
@@ -0,0 +1,42 @@
+import os
+import unittest
+import tempfile
+from quiz_dataset_tools.constants import DOMAINS
+from quiz_dataset_tools.util.domains import get_domains_list, run_domains
+
+
+def write_domain(domain: str, output_dir: str) -> None:
+    if domain == "broken":
+        raise Exception("broken domain")
+    with open(os.path.join(output_dir, domain), "w") as fd:
+        fd.write(str(os.getpid()))
+
+
+class TestDomains(unittest.TestCase):
+    def test_get_domains_list(self):
+        self.assertEqual(DOMAINS, get_domains_list("all"))
+        self.assertEqual(["bc", "on"], get_domains_list("bc, on"))
+        self.assertEqual(["on"], get_domains_list("on"))
+        with self.assertRaises(Exception):
+            get_domains_list(",")
+
+    def test_run_domains(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            results = run_domains(
+                write_domain, ["bc", "broken", "on"], 2, output_dir=output_dir
+            )
+            self.assertEqual(["bc", "broken", "on"], [r.domain for r in results])
+            self.assertEqual([None, "broken domain", None], [r.error for r in results])
+            self.assertEqual(["bc", "on"], sorted(os.listdir(output_dir)))
+            with open(os.path.join(output_dir, "bc")) as fd:
+                self.assertNotEqual(str(os.getpid()), fd.read())
+
+    def test_run_single_domain(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            results = run_domains(write_domain, ["on"], 2, output_dir=output_dir)
+            self.assertEqual([None], [r.error for r in results])
+            # A single domain runs in this process
+            with open(os.path.join(output_dir, "on")) as fd:
+                self.assertEqual(str(os.getpid()), fd.read())
+            with self.assertRaisesRegex(Exception, "broken domain"):
+                run_domains(write_domain, ["broken"], 2, output_dir=output_dir)
@@ -0,0 +1,94 @@
+import unittest
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import patch
+import httpx
+from openai import RateLimitError
+from quiz_dataset_tools.util.gpt import (
+    GPTMetrics,
+    GPTService,
+    GPTServiceWithCache,
+    estimate_prompt_tokens,
+    get_gpt_metrics,
+    get_retry_delay,
+    make_messages,
+    set_rate_limiter,
+)
+from quiz_dataset_tools.util.rate_limit import RateLimiter
+
+
+def make_completion(content: str):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))]
+    )
+
+
+class TestGPTMetrics(unittest.TestCase):
+    def test_subtract(self):
+        self.assertEqual(
+            GPTMetrics(prompts=2, cache_hits=1),
+            GPTMetrics(prompts=5, cache_hits=3, requests=1)
+            - GPTMetrics(prompts=3, cache_hits=2, requests=1),
+        )
+
+    @patch("quiz_dataset_tools.util.gpt.client")
+    def test_service_counters(self, client):
+        client.chat.completions.create.side_effect = [
+            Exception("timeout"),
+            make_completion("pong"),
+        ]
+        before = get_gpt_metrics().get("test-service", GPTMetrics())
+        service = GPTService("model", retry_delay=0, metrics_name="test-service")
+        self.assertEqual("pong", service.send_prompt("ping"))
+        usage = get_gpt_metrics()["test-service"] - before
+        self.assertEqual(GPTMetrics(requests=2, retries=1), usage)
+
+    @patch("quiz_dataset_tools.util.gpt.client")
+    def test_cache_counters(self, client):
+        client.chat.completions.create.return_value = make_completion("pong")
+        before = get_gpt_metrics().get("test-cache", GPTMetrics())
+        service = GPTServiceWithCache("test-cache", "model")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with patch(
+                "quiz_dataset_tools.util.cache.StringCache.CACHE_FILE_TEMPL",
+                tmpdir + "/{}/{}.cache",
+            ):
+                for _ in range(3):
+                    self.assertEqual("pong", service.send_prompt("ping"))
+        usage = get_gpt_metrics()["test-cache"] - before
+        self.assertEqual(GPTMetrics(prompts=3, cache_hits=2, requests=1), usage)
+
+
+class TestRateLimit(unittest.TestCase):
+    def tearDown(self):
+        set_rate_limiter(None)
+
+    def test_estimate_prompt_tokens(self):
+        messages = make_messages("x" * 400, system_prompt="y" * 40)
+        self.assertEqual(4 + 101 + 4 + 11, estimate_prompt_tokens(messages))
+
+    def test_retry_delay(self):
+        for attempt, low in [(1, 1.0), (2, 2.0), (3, 4.0), (10, 30.0)]:
+            delay = get_retry_delay(1.0, attempt)
+            self.assertGreaterEqual(delay, low)
+            self.assertLessEqual(delay, low + 1.0)
+        self.assertEqual(0, get_retry_delay(0, 3))
+
+    @patch("quiz_dataset_tools.util.gpt.client")
+    def test_service_retry_after(self, client):
+        response = httpx.Response(
+            429,
+            headers={"retry-after": "0.01"},
+            request=httpx.Request("POST", "https://api.openai.com/v1/chat"),
+        )
+        client.chat.completions.create.side_effect = [
+            RateLimitError("Rate limit", response=response, body=None),
+            make_completion("pong"),
+        ]
+        rate_limiter = RateLimiter(rpm=100)
+        set_rate_limiter(rate_limiter)
+        service = GPTService("model", retry_delay=100)
+        self.assertEqual("pong", service.send_prompt("ping"))
+        self.assertGreater(rate_limiter.state.blocked_until, 0)
+        # Both attempts are counted
+        self.assertAlmostEqual(98, rate_limiter.state.requests, delta=0.1)
@@ -0,0 +1,103 @@
+import json
+import os
+import shutil
+import unittest
+import tempfile
+from unittest.mock import patch
+from quiz_dataset_tools.util.gpt import GPTServiceWithCache, set_batch
+from quiz_dataset_tools.util.gpt_batch import (
+    BatchBackend,
+    GPTBatch,
+    LocalBatchBackend,
+)
+
+
+def echo(body: dict) -> str:
+    return "echo: " + body["messages"][0]["content"][0]["text"]
+
+
+class FailingBatchBackend(BatchBackend):
+    def run(self, input_path: str, output_path: str) -> None:
+        with open(input_path) as input_fd, open(output_path, "w") as output_fd:
+            for line in input_fd:
+                result = {
+                    "custom_id": json.loads(line)["custom_id"],
+                    "response": None,
+                    "error": {"code": "server_error", "message": "Failed"},
+                }
+                output_fd.write(json.dumps(result) + "\n")
+
+
+class TestGPTBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for name, templ in [
+            ("CACHE_FILE_TEMPL", "/{}/{}.cache"),
+            ("CACHE_FILE_TEMP_TEMPL", "/{}/{}.cache.tmp"),
+        ]:
+            patcher = patch(
+                f"quiz_dataset_tools.util.cache.StringCache.{name}",
+                self.tmpdir + templ,
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch("quiz_dataset_tools.util.gpt.client")
+        self.client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.chat.completions.create.side_effect = Exception("Not batched")
+        self.service = GPTServiceWithCache("test-batch", "model")
+
+    def tearDown(self):
+        set_batch(None)
+        shutil.rmtree(self.tmpdir)
+
+    def collect(self, prompts: list[str]) -> GPTBatch:
+        batch = GPTBatch()
+        set_batch(batch)
+        try:
+            for prompt in prompts:
+                self.service.send_prompt(prompt)
+        finally:
+            set_batch(None)
+        return batch
+
+    def test_collect_and_ingest(self):
+        batch = GPTBatch()
+        set_batch(batch)
+        self.assertEqual(["", "", ""], [self.service.send_prompt(p) for p in "aba"])
+        set_batch(None)
+        self.assertEqual(2, len(batch))
+
+        batch_dir = os.path.join(self.tmpdir, "batch")
+        self.assertEqual(2, batch.submit(LocalBatchBackend(echo), batch_dir))
+        self.assertEqual("echo: a", self.service.send_prompt("a"))
+        self.assertEqual("echo: b", self.service.send_prompt("b"))
+        self.client.chat.completions.create.assert_not_called()
+        # Results are saved with the cache
+        self.assertTrue(os.path.exists(f"{self.tmpdir}/test-batch/model.cache"))
+
+        # Cached prompts are not collected again
+        batch = self.collect(["a", "c"])
+        self.assertEqual(["c"], [request.cache_key for request in batch.requests])
+
+    def test_input_format(self):
+        batch = self.collect(["a"])
+        batch_dir = os.path.join(self.tmpdir, "batch")
+        batch.submit(LocalBatchBackend(echo), batch_dir)
+        [input_file] = [f for f in os.listdir(batch_dir) if ".input." in f]
+        with open(os.path.join(batch_dir, input_file)) as fd:
+            [line] = [json.loads(line) for line in fd]
+        self.assertEqual("0", line["custom_id"])
+        self.assertEqual("/v1/chat/completions", line["url"])
+        self.assertEqual("model", line["body"]["model"])
+
+    def test_failed_requests(self):
+        batch = self.collect(["a"])
+        batch_dir = os.path.join(self.tmpdir, "batch")
+        with self.assertLogs("quiz_dataset_tools.util.gpt_batch", "WARNING"):
+            self.assertEqual(0, batch.submit(FailingBatchBackend(), batch_dir))
+        self.assertIsNone(self.service.cache.get("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
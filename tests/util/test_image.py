@@ -0,0 +1,68 @@
+import base64
+import os
+import unittest
+import tempfile
+from io import BytesIO
+from unittest.mock import patch
+from PIL import Image
+from quiz_dataset_tools.util import image
+from quiz_dataset_tools.util.image import load_image_as_base64
+
+
+def decode(payload: str) -> Image.Image:
+    return Image.open(BytesIO(base64.b64decode(payload)))
+
+
+class TestLoadImageAsBase64(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.image_path = os.path.join(self.tmpdir.name, "image.png")
+        Image.new("RGBA", (2000, 1000), (200, 10, 10, 255)).save(self.image_path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_downscale(self):
+        img = decode(load_image_as_base64(self.image_path))
+        self.assertEqual("JPEG", img.format)
+        self.assertEqual((1024, 512), img.size)
+        img = decode(load_image_as_base64(self.image_path, max_size=4096))
+        # Never scaled up
+        self.assertEqual((2000, 1000), img.size)
+
+    def test_quality(self):
+        Image.effect_noise((512, 512), 64).save(self.image_path)
+        high = load_image_as_base64(self.image_path, quality=95)
+        low = load_image_as_base64(self.image_path, quality=20)
+        self.assertLess(len(low), len(high))
+
+    def test_memoized_by_content(self):
+        with patch.object(image.Image, "open", wraps=Image.open) as image_open:
+            first = load_image_as_base64(self.image_path, max_size=300)
+            self.assertEqual(first, load_image_as_base64(self.image_path, max_size=300))
+            self.assertEqual(1, image_open.call_count)
+
+            # Same content under another name
+            other_path = os.path.join(self.tmpdir.name, "other.png")
+            with open(self.image_path, "rb") as src, open(other_path, "wb") as dst:
+                dst.write(src.read())
+            self.assertEqual(first, load_image_as_base64(other_path, max_size=300))
+            self.assertEqual(1, image_open.call_count)
+
+            Image.new("RGB", (600, 600), (10, 10, 200)).save(self.image_path)
+            self.assertNotEqual(
+                first, load_image_as_base64(self.image_path, max_size=300)
+            )
+            self.assertEqual(2, image_open.call_count)
+
+    def test_image_options(self):
+        image.set_image_options(256, 50)
+        try:
+            img = decode(load_image_as_base64(self.image_path))
+        finally:
+            image.set_image_options(image.IMAGE_MAX_SIZE, image.IMAGE_QUALITY)
+        self.assertEqual((256, 128), img.size)
+
+
+if __name__ == "__main__":
+    unittest.main()
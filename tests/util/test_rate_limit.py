@@ -0,0 +1,42 @@
+import os
+import pickle
+import unittest
+import tempfile
+from quiz_dataset_tools.util.rate_limit import RateLimiter
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_requests_per_minute(self):
+        limiter = RateLimiter(rpm=60)
+        for _ in range(60):
+            self.assertEqual(0, limiter.reserve(1))
+        # One request per second after the burst, the waits queue up
+        self.assertAlmostEqual(1.0, limiter.reserve(1), delta=0.1)
+        self.assertAlmostEqual(2.0, limiter.reserve(1), delta=0.1)
+
+    def test_tokens_per_minute(self):
+        limiter = RateLimiter(tpm=6000)
+        self.assertEqual(0, limiter.reserve(6000))
+        self.assertAlmostEqual(30.0, limiter.reserve(3000), delta=0.1)
+        # Over the limit prompts take the full bucket
+        self.assertAlmostEqual(90.0, limiter.reserve(100000), delta=0.1)
+
+    def test_pause(self):
+        limiter = RateLimiter(rpm=60)
+        limiter.pause(5.0)
+        self.assertAlmostEqual(5.0, limiter.reserve(1), delta=0.1)
+
+    def test_shared_state(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_path = os.path.join(tmpdir, "rate_limit.json")
+            limiter = RateLimiter(rpm=2, state_path=state_path)
+            other = pickle.loads(pickle.dumps(limiter))
+            self.assertEqual(0, limiter.reserve(1))
+            self.assertEqual(0, other.reserve(1))
+            self.assertAlmostEqual(30.0, limiter.reserve(1), delta=0.1)
+            other.pause(100.0)
+            self.assertAlmostEqual(100.0, limiter.reserve(1), delta=0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import tempfile
+from sqlalchemy import create_engine
+from quiz_dataset_tools.util.sqlite import SqlitePragmas
+
+
+class TestSqlitePragmas(unittest.TestCase):
+    def test_defaults(self):
+        pragmas = SqlitePragmas.from_str("")
+        self.assertEqual(SqlitePragmas(), pragmas)
+        self.assertEqual("WAL", pragmas.journal_mode)
+
+    def test_from_str(self):
+        pragmas = SqlitePragmas.from_str("synchronous=FULL, busy_timeout=5000")
+        self.assertEqual("FULL", pragmas.synchronous)
+        self.assertEqual(5000, pragmas.busy_timeout)
+        self.assertEqual("WAL", pragmas.journal_mode)
+
+    def test_from_str_unknown(self):
+        with self.assertRaises(Exception):
+            SqlitePragmas.from_str("foo=1")
+        with self.assertRaises(Exception):
+            SqlitePragmas.from_str("synchronous")
+
+    def test_from_str_bad_values(self):
+        self.assertEqual("FULL", SqlitePragmas.from_str("synchronous=full").synchronous)
+        with self.assertRaisesRegex(Exception, "Bad sqlite synchronous"):
+            SqlitePragmas.from_str("synchronous=FULL; DROP TABLE Text")
+        with self.assertRaisesRegex(Exception, "Bad sqlite journal_mode"):
+            SqlitePragmas.from_str("journal_mode=WALL")
+        with self.assertRaisesRegex(Exception, "Bad sqlite pragma value"):
+            SqlitePragmas.from_str("busy_timeout=5s")
+        with self.assertRaisesRegex(Exception, "Bad sqlite cache_size"):
+            SqlitePragmas(cache_size="1; x").apply(create_engine("sqlite://"))  # type: ignore[arg-type]
+
+    def test_apply(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            engine = create_engine(f"sqlite:///{tmpdir}/test.db")
+            SqlitePragmas(busy_timeout=1234).apply(engine)
+            with engine.connect() as connection:
+                self.assertEqual(
+                    "wal",
+                    connection.exec_driver_sql("PRAGMA journal_mode").scalar(),
+                )
+                self.assertEqual(
+                    1234,
+                    connection.exec_driver_sql("PRAGMA busy_timeout").scalar(),
+                )
+                # NORMAL
+                self.assertEqual(
+                    1,
+                    connection.exec_driver_sql("PRAGMA synchronous").scalar(),
+                )
+            engine.dispose()